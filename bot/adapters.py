@@ -1,10 +1,58 @@
-from bot.cache import RedisCache
-from bot.cache.cache_proxy import CacheProxy
+from bot import settings
+from bot.cache import MemoryCache, MmapCache, RedisCache, TieredCache
+from bot.cache.cache_proxy import CacheProxy, minimal_date
 from bot.cache.adapters import StrCacheAdapter
 
 from bot.currency import Currency
+from bot.matrix import RateMatrix
+from bot.responses import ResponseCache
 
 
-default_cache = StrCacheAdapter(RedisCache(Currency, __name__),
-                                Currency)
+def bank_minimal_date(bank_short_name: str):
+    """First date of the bank's rates, start of its rate files"""
+    from bot import utils
+    from bot.exceptions import BotParserLookupError
+    try:
+        return minimal_date(utils.get_parser(bank_short_name))
+    except BotParserLookupError:
+        return None
+
+
+def create_cache():
+    if settings.CACHE_BACKEND == 'mmap':
+        return MmapCache(settings.MMAP_CACHE_DIR,
+                         base_date=bank_minimal_date)
+    if settings.CACHE_BACKEND == 'memory':
+        return MemoryCache(max_items=settings.MEMORY_CACHE_MAX_ITEMS,
+                           max_bytes=settings.MEMORY_CACHE_MAX_BYTES)
+    cache = RedisCache(Currency, __name__)
+    if settings.LOCAL_CACHE_SIZE > 0:
+        cache = TieredCache(cache, size=settings.LOCAL_CACHE_SIZE,
+                            ttl=settings.LOCAL_CACHE_TTL)
+    return cache
+
+
+def create_user_store():
+    """
+    Cache keeping users' subscriptions and alerts. They must be seen
+    by all of the processes and never evicted, so only redis (without
+    the in-process tier) qualifies, None for other backends.
+    """
+    cache = default_cache.cache
+    if isinstance(cache, TieredCache):
+        cache = cache.backend
+    return cache if isinstance(cache, RedisCache) else None
+
+
+default_cache = StrCacheAdapter(create_cache(), Currency)
+user_store = create_user_store()
 cache_proxy = CacheProxy(default_cache)
+
+# Today's rates of all banks, kept up to date by the cache proxy
+rate_matrix = RateMatrix()
+cache_proxy.add_snapshot_listener(rate_matrix.on_snapshot)
+
+# Rendered /course texts, dropped when the bank's rates change
+rendered_responses = ResponseCache(settings.RESPONSE_CACHE_SIZE,
+                                   ttl=settings.RESPONSE_CACHE_TTL)
+cache_proxy.add_snapshot_listener(rendered_responses.on_snapshot)
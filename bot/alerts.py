@@ -0,0 +1,327 @@
+"""
+Threshold alerts: "tell me when USD sell rate at bgp drops below 2.05".
+
+Thresholds are indexed per (bank, currency, side) in sorted lists.
+When today's rates of a bank are refreshed, the rate moving from old
+to new value triggers only alerts whose thresholds lie between the
+two, found by bisection, so the cost of a refresh does not depend
+on the total number of alerts.
+
+Alerts are kept in redis (they are disabled with other cache
+backends) along with a log of changes: every process keeps its own
+index and applies changes made by the others, the whole set of alerts
+is loaded on start only or once the log is missing some changes. An
+alert fires once and is removed; changes are made under a lock shared
+by the processes, so only one of them sends it.
+"""
+
+import bisect
+import datetime
+import json
+import logging
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from bot import metrics
+from bot.adapters import cache_proxy, user_store
+from bot.cache.base import AbstractCache
+from bot.cache.cache_proxy import effective_date
+from bot.currency import Currency
+from bot.exceptions import BotLoggedError
+
+logger = logging.getLogger('telegrambot')
+
+ALERT_KEY = 'alert:{}'
+# Number of the latest change and the changes by their numbers
+CHANGE_SEQ_KEY = 'alerts:seq'
+CHANGE_KEY = 'alerts:change:{}'
+CHANGES_LOCK = 'lock:alerts'
+# Processes lagging behind more are reloading all of the alerts
+CHANGE_TTL = 24 * 60 * 60
+MAX_CHANGES_BEHIND = 1000
+ADD, REMOVE = 'add', 'remove'
+SIDES = ('buy', 'sell')
+BELOW, ABOVE = 'below', 'above'
+
+# Dummy method for later localization
+_ = lambda x: x
+
+IndexKey = Tuple[str, str, str]
+
+
+class Alert(object):
+
+    def __init__(self, alert_id: str, chat_id: int, bank: str, iso: str,
+                 side: str, direction: str, threshold: float) -> None:
+        self.id = alert_id
+        self.chat_id = chat_id
+        self.bank = bank
+        self.iso = iso.upper()
+        self.side = side
+        self.direction = direction
+        self.threshold = threshold
+
+    @property
+    def index_key(self) -> IndexKey:
+        return self.bank, self.iso, self.side
+
+    def to_json(self) -> str:
+        return json.dumps([self.chat_id, self.bank, self.iso, self.side,
+                           self.direction, self.threshold])
+
+    @classmethod
+    def from_json(cls, alert_id: str, value) -> 'Alert':
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return cls(alert_id, *json.loads(value))
+
+    def describe(self) -> str:
+        return _("{iso} {side} at {bank} {direction} {threshold}").format(
+            iso=self.iso, side=self.side, bank=self.bank,
+            direction=self.direction, threshold=self.threshold)
+
+    def __repr__(self) -> str:
+        return "Alert({}: {})".format(self.id, self.describe())
+
+
+class AlertIndex(object):
+    """Thresholds of every (bank, currency, side) kept sorted,
+    separately for alerts on falling and rising rates"""
+
+    def __init__(self, alerts: Iterable[Alert]=()) -> None:
+        # key -> (sorted thresholds, alerts in the same order)
+        self._index = {BELOW: {}, ABOVE: {}}
+        for alert in alerts:
+            self.add(alert)
+
+    def add(self, alert: Alert) -> None:
+        thresholds, alerts = self._index[alert.direction].setdefault(
+            alert.index_key, ([], []))
+        i = bisect.bisect_right(thresholds, alert.threshold)
+        thresholds.insert(i, alert.threshold)
+        alerts.insert(i, alert)
+
+    def remove(self, alert: Alert) -> None:
+        entry = self._index[alert.direction].get(alert.index_key)
+        if entry is None:
+            return
+        thresholds, alerts = entry
+        lo = bisect.bisect_left(thresholds, alert.threshold)
+        hi = bisect.bisect_right(thresholds, alert.threshold)
+        for i in range(lo, hi):
+            if alerts[i].id == alert.id:
+                del thresholds[i]
+                del alerts[i]
+                return
+
+    def crossed(self, bank: str, iso: str, side: str,
+                old: float, new: float) -> List[Alert]:
+        """Alerts whose thresholds the rate crossed moving from old
+        to new: falling below thresholds in (new, old] or rising above
+        thresholds in [old, new)"""
+        key = (bank, iso.upper(), side)
+        if new < old:
+            entry = self._index[BELOW].get(key)
+            if entry is None:
+                return []
+            lo = bisect.bisect_right(entry[0], new)
+            hi = bisect.bisect_right(entry[0], old)
+        elif new > old:
+            entry = self._index[ABOVE].get(key)
+            if entry is None:
+                return []
+            lo = bisect.bisect_left(entry[0], old)
+            hi = bisect.bisect_left(entry[0], new)
+        else:
+            return []
+        return entry[1][lo:hi]
+
+    def __len__(self):
+        return sum(len(thresholds)
+                   for by_key in self._index.values()
+                   for thresholds, _ in by_key.values())
+
+
+class AlertManager(object):
+    """
+    Stores alerts in cache and triggers them from cache proxy
+    snapshots, messages are sent with `send(chat_id, text)`.
+    """
+
+    def __init__(self, cache: AbstractCache,
+                 send: Callable[[int, str], object]=None) -> None:
+        self.cache = cache
+        self.send = send
+        # Guards the index, alerts and rates
+        self._lock = threading.Lock()
+        # Only one thread at a time brings the index up to date
+        self._sync_lock = threading.Lock()
+        self._index = AlertIndex()
+        self._alerts = {}  # type: Dict[str, Alert]
+        # Number of the latest applied change, None until loaded
+        self._seq = None
+        # Last seen rate of every (bank, currency, side)
+        self._rates = {}  # type: Dict[IndexKey, float]
+
+    def _read_seq(self) -> int:
+        """Number of the latest change, None if cache is unavailable"""
+        value = self.cache.get(CHANGE_SEQ_KEY)
+        if value is None:
+            return 0 if self.cache.is_available else None
+        return int(value)
+
+    def _log_change(self, op: str, alert: Alert) -> None:
+        """Appends change to the log, CHANGES_LOCK must be held"""
+        seq = (self._read_seq() or 0) + 1
+        self.cache.put(CHANGE_KEY.format(seq),
+                       json.dumps([op, alert.id, alert.to_json()]),
+                       expire=CHANGE_TTL)
+        self.cache.put(CHANGE_SEQ_KEY, str(seq))
+
+    def _read_changes(self, first: int, last: int) -> List[Tuple[str, Alert]]:
+        """Changes first..last, None if some of them are missing"""
+        if last - first >= MAX_CHANGES_BEHIND:
+            return None
+        values = self.cache.get_many([CHANGE_KEY.format(seq)
+                                      for seq in range(first, last + 1)])
+        changes = []
+        for value in values:
+            if value is None:
+                return None
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            op, alert_id, alert = json.loads(value)
+            changes.append((op, Alert.from_json(alert_id, alert)))
+        return changes
+
+    def _load(self) -> List[Alert]:
+        prefix = ALERT_KEY.format('')
+        return [Alert.from_json(key[len(prefix):], value)
+                for key, value, expires_at
+                in self.cache.iter_items(match=prefix + '*')]
+
+    def _add_alert(self, alert: Alert) -> None:
+        if alert.id not in self._alerts:
+            self._alerts[alert.id] = alert
+            self._index.add(alert)
+
+    def _remove_alert(self, alert: Alert) -> None:
+        if self._alerts.pop(alert.id, None) is not None:
+            self._index.remove(alert)
+
+    def sync(self) -> None:
+        """Applies changes made since the last sync, alerts are
+        reloaded if the log misses some of them"""
+        seq = self._read_seq()
+        if seq is None:
+            # Index is kept until the cache is back
+            return
+        with self._sync_lock:
+            if seq == self._seq:
+                return
+            changes = None
+            if self._seq is not None and seq > self._seq:
+                changes = self._read_changes(self._seq + 1, seq)
+            if changes is not None:
+                with self._lock:
+                    for op, alert in changes:
+                        if op == ADD:
+                            self._add_alert(alert)
+                        else:
+                            self._remove_alert(alert)
+                    self._seq = seq
+                return
+            alerts = self._load()
+            if not self.cache.is_available:
+                # Alerts may be missing, loaded again next time
+                return
+            index = AlertIndex(alerts)
+            with self._lock:
+                self._index = index
+                self._alerts = {alert.id: alert for alert in alerts}
+                self._seq = seq
+            logger.info("Loaded {} alerts".format(len(alerts)))
+
+    def add(self, chat_id: int, bank: str, iso: str, side: str,
+            direction: str, threshold: float) -> Alert:
+        if side not in SIDES or direction not in (BELOW, ABOVE):
+            raise ValueError("Unknown alert: {} {}".format(side, direction))
+        alert = Alert(uuid.uuid4().hex[:12], chat_id, bank, iso,
+                      side, direction, threshold)
+        with self.cache.lock(CHANGES_LOCK) as acquired:
+            if not acquired:
+                raise BotLoggedError(_("Alerts are unavailable now, "
+                                       "please try later"))
+            self.cache.put(ALERT_KEY.format(alert.id), alert.to_json())
+            self._log_change(ADD, alert)
+        return alert
+
+    def alerts_of(self, chat_id: int) -> List[Alert]:
+        self.sync()
+        with self._lock:
+            return [alert for alert in self._alerts.values()
+                    if alert.chat_id == chat_id]
+
+    def clear(self, chat_id: int) -> int:
+        """Removes all of the chat's alerts, returns their number"""
+        alerts = self.alerts_of(chat_id)
+        if not alerts:
+            return 0
+        with self.cache.lock(CHANGES_LOCK) as acquired:
+            if not acquired:
+                raise BotLoggedError(_("Alerts are unavailable now, "
+                                       "please try later"))
+            for alert in alerts:
+                self.cache.delete(ALERT_KEY.format(alert.id))
+                self._log_change(REMOVE, alert)
+        return len(alerts)
+
+    def on_snapshot(self, parser, date: datetime.date,
+                    currencies: Iterable[Currency],
+                    complete: bool) -> None:
+        """Snapshot listener to be registered with CacheProxy, rates
+        in effect today are published on the bank's effective date"""
+        if date != effective_date(parser, datetime.date.today()):
+            return
+        self.sync()
+        triggered = []
+        with self._lock:
+            for currency in currencies:
+                for side in SIDES:
+                    new = getattr(currency, side)
+                    if not new:
+                        continue
+                    key = (parser.short_name, currency.iso.upper(), side)
+                    old = self._rates.get(key)
+                    self._rates[key] = new
+                    if old is None:
+                        continue
+                    triggered.extend(
+                        (alert, new) for alert in
+                        self._index.crossed(*key, old=old, new=new))
+        for alert, rate in triggered:
+            self._fire(alert, rate)
+
+    def _fire(self, alert: Alert, rate: float) -> None:
+        key = ALERT_KEY.format(alert.id)
+        with self.cache.lock(CHANGES_LOCK) as acquired:
+            # Other process could have sent it already
+            if not acquired or self.cache.get(key) is None:
+                return
+            self.cache.delete(key)
+            self._log_change(REMOVE, alert)
+        with self._lock:
+            self._remove_alert(alert)
+        metrics.ALERTS_TRIGGERED.inc(bank=alert.bank)
+        if self.send is None:
+            logger.warning("Alert {} fired with no sender".format(alert.id))
+            return
+        self.send(alert.chat_id, _("Alert: {alert}, now {rate}").format(
+            alert=alert.describe(), rate=rate))
+
+
+# Alerts must be shared by the processes and never evicted
+alert_manager = AlertManager(user_store) if user_store is not None else None
+if alert_manager is not None:
+    cache_proxy.add_snapshot_listener(alert_manager.on_snapshot)
@@ -0,0 +1,204 @@
+"""
+Loads historical exchange rates of the given banks into the cache
+ahead of user requests.
+
+Dates are walked from the newest to the oldest in chunks, progress
+is saved to a checkpoint file after every chunk, so an interrupted
+run continues where it stopped.
+
+    python -m bot.backfill -b nbrb bgp -c USD EUR --start 2010-01-01
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from bot import settings
+from bot import utils
+from bot.adapters import cache_proxy, default_cache
+from bot.cache.cache_proxy import CacheProxy, effective_date, minimal_date
+from bot.exceptions import BotBankUnavailableError, BotLoggedError
+from bot.fetch import FetchExecutor
+
+logger = logging.getLogger('telegrambot')
+
+DATE_FORMAT = '%Y-%m-%d'
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT = os.path.join(settings.BASE_DIR, 'backfill.json')
+
+
+class Checkpoint(object):
+    """Oldest fully loaded date of every backfill job, stored as JSON"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._progress = {}  # type: Dict[str, str]
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') == CHECKPOINT_VERSION:
+                self._progress = data.get('progress', {})
+
+    def get(self, job: str) -> datetime.date:
+        value = self._progress.get(job)
+        if value is None:
+            return None
+        return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+    def set(self, job: str, date: datetime.date) -> None:
+        self._progress[job] = date.strftime(DATE_FORMAT)
+        self.save()
+
+    def save(self) -> None:
+        data = {'version': CHECKPOINT_VERSION, 'progress': self._progress}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def job_name(parser, currencies: Sequence[str]) -> str:
+    return '{}:{}'.format(parser.short_name, ','.join(currencies) or '*')
+
+
+def publication_dates(parser,
+                      start: datetime.date,
+                      end: datetime.date) -> List[datetime.date]:
+    """Distinct publication dates between start and end, newest first"""
+    dates = []
+    date = end
+    while date >= start:
+        published = effective_date(parser, date)
+        if published >= start and (not dates or published < dates[-1]):
+            dates.append(published)
+        date = published - datetime.timedelta(days=1)
+    return dates
+
+
+def chunks(items: Sequence, size: int) -> Iterator[Sequence]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def fetch_rates(parser,
+                date: datetime.date,
+                currencies: Sequence[str]) -> Tuple[datetime.date, list]:
+    """All or the selected rates of the bank for the date"""
+    table = parser.get_all_currencies(date)
+    if currencies:
+        wanted = set(currencies)
+        table = [c for c in table if c.iso.upper() in wanted]
+    return date, list(table)
+
+
+def is_cached(proxy: CacheProxy, parser,
+              currencies: Sequence[str],
+              dates: Sequence[datetime.date]) -> Dict[datetime.date, bool]:
+    """Dates having all of the currencies cached already"""
+    if not currencies:
+        return {}
+    cached = {date: True for date in dates}
+    for currency in currencies:
+        found = proxy.get_cached_currencies(parser, currency, dates)
+        for date in dates:
+            cached[date] = cached[date] and date in found
+    return cached
+
+
+def backfill_bank(parser,
+                  currencies: Sequence[str],
+                  start: datetime.date,
+                  end: datetime.date,
+                  checkpoint: Checkpoint,
+                  executor: FetchExecutor,
+                  proxy: CacheProxy=cache_proxy,
+                  chunk_size: int=64) -> int:
+    """Loads rates of the bank into cache, returns number of cached rows"""
+    job = job_name(parser, currencies)
+    done_until = checkpoint.get(job)
+    if done_until is not None:
+        end = min(end, done_until - datetime.timedelta(days=1))
+    min_date = minimal_date(parser)
+    if min_date is not None:
+        start = max(start, min_date)
+    dates = publication_dates(parser, start, end)
+    logger.info("Backfilling {}: {} dates from {} to {}".format(
+        job, len(dates), end, start))
+
+    rows = 0
+    started = time.time()
+    for chunk in chunks(dates, chunk_size):
+        cached = is_cached(proxy, parser, currencies, chunk)
+        futures = [executor.submit(fetch_rates, parser, date, currencies)
+                   for date in chunk if not cached.get(date)]
+        results = [future.result() for future in futures]
+
+        items = [(date, currency) for date, table in results
+                 for currency in table]
+        rows += proxy.cache_currencies(parser, items)
+        for date, table in results:
+            fetched = set(c.iso.upper() for c in table)
+            for currency in currencies:
+                if currency not in fetched:
+                    proxy.cache_missing(parser, currency, date)
+
+        checkpoint.set(job, chunk[-1])
+        elapsed = time.time() - started
+        logger.info("{}: loaded down to {}, {} rows, {:.1f} rows/s".format(
+            job, chunk[-1], rows, rows / elapsed if elapsed else 0.0))
+    return rows
+
+
+def parse_date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    arg_parser.add_argument('-b', '--banks', nargs='+', required=True,
+                            help='Bank names or short names')
+    arg_parser.add_argument('-c', '--currencies', nargs='*', default=[],
+                            help='Currencies to load, all if omitted')
+    arg_parser.add_argument('--start', type=parse_date,
+                            default=datetime.date(1990, 1, 1),
+                            help='Oldest date, bank minimal date by default')
+    arg_parser.add_argument('--end', type=parse_date,
+                            default=(datetime.date.today() -
+                                     datetime.timedelta(days=1)))
+    arg_parser.add_argument('-w', '--workers', type=int,
+                            default=settings.FETCH_WORKERS)
+    arg_parser.add_argument('--chunk', type=int, default=64,
+                            help='Dates loaded between checkpoints')
+    arg_parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT)
+    args = arg_parser.parse_args(argv)
+
+    currencies = [c.upper() for c in args.currencies]
+    checkpoint = Checkpoint(args.checkpoint)
+    executor = FetchExecutor(max_workers=args.workers,
+                             max_queue_depth=args.chunk)
+    started = time.time()
+    total = 0
+    try:
+        for bank in args.banks:
+            parser = utils.get_parser(bank)(cache=default_cache)
+            try:
+                total += backfill_bank(parser, currencies,
+                                       args.start, args.end,
+                                       checkpoint, executor,
+                                       chunk_size=args.chunk)
+            except (BotBankUnavailableError, BotLoggedError) as e:
+                logger.error("Backfill of {} stopped: {}".format(bank, e))
+    finally:
+        executor.shutdown()
+    elapsed = time.time() - started
+    print("Cached {} rows in {:.1f}s ({:.1f} rows/s)".format(
+        total, elapsed, total / elapsed if elapsed else 0.0))
+
+
+if __name__ == '__main__':
+    main()
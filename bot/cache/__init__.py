@@ -2,11 +2,17 @@ from .base import AbstractCache
 from .mongo import MongoCurrencyCache
 from .redis import RedisCache
 from .dict import DictionaryCache
+from .memory import MemoryCache
+from .mmap import MmapCache
+from .tiered import TieredCache
 from .adapters import StrCacheAdapter
 
 
 __all__ = ('AbstractCache',
            'DictionaryCache',
+           'MemoryCache',
+           'MmapCache',
            'MongoCurrencyCache',
            'RedisCache',
-           'StrCacheAdapter')
+           'StrCacheAdapter',
+           'TieredCache')
@@ -7,8 +7,23 @@ operations.
 """
 
 import datetime
+import json
+from typing import Any, Iterable, Sequence, Tuple
 
-from bot.cache.conf import CACHE_DATE_FORMAT
+from bot import metrics
+from bot.cache.conf import (
+    CACHE_DATE_FORMAT,
+    FETCH_LOCK_LEASE,
+    NEGATIVE_CACHE_VALUE
+)
+from bot.currency import RateTable
+
+
+def _count_bytes(bank_short_name: str, direction: str, *values) -> None:
+    size = sum(len(value) for value in values if value is not None)
+    if size:
+        metrics.CACHE_BYTES.inc(size, bank=bank_short_name.lower(),
+                                direction=direction)
 
 
 class StrCacheAdapter(object):
@@ -17,17 +32,45 @@ class StrCacheAdapter(object):
         self.cache = cache
         self.currency_cls = currency_cls
 
+    def _key(self, bank_short_name: str,
+             currency_name: str,
+             date: datetime.date) -> str:
+        str_date = date.strftime(CACHE_DATE_FORMAT)
+        return "{}_{}_{}".format(bank_short_name.lower(),
+                                 currency_name.lower(),
+                                 str_date.lower())
+
     def get_cached_value(self, bank_short_name: str,
                          currency_name: str,
                          date: datetime.date):
-        str_date = date.strftime(CACHE_DATE_FORMAT)
-        search_key = "{}_{}_{}".format(bank_short_name.lower(),
-                                       currency_name.lower(),
-                                       str_date.lower())
-        str_result = self.cache.get(search_key)
+        """
+        Returns cached currency, empty currency if the bank
+        is known to have no rates for the date or None if
+        nothing is cached
+        """
+        search_key = self._key(bank_short_name, currency_name, date)
+        value = self.cache.get(search_key)
+        _count_bytes(bank_short_name, 'read', value)
+        return self._decode(currency_name, value)
+
+    def get_cached_values(self, bank_short_name: str,
+                          currency_name: str,
+                          dates: Sequence[datetime.date]):
+        """Bulk version of get_cached_value, results are
+        in the order of the given dates"""
+        keys = [self._key(bank_short_name, currency_name, date)
+                for date in dates]
+        values = self.cache.get_many(keys)
+        _count_bytes(bank_short_name, 'read', *values)
+        return [self._decode(currency_name, value) for value in values]
+
+    def _decode(self, currency_name: str, str_result):
         if str_result is None:
             return None
-        str_result = str_result.decode('utf-8')
+        if isinstance(str_result, bytes):
+            str_result = str_result.decode('utf-8')
+        if str_result == NEGATIVE_CACHE_VALUE:
+            return self.currency_cls.empty_currency()
         buy, sell, multiplier = str_result.split(",")
         c = self.currency_cls(currency_name,
                               currency_name,
@@ -36,18 +79,88 @@ class StrCacheAdapter(object):
                               multiplier=int(multiplier))
         return c
 
+    def _snapshot_key(self, bank_short_name: str,
+                      date: datetime.date) -> str:
+        return "snapshot:{}:{}".format(bank_short_name.lower(),
+                                       date.strftime(CACHE_DATE_FORMAT))
+
+    def get_snapshot(self, bank_short_name: str,
+                     date: datetime.date,
+                     fresh: bool=False) -> Tuple[float, RateTable]:
+        """(fetched_at, rates) of the bank's rates snapshot
+        or None if nothing is cached, `fresh` skips in-process
+        copies to see snapshots written by other processes"""
+        key = self._snapshot_key(bank_short_name, date)
+        if fresh:
+            self.cache.invalidate(key)
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        _count_bytes(bank_short_name, 'read', value)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        data = json.loads(value)
+        table = RateTable(
+            (self.currency_cls(name, iso, sell=sell, buy=buy,
+                               multiplier=multiplier)
+             for iso, name, buy, sell, multiplier in data['rates']),
+            fetched_at=data['fetched_at'])
+        return data['fetched_at'], table
+
+    def cache_snapshot(self, bank_short_name: str,
+                       date: datetime.date,
+                       fetched_at: float,
+                       currencies: Iterable[Any],
+                       expire: int) -> None:
+        """Caches all of the bank's rates fetched at the given time"""
+        rates = [[c.iso, c.name, c.buy, c.sell, c.multiplier]
+                 for c in currencies]
+        value = json.dumps({'fetched_at': fetched_at, 'rates': rates})
+        _count_bytes(bank_short_name, 'written', value)
+        self.cache.put(self._snapshot_key(bank_short_name, date), value,
+                       expire=expire)
+
+    def fetch_lock(self, bank_short_name: str, date: datetime.date):
+        """Lock held while bank's rates for the date are fetched,
+        shared by all of the bot processes using the same cache"""
+        name = "lock:{}:{}".format(bank_short_name.lower(),
+                                   date.strftime(CACHE_DATE_FORMAT))
+        return self.cache.lock(name, lease=FETCH_LOCK_LEASE)
+
+    def cache_missing(self,
+                      bank_short_name: str,
+                      currency_name: str,
+                      date: datetime.date,
+                      expire: int) -> None:
+        """Remembers that the bank has no rates for the date"""
+        search_key = self._key(bank_short_name, currency_name, date)
+        _count_bytes(bank_short_name, 'written', NEGATIVE_CACHE_VALUE)
+        self.cache.put(search_key, NEGATIVE_CACHE_VALUE, expire=expire)
+
+    def _encode(self, cur_instance) -> str:
+        multiplier = 1
+        if hasattr(cur_instance, "multiplier"):
+            multiplier = cur_instance.multiplier
+        return ",".join([str(cur_instance.buy),
+                         str(cur_instance.sell),
+                         str(multiplier)])
+
     def cache_currency(self,
                        bank_short_name: str,
                        cur_instance,
                        date: datetime.date) -> None:
-        str_date = date.strftime(CACHE_DATE_FORMAT)
-        search_key = "{}_{}_{}".format(bank_short_name.lower(),
-                                       cur_instance.iso.lower(),
-                                       str_date.lower())
-        multiplier = 1
-        if hasattr(cur_instance, "multiplier"):
-            multiplier = cur_instance.multiplier
-        str_value = ",".join([str(cur_instance.buy),
-                              str(cur_instance.sell),
-                              str(multiplier)])
-        self.cache.put(search_key, str_value)
+        search_key = self._key(bank_short_name, cur_instance.iso, date)
+        value = self._encode(cur_instance)
+        _count_bytes(bank_short_name, 'written', value)
+        self.cache.put(search_key, value)
+
+    def cache_currencies(self,
+                         bank_short_name: str,
+                         items: Iterable[Tuple[datetime.date, Any]]) -> None:
+        """Caches (date, currency) pairs at once"""
+        items = [(self._key(bank_short_name, currency.iso, date),
+                  self._encode(currency))
+                 for date, currency in items]
+        _count_bytes(bank_short_name, 'written',
+                     *(value for _, value in items))
+        self.cache.put_many(items)
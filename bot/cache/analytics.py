@@ -0,0 +1,159 @@
+"""
+Offline report of the cache key space: number of keys, their size
+and covered dates per bank and currency. Redis keys are walked with
+SCAN, so the report can be run against a live instance.
+
+    python -m bot.cache.analytics
+    python -m bot.cache.analytics --match 'nbrb_*' --banks
+"""
+
+import argparse
+import datetime
+import time
+from typing import Dict, Tuple
+
+from .base import AbstractCache
+from .conf import CACHE_DATE_FORMAT, NEGATIVE_CACHE_VALUE, RATE_KEY_REGEX
+
+
+def _size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return len(value)
+
+
+class KeyGroupStats(object):
+    """Key count, size and date range of a group of keys"""
+
+    def __init__(self) -> None:
+        self.keys = 0
+        self.negative = 0
+        self.bytes = 0
+        self.first_date = None
+        self.last_date = None
+
+    def add(self, key, value, date: datetime.date=None) -> None:
+        self.keys += 1
+        self.bytes += _size(key) + _size(value)
+        if value in (NEGATIVE_CACHE_VALUE, NEGATIVE_CACHE_VALUE.encode()):
+            self.negative += 1
+        if date is None:
+            return
+        if self.first_date is None or date < self.first_date:
+            self.first_date = date
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+
+    def merge(self, other: 'KeyGroupStats') -> None:
+        self.keys += other.keys
+        self.negative += other.negative
+        self.bytes += other.bytes
+        for date in (other.first_date, other.last_date):
+            if date is None:
+                continue
+            if self.first_date is None or date < self.first_date:
+                self.first_date = date
+            if self.last_date is None or date > self.last_date:
+                self.last_date = date
+
+    @property
+    def coverage(self) -> float:
+        """Share of days between the first and the last date
+        having a key, meaningful for a single currency only"""
+        if self.first_date is None:
+            return 0.0
+        days = (self.last_date - self.first_date).days + 1
+        return min(1.0, self.keys / days)
+
+
+class KeySpaceStats(object):
+    """Rate keys grouped by (bank, currency), other keys by prefix"""
+
+    def __init__(self) -> None:
+        self.series = {}  # type: Dict[Tuple[str, str], KeyGroupStats]
+        self.other = {}  # type: Dict[str, KeyGroupStats]
+
+    def add(self, key, value) -> None:
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        match = RATE_KEY_REGEX.match(key)
+        if match is None:
+            prefix = key.split(':', 1)[0] if ':' in key else '<other>'
+            self.other.setdefault(prefix, KeyGroupStats()).add(key, value)
+            return
+        date = datetime.datetime.strptime(match.group('date'),
+                                          CACHE_DATE_FORMAT).date()
+        group = (match.group('bank'), match.group('currency'))
+        self.series.setdefault(group, KeyGroupStats()).add(key, value, date)
+
+    def by_bank(self) -> Dict[str, KeyGroupStats]:
+        banks = {}
+        for (bank, _), stats in self.series.items():
+            banks.setdefault(bank, KeyGroupStats()).merge(stats)
+        return banks
+
+    def total(self) -> KeyGroupStats:
+        total = KeyGroupStats()
+        for stats in list(self.series.values()) + list(self.other.values()):
+            total.merge(stats)
+        return total
+
+
+def analyze(cache: AbstractCache, match=None) -> KeySpaceStats:
+    stats = KeySpaceStats()
+    for key, value, _ in cache.iter_items(match=match):
+        stats.add(key, value)
+    return stats
+
+
+def _format_date(date: datetime.date) -> str:
+    return date.isoformat() if date is not None else '-'
+
+
+def format_report(stats: KeySpaceStats, by_bank: bool=False) -> str:
+    row = "{:<16} {:>8} {:>8} {:>10} {:>10}  {:<10}  {:<10}"
+    lines = [row.format('bank' if by_bank else 'bank/currency',
+                        'keys', 'negative', 'bytes', 'coverage',
+                        'first', 'last')]
+    if by_bank:
+        groups = sorted(stats.by_bank().items())
+    else:
+        groups = sorted(('{}/{}'.format(bank, currency.upper()), group)
+                        for (bank, currency), group in stats.series.items())
+    for name, group in groups:
+        coverage = '-' if by_bank else '{:.1%}'.format(group.coverage)
+        lines.append(row.format(name, group.keys, group.negative,
+                                group.bytes, coverage,
+                                _format_date(group.first_date),
+                                _format_date(group.last_date)))
+    for prefix, group in sorted(stats.other.items()):
+        lines.append(row.format(prefix + ':*', group.keys, group.negative,
+                                group.bytes, '-', '-', '-'))
+    total = stats.total()
+    lines.append(row.format('total', total.keys, total.negative,
+                            total.bytes, '-', '-', '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from bot.adapters import default_cache
+
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    arg_parser.add_argument('--match', default=None,
+                            help='Glob-style pattern of keys to include')
+    arg_parser.add_argument('--banks', action='store_true',
+                            help='Group rates by bank only')
+    args = arg_parser.parse_args(argv)
+
+    started = time.time()
+    stats = analyze(default_cache.cache, match=args.match)
+    print(format_report(stats, by_bank=args.banks))
+    print("Scanned {} keys in {:.1f}s".format(stats.total().keys,
+                                             time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,10 @@
 import abc
+import contextlib
+import threading
+
+# Process-local named locks: name -> [lock, number of users]
+_local_locks = {}
+_local_locks_guard = threading.Lock()
 
 
 class AbstractCache(object, metaclass=abc.ABCMeta):
@@ -11,17 +17,60 @@ class AbstractCache(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def put(self, key, value, key_type=None, value_type=None):
-        """Method to put item to cache"""
+    def put(self, key, value, key_type=None, value_type=None, expire=None):
+        """Method to put item to cache, item is removed after
+        `expire` seconds if it is specified"""
         pass
 
+    def get_many(self, keys, key_type=None):
+        """Returns list of values for the given keys, None
+        for the missing ones"""
+        return [self.get(key, key_type=key_type) for key in keys]
+
+    def put_many(self, items, expire=None):
+        """Puts all of the (key, value) pairs to cache"""
+        for key, value in items:
+            self.put(key, value, expire=expire)
+
+    @abc.abstractmethod
+    def iter_items(self, match=None):
+        """Iterates over (key, value, expires_at) of all of the
+        items, expires_at is unix time or None, `match` is
+        a glob-style key pattern"""
+        pass
+
+    @contextlib.contextmanager
+    def lock(self, name, lease=30):
+        """
+        Context manager holding lock with the given name. Caches
+        shared between processes make it shared as well and release
+        it after `lease` seconds even if its holder never does.
+        """
+        with _local_locks_guard:
+            entry = _local_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield True
+        finally:
+            with _local_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _local_locks[name]
+
     def delete(self, key, key_type=None):
         """Method to delete item from cache"""
         pass
 
-    def is_available(self):
+    def invalidate(self, key):
+        """Drops in-process copy of the item, if any, so that
+        the next read goes to the shared storage"""
         pass
 
+    @property
+    def is_available(self):
+        return True
+
     @classmethod
     def get_instance(cls, *args, **kwargs):
         """Naive singleton method implementation"""
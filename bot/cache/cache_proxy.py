@@ -1,23 +1,95 @@
 import datetime
+import logging
+import threading
+import time
 from typing import (
+    Iterable,
     Sequence,
+    Tuple,
 )
 
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
+from bot.exceptions import BotBankUnavailableError
+from bot.fetch import fetch_executor, FetchQueueFullError
+from bot.publication import DailyCalendar
 from bot.settings import (
     DENOMINATION_DATE,
-    DENOMINATION_MULTIPLIER
+    DENOMINATION_MULTIPLIER,
+    NEGATIVE_CACHE_TTL,
+    SNAPSHOT_HARD_TTL,
+    SNAPSHOT_SOFT_TTL,
+    SNAPSHOT_STALE_IF_ERROR
 )
 
+logger = logging.getLogger('telegrambot')
+
+
+def minimal_date(parser) -> datetime.date:
+    """Earliest date the parser has rates for, None if unknown"""
+    min_date = getattr(parser, 'MINIMAL_DATE', None)
+    if isinstance(min_date, datetime.datetime):
+        return min_date.date()
+    return min_date
+
+
+def effective_date(parser, date: datetime.date) -> datetime.date:
+    """Date the bank published rates valid for the given date"""
+    calendar = getattr(parser, 'publication_calendar', None)
+    if calendar is None:
+        calendar = DailyCalendar()
+    return calendar.effective_date(date)
+
 
 class CacheProxy(object):
     """
     Serves as a caching proxy to the given
     parser object
+
+    Rates for past dates never change and are cached forever,
+    today's rates are cached as a snapshot of all of the bank's rates
+    and served stale while they are refreshed in background.
     """
 
-    def __init__(self, cache):
+    def __init__(self, cache,
+                 negative_ttl: int=NEGATIVE_CACHE_TTL,
+                 soft_ttl: int=SNAPSHOT_SOFT_TTL,
+                 hard_ttl: int=SNAPSHOT_HARD_TTL,
+                 stale_if_error: int=SNAPSHOT_STALE_IF_ERROR,
+                 executor=fetch_executor,
+                 clock=time.time):
         self._cache = cache
+        self._negative_ttl = negative_ttl
+        self._soft_ttl = soft_ttl
+        self._hard_ttl = hard_ttl
+        self._stale_if_error = max(stale_if_error, hard_ttl)
+        self._executor = executor
+        self._clock = clock
+        backend = getattr(cache, 'cache', cache)
+        self._backend_name = type(backend).__name__
+        self._snapshot_listeners = []
+        self._lock = threading.Lock()
+        # Snapshots being refreshed in background
+        self._refreshing = set()
+        # fetched_at of the latest snapshot listeners were notified of
+        self._notified_at = {}
+
+    def add_snapshot_listener(self, listener) -> None:
+        """
+        Registers callable(parser, date, currencies, complete) called
+        every time rates are fetched from the bank, `complete` is
+        False if only some of the bank's currencies were fetched
+        """
+        self._snapshot_listeners.append(listener)
+
+    def _notify_snapshot(self, parser, date: datetime.date,
+                         currencies: Sequence[Currency],
+                         complete: bool) -> None:
+        for listener in self._snapshot_listeners:
+            try:
+                listener(parser, date, currencies, complete)
+            except Exception:
+                logger.exception("Snapshot listener failed")
 
     def get_currency(self, parser,
                      currency_name: str='USD',
@@ -30,10 +102,34 @@ class CacheProxy(object):
         """
         if date is None:
             date = datetime.date.today()
+        date = effective_date(parser, date)
+        if not self.is_published(parser, date):
+            return Currency.empty_currency()
+        if date == datetime.date.today():
+            snapshot = self.get_snapshot(parser, date)
+            return snapshot.get(currency_name, Currency.empty_currency())
         currency = self.get_cached_currency(parser, currency_name, date)
         if currency is None:
-            currency = parser.get_currency(currency_name, date)
+            with self._cache.fetch_lock(parser.short_name, date):
+                # Other worker could have fetched it while we waited
+                currency = self.get_cached_currency(parser, currency_name,
+                                                    date, operation='recheck')
+                if currency is None:
+                    return self._fetch_currency(parser, currency_name, date)
+        if currency.is_empty():
+            # Bank is known to have no rates for this date
+            return currency
+        return self.denominate_currency(currency, date)
+
+    def _fetch_currency(self, parser,
+                        currency_name: str,
+                        date: datetime.date) -> Currency:
+        currency = parser.get_currency(currency_name, date)
+        if currency is None or currency.is_empty():
+            self.cache_missing(parser, currency_name, date)
+            return Currency.empty_currency()
         currency = self.denominate_currency(currency, date)
+        self._notify_snapshot(parser, date, [currency], complete=False)
         self.try_caching(parser, currency, date)
         return currency
 
@@ -41,35 +137,185 @@ class CacheProxy(object):
                            date: datetime.date=None) -> Sequence[Currency]:
         if date is None:
             date = datetime.date.today()
+        date = effective_date(parser, date)
+        if not self.is_published(parser, date):
+            return []
+        if date == datetime.date.today():
+            return self.get_snapshot(parser, date)
         # TODO: investigate bulk caching of currencies
         # for example we may check. whether all of the
         # provided by parser currencies are cached
         # and return cached values if so\
-        currencies = parser.get_all_currencies(date)
-        denominated = [self.denominate_currency(c, date)
-                       for c in currencies]
-        for c in denominated:
-            self.try_caching(parser, c, date)
+        with self._cache.fetch_lock(parser.short_name, date):
+            currencies = parser.get_all_currencies(date)
+            denominated = [self.denominate_currency(c, date)
+                           for c in currencies]
+            self._notify_snapshot(parser, date, denominated, complete=True)
+            for c in denominated:
+                self.try_caching(parser, c, date)
         return denominated
 
+    def get_snapshot(self, parser, date: datetime.date) -> RateTable:
+        """
+        All of the bank's rates for the date. Cached snapshot younger
+        than soft TTL is returned as is, one younger than hard TTL is
+        returned and refreshed in background, otherwise rates are
+        fetched unless the bank is unavailable and the snapshot is
+        still within stale-if-error window.
+        """
+        bank = parser.short_name
+        snapshot = self._read_snapshot(parser, date)
+        if snapshot is not None:
+            age = self._clock() - snapshot[0]
+            if age < self._soft_ttl:
+                metrics.SNAPSHOT_REQUESTS.inc(bank=bank, result='fresh')
+                return snapshot[1]
+            if age < self._hard_ttl:
+                metrics.SNAPSHOT_REQUESTS.inc(bank=bank, result='stale')
+                self._schedule_refresh(parser, date)
+                return snapshot[1]
+        try:
+            table = self._refresh_snapshot(parser, date)
+        except BotBankUnavailableError as e:
+            if snapshot is None:
+                raise
+            if self._clock() - snapshot[0] >= self._stale_if_error:
+                raise
+            logger.warning("Serving stale {} rates: {}".format(bank, e))
+            metrics.SNAPSHOT_REQUESTS.inc(bank=bank, result='stale_if_error')
+            return snapshot[1]
+        metrics.SNAPSHOT_REQUESTS.inc(bank=bank, result='refreshed')
+        return table
+
+    def _read_snapshot(self, parser, date: datetime.date,
+                       fresh: bool=False):
+        with metrics.CACHE_LOOKUP_SECONDS.time(
+                **self._labels(parser, 'get_snapshot')):
+            snapshot = self._cache.get_snapshot(parser.short_name, date,
+                                                fresh=fresh)
+        metrics.CACHE_REQUESTS.inc(
+            result='miss' if snapshot is None else 'hit',
+            **self._labels(parser, 'get_snapshot'))
+        if snapshot is not None:
+            self._notify_if_newer(parser, date, *snapshot)
+        return snapshot
+
+    def _notify_if_newer(self, parser, date: datetime.date,
+                         fetched_at: float, table: RateTable) -> None:
+        """Notifies listeners of snapshots fetched by other processes"""
+        key = (parser.short_name, date)
+        with self._lock:
+            if self._notified_at.get(key, 0) >= fetched_at:
+                return
+            self._notified_at[key] = fetched_at
+        self._notify_snapshot(parser, date, list(table), complete=True)
+
+    def _refresh_snapshot(self, parser, date: datetime.date) -> RateTable:
+        with self._cache.fetch_lock(parser.short_name, date):
+            # Other worker could have refreshed it while we waited,
+            # local tier would still hold the snapshot we found stale
+            snapshot = self._read_snapshot(parser, date, fresh=True)
+            if snapshot is not None and \
+                    self._clock() - snapshot[0] < self._soft_ttl:
+                return snapshot[1]
+            currencies = parser.get_all_currencies(date)
+            fetched_at = self._clock()
+            table = RateTable((self.denominate_currency(c, date)
+                               for c in currencies), fetched_at=fetched_at)
+            with metrics.CACHE_WRITE_SECONDS.time(
+                    **self._labels(parser, 'put_snapshot')):
+                self._cache.cache_snapshot(parser.short_name, date,
+                                           fetched_at, table,
+                                           expire=self._stale_if_error)
+            self._notify_if_newer(parser, date, fetched_at, table)
+        return table
+
+    def _schedule_refresh(self, parser, date: datetime.date) -> None:
+        """Refreshes the snapshot in background, once at a time"""
+        key = (parser.short_name, date)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._refresh_snapshot(parser, date)
+            except Exception as e:
+                logger.warning("Refreshing {} rates failed: {}".format(
+                    parser.short_name, e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self._executor.submit(refresh)
+        except FetchQueueFullError:
+            with self._lock:
+                self._refreshing.discard(key)
+
     def get_cached_currency(self, parser,
                             currency_name: str,
-                            date: datetime.date) -> Currency:
+                            date: datetime.date,
+                            operation: str='get') -> Currency:
         """
         Attempts to read currency for the given
-        parser, currency name and date
+        parser, currency name and date, `operation`
+        labels the lookup in metrics
         """
         today = datetime.date.today()
         if date == today:
             # Today exchange rates should never be persisted
             # as they may change across the day
             return None
-        cached_item = self._cache.get_cached_value(parser.short_name,
-                                                   currency_name,
-                                                   date)
+        with metrics.CACHE_LOOKUP_SECONDS.time(
+                **self._labels(parser, operation)):
+            cached_item = self._cache.get_cached_value(parser.short_name,
+                                                       currency_name,
+                                                       date)
+        self._count_lookup(parser, operation, cached_item)
         # May be None
         return cached_item
 
+    def get_cached_currencies(self, parser,
+                              currency_name: str,
+                              dates: Sequence[datetime.date]):
+        """
+        Reads currency for many dates at once, returns dict of
+        cached currencies by date, empty currencies included
+        """
+        today = datetime.date.today()
+        dates = [d for d in dates if d != today]
+        with metrics.CACHE_LOOKUP_SECONDS.time(
+                **self._labels(parser, 'get_many')):
+            cached_items = self._cache.get_cached_values(parser.short_name,
+                                                         currency_name,
+                                                         dates)
+        found = {}
+        for date, cached_item in zip(dates, cached_items):
+            self._count_lookup(parser, 'get_many', cached_item)
+            if cached_item is None:
+                continue
+            if not cached_item.is_empty():
+                cached_item = self.denominate_currency(cached_item, date)
+            found[date] = cached_item
+        return found
+
+    def _labels(self, parser, operation: str):
+        return {'backend': self._backend_name,
+                'bank': parser.short_name,
+                'operation': operation}
+
+    def _count_lookup(self, parser, operation: str, cached_item) -> None:
+        if cached_item is None:
+            result = 'miss'
+        elif cached_item.is_empty():
+            result = 'negative_hit'
+        else:
+            result = 'hit'
+        metrics.CACHE_REQUESTS.inc(result=result,
+                                   **self._labels(parser, operation))
+
     def try_caching(self, parser,
                     currency, date: datetime.date,
                     use_cache: bool=True):
@@ -81,8 +327,45 @@ class CacheProxy(object):
             return
         is_today = date == datetime.date.today()
         if not is_today and not currency.is_empty():
-            self._cache.cache_currency(parser.short_name,
-                                       currency, date)
+            with metrics.CACHE_WRITE_SECONDS.time(
+                    **self._labels(parser, 'put')):
+                self._cache.cache_currency(parser.short_name,
+                                           currency, date)
+
+    def cache_currencies(self, parser,
+                         items: Iterable[Tuple[datetime.date, Currency]]) -> int:
+        """
+        Caches (date, currency) pairs in bulk skipping empty
+        currencies and today's rates, returns number of cached ones
+        """
+        today = datetime.date.today()
+        to_cache = [(date, self.denominate_currency(currency, date))
+                    for date, currency in items
+                    if date != today and not currency.is_empty()]
+        if to_cache:
+            with metrics.CACHE_WRITE_SECONDS.time(
+                    **self._labels(parser, 'put_many')):
+                self._cache.cache_currencies(parser.short_name, to_cache)
+        return len(to_cache)
+
+    def cache_missing(self, parser,
+                      currency_name: str,
+                      date: datetime.date):
+        """
+        Remembers for a while that the bank has no rates
+        for the given past date, so that it is not requested again
+        """
+        if date == datetime.date.today() or not self._negative_ttl:
+            return
+        with metrics.CACHE_WRITE_SECONDS.time(
+                **self._labels(parser, 'put_missing')):
+            self._cache.cache_missing(parser.short_name, currency_name,
+                                      date, expire=self._negative_ttl)
+
+    def is_published(self, parser, date: datetime.date) -> bool:
+        """False for dates the bank could not have rates for"""
+        min_date = minimal_date(parser)
+        return min_date is None or date >= min_date
 
     def denominate_currency(self, currency,
                             date: datetime.date):
@@ -1 +1,17 @@
+import os
+import re
+
 CACHE_DATE_FORMAT = "%d.%m.%Y"
+# Value stored for dates the bank has no rates for
+NEGATIVE_CACHE_VALUE = "none"
+# Keys of rates written by StrCacheAdapter: <bank>_<currency>_<date>
+RATE_KEY_REGEX = re.compile(r'^(?P<bank>.+)_(?P<currency>[a-z]{3})_'
+                            r'(?P<date>\d{2}\.\d{2}\.\d{4})$')
+# Fetch lock expires after that many seconds if its holder died
+FETCH_LOCK_LEASE = int(os.environ.get('BANK_BOT_FETCH_LOCK_LEASE', '30'))
+# Backend is bypassed after that many consecutive failures and probed
+# every CACHE_PROBE_INTERVAL seconds until it responds again
+CACHE_FAILURE_THRESHOLD = int(os.environ.get(
+    'BANK_BOT_CACHE_FAILURE_THRESHOLD', '3'))
+CACHE_PROBE_INTERVAL = float(os.environ.get(
+    'BANK_BOT_CACHE_PROBE_INTERVAL', '5'))
@@ -1,3 +1,6 @@
+import fnmatch
+import time
+
 from .base import AbstractCache
 
 
@@ -9,13 +12,25 @@ class DictionaryCache(AbstractCache):
         self.is_available = True
         self.data = {}
 
-    def put(self, key, value, key_type=None):
-        self.data[key] = value
-        print(self.data)
+    def put(self, key, value, key_type=None, value_type=None, expire=None):
+        expires_at = time.time() + expire if expire else None
+        self.data[key] = (value, expires_at)
 
     def get(self, key, key_type=None):
         # TODO: think about the behaviour when items is not present
-        return self.data.get(key, None)
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    def iter_items(self, match=None):
+        now = time.time()
+        for key, (value, expires_at) in list(self.data.items()):
+            if expires_at is not None and expires_at <= now:
+                continue
+            if match is None or fnmatch.fnmatchcase(key, match):
+                yield key, value, expires_at
 
     def delete(self, key, key_type=None):
         self.data.pop(key, None)
@@ -0,0 +1,118 @@
+"""
+Health tracking of cache backends.
+
+After a few consecutive failed calls the backend is marked
+unavailable and bypassed without trying, so that lookups do not wait
+for connection timeouts while e.g. redis is down. A background thread
+probes the backend and marks it available again once it responds.
+
+Threads do not survive fork, so forked worker processes start their
+own probers if the backend is unavailable at fork time.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Tuple, Type
+
+from bot.resilience import CircuitBreaker
+
+from .conf import CACHE_FAILURE_THRESHOLD, CACHE_PROBE_INTERVAL
+
+logger = logging.getLogger('telegrambot')
+
+# Instances to be reset in forked child processes
+_instances = weakref.WeakSet()
+
+
+class CacheHealth(object):
+    """
+    Availability of a single backend, kept by a circuit breaker whose
+    half-open trials are made by the prober rather than by requests.
+    """
+
+    def __init__(self, name: str,
+                 probe: Callable[[], object],
+                 errors: Tuple[Type[Exception], ...]=(Exception,),
+                 failure_threshold: int=CACHE_FAILURE_THRESHOLD,
+                 probe_interval: float=CACHE_PROBE_INTERVAL,
+                 background: bool=True,
+                 clock: Callable[[], float]=time.time) -> None:
+        self.name = name
+        self.probe_interval = probe_interval
+        self.breaker = CircuitBreaker('cache:{}'.format(name),
+                                      failure_threshold=failure_threshold,
+                                      cooldown=probe_interval,
+                                      clock=clock)
+        self._probe = probe
+        self._errors = errors
+        self._background = background
+        self._prober = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    @property
+    def is_available(self) -> bool:
+        return self.breaker.state == CircuitBreaker.CLOSED
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self.breaker.record_failure()
+        if self._background and not self.is_available:
+            self._start_prober()
+
+    def probe(self) -> bool:
+        """Checks the unavailable backend once, returns whether
+        it is available again"""
+        if not self.breaker.allow_request():
+            return self.is_available
+        try:
+            self._probe()
+        except self._errors as e:
+            logger.warning("Cache {} is still unavailable: {}".format(
+                self.name, e))
+            self.breaker.record_failure()
+            return False
+        self.breaker.record_success()
+        return True
+
+    def _start_prober(self) -> None:
+        with self._lock:
+            if self._prober is not None:
+                return
+            logger.error("Cache {} is unavailable, bypassing it".format(
+                self.name))
+            self._prober = threading.Thread(
+                target=self._run_prober,
+                name='cache-health-{}'.format(self.name),
+                daemon=True)
+            self._prober.start()
+
+    def _after_fork(self) -> None:
+        # Prober thread of the parent process is not running here
+        self._lock = threading.Lock()
+        self._prober = None
+        self.breaker.after_fork()
+        if self._background and not self.is_available:
+            self._start_prober()
+
+    def _run_prober(self) -> None:
+        while True:
+            with self._lock:
+                if self.is_available:
+                    self._prober = None
+                    return
+            time.sleep(self.probe_interval)
+            self.probe()
+
+
+def _after_fork_in_child() -> None:
+    for health in list(_instances):
+        health._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
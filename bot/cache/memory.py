@@ -0,0 +1,109 @@
+"""
+Bounded in-process cache backend, used when no redis is configured
+and in tests.
+"""
+
+import collections
+import fnmatch
+import sys
+import threading
+import time
+
+from .base import AbstractCache
+
+
+class MemoryCache(AbstractCache):
+    """
+    Thread-safe LRU cache bounded both by number of items and by
+    approximate size of keys and values in bytes. Items may expire
+    after `expire` seconds, expired items are dropped when they are
+    read or evicted. All of the operations are O(1).
+    """
+
+    def __init__(self, max_items: int=100000,
+                 max_bytes: int=64 * 1024 * 1024,
+                 clock=time.time) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._clock = clock
+        # key -> (value, expires_at, size), least recently used first
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(key, value) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def _get(self, key, now: float):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            self._remove(key)
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def _remove(self, key) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def _put(self, key, value, expires_at) -> None:
+        self._remove(key)
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._items) > self.max_items or \
+                self._bytes > self.max_bytes:
+            _, item = self._items.popitem(last=False)
+            self._bytes -= item[2]
+
+    def get(self, key, key_type=None):
+        with self._lock:
+            return self._get(key, self._clock())
+
+    def get_many(self, keys, key_type=None):
+        with self._lock:
+            now = self._clock()
+            return [self._get(key, now) for key in keys]
+
+    def put(self, key, value, key_type=None, value_type=None, expire=None):
+        with self._lock:
+            expires_at = self._clock() + expire if expire else None
+            self._put(key, value, expires_at)
+
+    def put_many(self, items, expire=None):
+        with self._lock:
+            expires_at = self._clock() + expire if expire else None
+            for key, value in items:
+                self._put(key, value, expires_at)
+
+    def delete(self, key, key_type=None):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def iter_items(self, match=None):
+        with self._lock:
+            now = self._clock()
+            items = [(key, value, expires_at)
+                     for key, (value, expires_at, _) in self._items.items()
+                     if expires_at is None or expires_at > now]
+        for key, value, expires_at in items:
+            if match is None or fnmatch.fnmatchcase(key, match):
+                yield key, value, expires_at
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,299 @@
+"""
+Cache backend keeping exchange rates in memory-mapped files.
+
+Every (bank, currency) series lives in its own file of fixed-width
+records, the record of a date is found at its day offset from the
+series' base date, so reading a date takes a single offset
+computation and reading a date range is a slice of the mapping.
+Files are shared through the page cache by all of the processes
+on the host.
+
+Keys which are not rate keys are kept in the fallback cache.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import fnmatch
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from .base import AbstractCache
+from .conf import CACHE_DATE_FORMAT, NEGATIVE_CACHE_VALUE, RATE_KEY_REGEX
+from .memory import MemoryCache
+
+MAGIC = b'BBRATES1'
+# magic, base date ordinal, record size
+HEADER = struct.Struct('<8sii')
+HEADER_SIZE = 32
+# flag, multiplier, buy, sell, expires_at (0 if never expires)
+RECORD = struct.Struct('<B3xiddd')
+RECORD_DTYPE = np.dtype([('flag', 'u1'), ('pad', 'V3'),
+                         ('multiplier', '<i4'), ('buy', '<f8'),
+                         ('sell', '<f8'), ('expires_at', '<f8')])
+
+EMPTY, RATE, MISSING = 0, 1, 2
+
+# Files grow by a year worth of records at once
+GROWTH_RECORDS = 366
+DEFAULT_BASE_DATE = datetime.date(year=1996, month=1, day=1)
+
+
+class RateFile(object):
+    """Fixed-width records of a single (bank, currency) series"""
+
+    def __init__(self, path: str, base_date: datetime.date) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, 'r+b')
+        with self._file_lock():
+            if os.fstat(fd).st_size == 0:
+                header = HEADER.pack(MAGIC, base_date.toordinal(),
+                                     RECORD.size)
+                self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+                self._file.flush()
+        self._file.seek(0)
+        magic, ordinal, record_size = HEADER.unpack(
+            self._file.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError("{} is not a rate file".format(path))
+        self.base_date = datetime.date.fromordinal(ordinal)
+        self._map = None
+        self._remap()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with other processes"""
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _remap(self) -> None:
+        # Previous mapping is not closed explicitly, arrays returned
+        # by read_range may still point into it
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _offset(self, date: datetime.date) -> int:
+        index = (date - self.base_date).days
+        if index < 0:
+            return None
+        return HEADER_SIZE + index * RECORD.size
+
+    def _ensure_mapped(self, end: int, grow: bool) -> bool:
+        """Makes sure the mapping covers `end` bytes, the file
+        could have been extended by another process"""
+        if end <= len(self._map):
+            return True
+        size = os.fstat(self._file.fileno()).st_size
+        if end > size:
+            if not grow:
+                return False
+            with self._file_lock():
+                size = os.fstat(self._file.fileno()).st_size
+                if end > size:
+                    self._file.truncate(end + GROWTH_RECORDS * RECORD.size)
+        self._remap()
+        return True
+
+    def read(self, date: datetime.date) -> Tuple[int, int, float, float, float]:
+        """(flag, multiplier, buy, sell, expires_at) of the date"""
+        offset = self._offset(date)
+        if offset is None:
+            return None
+        with self._lock:
+            if not self._ensure_mapped(offset + RECORD.size, grow=False):
+                return None
+            return RECORD.unpack_from(self._map, offset)
+
+    def write(self, date: datetime.date, flag: int,
+              multiplier: int=0, buy: float=0.0, sell: float=0.0,
+              expires_at: float=0.0) -> bool:
+        offset = self._offset(date)
+        if offset is None:
+            return False
+        with self._lock:
+            self._ensure_mapped(offset + RECORD.size, grow=True)
+            # Flag goes last so that readers never see a partial record
+            RECORD.pack_into(self._map, offset, EMPTY, multiplier,
+                             buy, sell, expires_at)
+            self._map[offset] = flag
+        return True
+
+    def read_range(self, start: datetime.date,
+                   end: datetime.date) -> np.ndarray:
+        """Records from start to end inclusive as a structured array
+        sharing memory with the file, records past the end of the file
+        are not included"""
+        start = max(start, self.base_date)
+        first = self._offset(start)
+        count = (end - start).days + 1
+        with self._lock:
+            self._ensure_mapped(first + count * RECORD.size, grow=False)
+            available = (len(self._map) - first) // RECORD.size
+            count = min(count, available)
+            if count <= 0:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            return np.frombuffer(self._map, dtype=RECORD_DTYPE,
+                                 count=count, offset=first)
+
+    def iter_records(self):
+        """Iterates over (date, record) of all of the non-empty records"""
+        with self._lock:
+            self._ensure_mapped(os.fstat(self._file.fileno()).st_size,
+                                grow=False)
+            mapping = self._map
+        index = 0
+        for offset in range(HEADER_SIZE, len(mapping) - RECORD.size + 1,
+                            RECORD.size):
+            record = RECORD.unpack_from(mapping, offset)
+            if record[0] != EMPTY:
+                yield self.base_date + datetime.timedelta(days=index), record
+            index += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._map = None
+            self._file.close()
+
+
+class MmapCache(AbstractCache):
+    """
+    Stores rate keys written by StrCacheAdapter in memory-mapped
+    rate files inside `directory`. `base_date` returns the first
+    date of the bank's series, files are never written before it.
+    """
+
+    def __init__(self, directory: str,
+                 base_date: Callable[[str], datetime.date]=None,
+                 fallback: AbstractCache=None) -> None:
+        self.directory = directory
+        self._base_date = base_date or (lambda bank: DEFAULT_BASE_DATE)
+        self._fallback = fallback if fallback is not None \
+            else MemoryCache()
+        self._files = {}  # type: Dict[Tuple[str, str], RateFile]
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, bank: str, currency: str) -> str:
+        return os.path.join(self.directory,
+                            '{}_{}.rates'.format(bank, currency))
+
+    def rate_file(self, bank: str, currency: str,
+                  create: bool=True) -> RateFile:
+        key = (bank.lower(), currency.lower())
+        with self._lock:
+            rate_file = self._files.get(key)
+            if rate_file is None:
+                path = self._path(*key)
+                if not create and not os.path.exists(path):
+                    return None
+                base_date = self._base_date(key[0]) or DEFAULT_BASE_DATE
+                rate_file = RateFile(path, base_date)
+                self._files[key] = rate_file
+            return rate_file
+
+    @staticmethod
+    def _parse_key(key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        match = RATE_KEY_REGEX.match(key)
+        if match is None:
+            return None
+        date = datetime.datetime.strptime(match.group('date'),
+                                          CACHE_DATE_FORMAT).date()
+        return match.group('bank'), match.group('currency'), date
+
+    def get(self, key, key_type=None):
+        parsed = self._parse_key(key)
+        if parsed is None:
+            return self._fallback.get(key)
+        bank, currency, date = parsed
+        rate_file = self.rate_file(bank, currency, create=False)
+        if rate_file is None:
+            return None
+        record = rate_file.read(date)
+        if record is None:
+            return None
+        flag, multiplier, buy, sell, expires_at = record
+        if flag == EMPTY:
+            return None
+        if expires_at and expires_at <= time.time():
+            return None
+        if flag == MISSING:
+            return NEGATIVE_CACHE_VALUE
+        return ",".join([str(buy), str(sell), str(multiplier)])
+
+    def put(self, key, value, key_type=None, value_type=None, expire=None):
+        parsed = self._parse_key(key)
+        if parsed is None:
+            self._fallback.put(key, value, expire=expire)
+            return
+        bank, currency, date = parsed
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        expires_at = time.time() + expire if expire else 0.0
+        rate_file = self.rate_file(bank, currency)
+        if value == NEGATIVE_CACHE_VALUE:
+            rate_file.write(date, MISSING, expires_at=expires_at)
+            return
+        buy, sell, multiplier = value.split(",")
+        rate_file.write(date, RATE, int(multiplier),
+                        float(buy), float(sell), expires_at)
+
+    def delete(self, key, key_type=None):
+        parsed = self._parse_key(key)
+        if parsed is None:
+            self._fallback.delete(key)
+            return
+        bank, currency, date = parsed
+        rate_file = self.rate_file(bank, currency, create=False)
+        if rate_file is not None:
+            rate_file.write(date, EMPTY)
+
+    def read_range(self, bank: str, currency: str,
+                   start: datetime.date,
+                   end: datetime.date) -> np.ndarray:
+        """Zero-copy view of the series' records from start to end"""
+        rate_file = self.rate_file(bank, currency, create=False)
+        if rate_file is None:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return rate_file.read_range(start, end)
+
+    def iter_items(self, match=None):
+        now = time.time()
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.rates'):
+                continue
+            bank, currency = name[:-len('.rates')].rsplit('_', 1)
+            rate_file = self.rate_file(bank, currency, create=False)
+            for date, record in rate_file.iter_records():
+                key = "{}_{}_{}".format(bank, currency,
+                                        date.strftime(CACHE_DATE_FORMAT))
+                flag, multiplier, buy, sell, expires_at = record
+                if expires_at and expires_at <= now:
+                    continue
+                if match is not None and not fnmatch.fnmatchcase(key, match):
+                    continue
+                value = self.get(key)
+                yield key, value, expires_at or None
+        for item in self._fallback.iter_items(match=match):
+            yield item
+
+    def close(self) -> None:
+        with self._lock:
+            for rate_file in self._files.values():
+                rate_file.close()
+            self._files = {}
+
+    @property
+    def is_available(self):
+        return True
@@ -1,6 +1,8 @@
 # coding: utf-8
 
+import fnmatch
 import logging
+import time
 import typing
 
 
@@ -42,12 +44,27 @@ class MongoCurrencyCache(AbstractCache):
     def get(self, key, key_type=None):
         item = self._collection.find_one({"currency_key": key})
         if item is not None:
+            expires_at = item.get("expires_at")
+            if expires_at is not None and expires_at <= time.time():
+                return None
             return item["value"]
         return None
 
-    def put(self, key, value, key_type=None, key_value=None):
+    def iter_items(self, match=None):
+        query = {}
+        if match is not None:
+            query["currency_key"] = {"$regex": fnmatch.translate(match)}
+        now = time.time()
+        for item in self._collection.find(query):
+            expires_at = item.get("expires_at")
+            if expires_at is not None and expires_at <= now:
+                continue
+            yield item["currency_key"], item["value"], expires_at
+
+    def put(self, key, value, key_type=None, key_value=None, expire=None):
         item = {
             "currency_key": key,
-            "value": value
+            "value": value,
+            "expires_at": time.time() + expire if expire else None
         }
         self._collection.insert(item)
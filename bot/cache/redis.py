@@ -1,32 +1,146 @@
 # import logging
 
+import contextlib
+import time
+import uuid
+
 import redis
 
 from . import AbstractCache
 from . import redis_settings as settings
+from .health import CacheHealth
+
+# Errors meaning redis is unreachable rather than a bad command
+REDIS_ERRORS = (redis.exceptions.ConnectionError,
+                redis.exceptions.TimeoutError)
+
+
+# Deletes the lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 
 
 class RedisCache(AbstractCache):
     """This class implements caching interface
-    for redis backend"""
+    for redis backend, while redis is unavailable
+    it is bypassed as if it had no items"""
+
+    LOCK_POLL_INTERVAL = 0.05
+    LOCK_MAX_POLL_INTERVAL = 0.5
 
     def __init__(self, currency_cls, logger_name):
 
         prefs = {"host": settings.REDIS_HOST,
                  "port": settings.REDIS_PORT,
-                 "db": settings.REDIS_DB}
+                 "db": settings.REDIS_DB,
+                 "socket_timeout": settings.REDIS_TIMEOUT,
+                 "socket_connect_timeout": settings.REDIS_TIMEOUT}
         self._connection = redis.StrictRedis(**prefs)
+        self._release_lock = self._connection.register_script(
+            RELEASE_LOCK_SCRIPT)
+        self.health = CacheHealth('redis', self._connection.ping,
+                                  errors=REDIS_ERRORS)
 
-    def get(self, key, key_type=None):
+    def _call(self, default, method, *args, **kwargs):
+        """Calls redis unless it is known to be down, returns
+        default if it is"""
+        if not self.health.is_available:
+            return default
         try:
-            item = self._connection.get(key)
-            return item
-        except redis.exceptions.ConnectionError:
-            return None
-        return None
+            result = method(*args, **kwargs)
+        except REDIS_ERRORS:
+            self.health.record_failure()
+            return default
+        self.health.record_success()
+        return result
+
+    @property
+    def is_available(self):
+        return self.health.is_available
 
-    def put(self, key, value, key_type=None, key_value=None):
+    def get(self, key, key_type=None):
+        return self._call(None, self._connection.get, key)
+
+    def get_many(self, keys, key_type=None):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self._call([None] * len(keys), self._connection.mget, keys)
+
+    def iter_items(self, match=None, batch_size=500):
+        """Walks keys with SCAN, stops as soon as redis is down,
+        check is_available to tell that from the end of items"""
+        cursor = 0
+        while True:
+            scanned = self._call(None, self._connection.scan, cursor,
+                                 match=match, count=batch_size)
+            if scanned is None:
+                return
+            cursor, batch = scanned
+            if not batch:
+                if int(cursor) == 0:
+                    return
+                continue
+            pipeline = self._connection.pipeline(transaction=False)
+            for key in batch:
+                pipeline.get(key)
+                pipeline.pttl(key)
+            results = self._call(None, pipeline.execute)
+            if results is None:
+                return
+            now = time.time()
+            for i, key in enumerate(batch):
+                value, ttl = results[2 * i], results[2 * i + 1]
+                if value is None:
+                    # Expired in the meantime
+                    continue
+                expires_at = now + ttl / 1000.0 if ttl >= 0 else None
+                yield key.decode('utf-8'), value, expires_at
+            if int(cursor) == 0:
+                return
+
+    def put(self, key, value, key_type=None, key_value=None, expire=None):
+        self._call(None, self._connection.set, key, value, ex=expire)
+
+    def delete(self, key, key_type=None):
+        self._call(None, self._connection.delete, key)
+
+    @contextlib.contextmanager
+    def lock(self, name, lease=30, wait=None):
+        """
+        Lock shared by all of the processes using the same redis
+        (SET NX PX lease). Waits for the lock up to `wait` seconds,
+        lease by default, and proceeds without it afterwards or if
+        redis is down; yields whether the lock was acquired.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.time() + (lease if wait is None else wait)
+        interval = self.LOCK_POLL_INTERVAL
+        acquired = False
+        while self.health.is_available:
+            try:
+                acquired = bool(self._connection.set(
+                    name, token, nx=True, px=int(lease * 1000)))
+            except REDIS_ERRORS:
+                self.health.record_failure()
+                break
+            if acquired or time.time() >= deadline:
+                break
+            time.sleep(interval)
+            interval = min(interval * 2, self.LOCK_MAX_POLL_INTERVAL)
         try:
-            self._connection.set(key, value)
-        except redis.exceptions.ConnectionError:
-            pass
+            yield acquired
+        finally:
+            if acquired:
+                self._call(None, self._release_lock,
+                           keys=[name], args=[token])
+
+    def put_many(self, items, expire=None):
+        pipeline = self._connection.pipeline(transaction=False)
+        for key, value in items:
+            pipeline.set(key, value, ex=expire)
+        self._call(None, pipeline.execute)
@@ -3,3 +3,5 @@ import os
 REDIS_HOST = os.environ.get('TELEGRAM_REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('TELEGRAM_REDIS_PORT', '6379'))
 REDIS_DB = int(os.environ.get('TELEGRAM_REDIS_DB', '0'))
+# Seconds to wait for connection and replies
+REDIS_TIMEOUT = float(os.environ.get('TELEGRAM_REDIS_TIMEOUT', '0.5'))
@@ -0,0 +1,145 @@
+"""
+Cache snapshots: the whole cache dumped into a gzipped file
+and loaded back, e.g. into an empty cache on a new host.
+
+The first line of the file is a JSON header, every next line
+is a JSON array [key, value, expires_at].
+
+    python -m bot.cache.snapshot export cache.snapshot.gz
+    python -m bot.cache.snapshot import cache.snapshot.gz
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import os
+import time
+
+from bot.exceptions import BotCacheSnapshotError
+
+from .base import AbstractCache
+
+logger = logging.getLogger('telegrambot')
+
+SNAPSHOT_FORMAT = 'bank-bot-cache'
+SNAPSHOT_VERSION = 1
+IMPORT_BATCH_SIZE = 500
+
+
+def export_snapshot(cache: AbstractCache, path: str, match=None) -> int:
+    """Writes all of the cache items to the file, returns their number"""
+    tmp_path = path + '.tmp'
+    count = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        header = {'format': SNAPSHOT_FORMAT,
+                  'version': SNAPSHOT_VERSION,
+                  'created_at': time.time()}
+        f.write(json.dumps(header) + '\n')
+        for key, value, expires_at in cache.iter_items(match=match):
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            f.write(json.dumps([key, value, expires_at],
+                               separators=(',', ':')) + '\n')
+            count += 1
+    if not cache.is_available:
+        # Items of a cache that went down are incomplete
+        os.remove(tmp_path)
+        logger.warning("Cache is unavailable, {} was not exported"
+                       .format(path))
+        return 0
+    os.replace(tmp_path, path)
+    logger.info("Exported {} cache items to {}".format(count, path))
+    return count
+
+
+def read_snapshot(path: str):
+    """Iterates over (key, value, expires_at) items of the snapshot"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            raise BotCacheSnapshotError("{} is not a cache snapshot"
+                                        .format(path))
+        if header.get('format') != SNAPSHOT_FORMAT:
+            raise BotCacheSnapshotError("{} is not a cache snapshot"
+                                        .format(path))
+        if header.get('version') != SNAPSHOT_VERSION:
+            raise BotCacheSnapshotError(
+                "Unsupported cache snapshot version {}"
+                .format(header.get('version')))
+        for line in f:
+            try:
+                key, value, expires_at = json.loads(line)
+            except ValueError:
+                raise BotCacheSnapshotError("Damaged cache snapshot line: {}"
+                                            .format(line[:100]))
+            yield key, value, expires_at
+
+
+def import_snapshot(cache: AbstractCache, path: str,
+                    overwrite: bool=False) -> int:
+    """
+    Loads snapshot items into the cache in batches, returns number
+    of loaded items. Expired items are skipped, so are keys already
+    present in cache unless `overwrite` is set.
+    """
+    items = read_snapshot(path)
+    count = 0
+    while True:
+        batch = list(itertools.islice(items, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        now = time.time()
+        batch = [item for item in batch
+                 if item[2] is None or item[2] > now]
+        if not overwrite:
+            existing = cache.get_many([key for key, _, _ in batch])
+            batch = [item for item, value in zip(batch, existing)
+                     if value is None]
+        persistent = [(key, value) for key, value, expires_at in batch
+                      if expires_at is None]
+        cache.put_many(persistent)
+        for key, value, expires_at in batch:
+            if expires_at is not None:
+                cache.put(key, value, expire=max(1, int(expires_at - now)))
+        count += len(batch)
+    logger.info("Imported {} cache items from {}".format(count, path))
+    return count
+
+
+def load_snapshot(cache: AbstractCache, path: str) -> int:
+    """Imports snapshot if the file exists, errors are logged"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        return import_snapshot(cache, path)
+    except (BotCacheSnapshotError, OSError) as e:
+        logger.error("Cache snapshot was not loaded: {}".format(e))
+        return 0
+
+
+def main(argv=None):
+    from bot.adapters import default_cache
+
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    arg_parser.add_argument('command', choices=('export', 'import'))
+    arg_parser.add_argument('path')
+    arg_parser.add_argument('--overwrite', action='store_true',
+                            help='Replace keys already present in cache')
+    args = arg_parser.parse_args(argv)
+
+    cache = default_cache.cache
+    started = time.time()
+    if args.command == 'export':
+        count = export_snapshot(cache, args.path)
+    else:
+        count = import_snapshot(cache, args.path, overwrite=args.overwrite)
+    print("{}ed {} items in {:.1f}s".format(args.command.capitalize(),
+                                           count, time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
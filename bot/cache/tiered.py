@@ -0,0 +1,110 @@
+"""
+Two-tier cache: bounded in-process LRU in front of any other backend.
+
+Hot keys, e.g. yesterday's USD rate of NBRB, are read from
+a dictionary instead of going to redis over the network. Items are
+kept locally for at most `ttl` seconds so that writes made by other
+processes are picked up, writes made through this cache replace
+the local item right away.
+"""
+
+import time
+
+from bot import metrics
+
+from .base import AbstractCache
+from .memory import MemoryCache
+
+
+class TieredCache(AbstractCache):
+    """Keeps up to `size` recently read items of `backend` in memory"""
+
+    def __init__(self, backend: AbstractCache, size: int=1024,
+                 ttl: float=60, clock=time.time) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self._local = MemoryCache(max_items=size, clock=clock)
+
+    def _get_local(self, key):
+        return self._local.get(key)
+
+    def _put_local(self, key, value, expire=None) -> None:
+        ttl = self.ttl if not expire else min(self.ttl, expire)
+        self._local.put(key, value, expire=ttl)
+
+    def _evict(self, key) -> None:
+        self._local.delete(key)
+
+    def get(self, key, key_type=None):
+        value = self._get_local(key)
+        if value is not None:
+            metrics.CACHE_TIER_REQUESTS.inc(tier='local', result='hit')
+            return value
+        metrics.CACHE_TIER_REQUESTS.inc(tier='local', result='miss')
+        value = self.backend.get(key, key_type=key_type)
+        self._count_backend(value)
+        if value is not None:
+            self._put_local(key, value)
+        return value
+
+    def get_many(self, keys, key_type=None):
+        keys = list(keys)
+        values = [self._get_local(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        hits = len(keys) - len(missing)
+        if hits:
+            metrics.CACHE_TIER_REQUESTS.inc(hits, tier='local', result='hit')
+        if not missing:
+            return values
+        metrics.CACHE_TIER_REQUESTS.inc(len(missing), tier='local',
+                                        result='miss')
+        fetched = self.backend.get_many([keys[i] for i in missing],
+                                        key_type=key_type)
+        for i, value in zip(missing, fetched):
+            self._count_backend(value)
+            if value is not None:
+                self._put_local(keys[i], value)
+            values[i] = value
+        return values
+
+    @staticmethod
+    def _count_backend(value) -> None:
+        metrics.CACHE_TIER_REQUESTS.inc(
+            tier='backend', result='miss' if value is None else 'hit')
+
+    def put(self, key, value, key_type=None, value_type=None, expire=None):
+        self.backend.put(key, value, expire=expire)
+        if expire is not None and expire <= 0:
+            self._evict(key)
+        else:
+            self._put_local(key, value, expire)
+
+    def put_many(self, items, expire=None):
+        items = list(items)
+        self.backend.put_many(items, expire=expire)
+        for key, _ in items:
+            self._evict(key)
+
+    def delete(self, key, key_type=None):
+        self._evict(key)
+        self.backend.delete(key, key_type=key_type)
+
+    def invalidate(self, key):
+        self._evict(key)
+
+    def clear_local(self) -> None:
+        """Drops all of the in-process items"""
+        self._local.clear()
+
+    def iter_items(self, match=None):
+        return self.backend.iter_items(match=match)
+
+    def lock(self, name, lease=30):
+        return self.backend.lock(name, lease=lease)
+
+    @property
+    def is_available(self):
+        return self.backend.is_available
+
+    def __len__(self):
+        return len(self._local)
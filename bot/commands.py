@@ -3,20 +3,25 @@ This module contains actual bot commands
 """
 
 from collections import deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 import datetime
 import os
 import uuid
 
 import telegram
-from telegram.ext.dispatcher import run_async
 
 from bot import utils
 from bot import plotting
 from bot import settings
 from bot.decorators import log_exceptions, log_statistics
+from bot.exceptions import BotBankUnavailableError, BotLoggedError
+from bot.fetch import fetch_executor, FetchQueueFullError
+from bot.series import CurrencySeries
+from bot.subscriptions import currencies_from_args, subscription_store
+from bot.alerts import ABOVE, BELOW, SIDES, alert_manager
 from bot.settings import logging
-from bot.adapters import default_cache, cache_proxy
+from bot.adapters import default_cache, cache_proxy, rendered_responses
+from bot.cache.cache_proxy import effective_date
 
 
 # Dummy method for later localization
@@ -34,6 +39,38 @@ def result_date_saver(parser, currency_name: str,
     return (date, currency)
 
 
+def render_all_currencies(parser, date: datetime.date) -> str:
+    """
+    Text listing all of the bank's rates for the date. Texts are
+    cached by version of the rates: past ones are kept for a while
+    and today's ones are versioned by the time they were fetched at.
+    """
+    date = effective_date(parser, date)
+    is_today = date == datetime.date.today()
+    if not is_today:
+        text = rendered_responses.get(parser.short_name, date, 'all')
+        if text is not None:
+            return text
+    all_currencies = cache_proxy.get_all_currencies(parser, date=date)
+    version = getattr(all_currencies, 'fetched_at', None)
+    if is_today and version is not None:
+        text = rendered_responses.get(parser.short_name, date, 'all',
+                                      version)
+        if text is not None:
+            return text
+
+    all_currencies = utils.sort_currencies(all_currencies)
+    displayed_values = [utils.format_currency_string(x)
+                        for x in all_currencies]
+    header = [_("\tBuy\tSell"), ]
+
+    currencies_text_value = "\n".join(header + displayed_values)
+    text = _("Currencies: \n{curs}").format(curs=currencies_text_value)
+    if all_currencies and (version is not None or not is_today):
+        rendered_responses.put(parser.short_name, date, 'all', version, text)
+    return text
+
+
 def start(bot, update):
     bot.sendMessage(chat_id=update.message.chat_id,
                     text=_("I'm a bot, please talk to me!"))
@@ -65,6 +102,12 @@ rate dynamincs for the specified period of time
 /banks - list names of currently supported banks.
 /set <bank_name> - sets default bank name for all of the operations
 /best -c <cur_name> -d <date diff> - best exchange rate for the given currency
+/subscribe -b <bank_name> -c <currency name> - get the bank's rates every day,
+-c may be repeated or omitted for all of the currencies
+/unsubscribe - stop getting daily rates
+/alert <currency name> <buy|sell> <below|above> <rate> -b <bank_name> - tell
+when the rate crosses the given value
+/alerts - list your alerts, /alerts clear - remove them
 """)
     bot.sendMessage(chat_id=chat_id,
                     text=help_message)
@@ -72,6 +115,118 @@ rate dynamincs for the specified period of time
     return
 
 
+def _reply_unavailable(bot, chat_id):
+    bot.sendMessage(chat_id=chat_id,
+                    text=_("Sorry, this feature is not enabled"))
+
+
+@log_exceptions
+def subscribe(bot, update, args):
+    """Subscribes chat to daily rates of the bank"""
+    user_id = str(update.message.from_user.id)
+    chat_id = update.message.chat_id
+    if subscription_store is None:
+        _reply_unavailable(bot, chat_id)
+        return
+
+    preferences = utils.parse_args(bot, update, args)
+    if not preferences:
+        return
+    bank_name = preferences['bank_name'] or \
+        utils.get_user_selected_bank(user_id)
+    parser = utils.get_parser(bank_name)
+    currencies = currencies_from_args(args)
+    unknown = [c for c in currencies if c not in parser.allowed_currencies]
+    if unknown:
+        bot.sendMessage(chat_id=chat_id,
+                        text=_("Unknown currency: {}").format(
+                            ", ".join(unknown)))
+        return
+    subscription_store.subscribe(chat_id, parser.short_name, currencies)
+    msg = _("You will get {bank} rates of {currencies} every day at {time}")
+    bot.sendMessage(chat_id=chat_id,
+                    text=msg.format(bank=parser.name,
+                                    currencies=", ".join(currencies) or
+                                    _("all currencies"),
+                                    time=settings.DIGEST_TIME.strftime(
+                                        '%H:%M')))
+
+
+@log_exceptions
+def unsubscribe(bot, update):
+    chat_id = update.message.chat_id
+    if subscription_store is None:
+        _reply_unavailable(bot, chat_id)
+        return
+    if subscription_store.unsubscribe(chat_id):
+        msg = _("You will not get daily rates anymore")
+    else:
+        msg = _("You are not subscribed to daily rates")
+    bot.sendMessage(chat_id=chat_id, text=msg)
+
+
+@log_exceptions
+def set_alert(bot, update, args):
+    """Sets alert on today's rate of the bank crossing a threshold"""
+    user_id = str(update.message.from_user.id)
+    chat_id = update.message.chat_id
+    usage = _("Usage: /alert <currency name> <buy|sell> <below|above> "
+              "<rate> -b <bank_name>")
+    if alert_manager is None:
+        _reply_unavailable(bot, chat_id)
+        return
+
+    positional = [arg for i, arg in enumerate(args)
+                  if arg != '-b' and (i == 0 or args[i - 1] != '-b')]
+    if len(positional) != 4:
+        bot.sendMessage(chat_id=chat_id, text=usage)
+        return
+    currency, side, direction, threshold = positional
+    side, direction = side.lower(), direction.lower()
+    try:
+        threshold = float(threshold.replace(',', '.'))
+    except ValueError:
+        threshold = None
+    if side not in SIDES or direction not in (BELOW, ABOVE) or \
+            threshold is None:
+        bot.sendMessage(chat_id=chat_id, text=usage)
+        return
+
+    preferences = utils.parse_args(bot, update, args)
+    if not preferences:
+        return
+    bank_name = preferences['bank_name'] or \
+        utils.get_user_selected_bank(user_id)
+    parser = utils.get_parser(bank_name)
+    if currency.upper() not in parser.allowed_currencies:
+        bot.sendMessage(chat_id=chat_id,
+                        text=_("Unknown currency: {}").format(currency))
+        return
+    alert = alert_manager.add(chat_id, parser.short_name, currency,
+                              side, direction, threshold)
+    bot.sendMessage(chat_id=chat_id,
+                    text=_("Alert set: {}").format(alert.describe()))
+
+
+@log_exceptions
+def list_alerts(bot, update, args):
+    chat_id = update.message.chat_id
+    if alert_manager is None:
+        _reply_unavailable(bot, chat_id)
+        return
+    if args and args[0] == 'clear':
+        removed = alert_manager.clear(chat_id)
+        bot.sendMessage(chat_id=chat_id,
+                        text=_("Removed {} alerts").format(removed))
+        return
+    alerts = alert_manager.alerts_of(chat_id)
+    if not alerts:
+        bot.sendMessage(chat_id=chat_id, text=_("You have no alerts"))
+        return
+    bot.sendMessage(chat_id=chat_id,
+                    text="\n".join(alert.describe() for alert in alerts))
+
+
 @log_exceptions
 def list_banks(bot, update):
     """Show user names of banks that are supported"""
@@ -90,7 +245,6 @@ def list_banks(bot, update):
     return
 
 
-@run_async
 @log_statistics
 @log_exceptions
 def course(bot, update, args, **kwargs):
@@ -112,19 +266,10 @@ def course(bot, update, args, **kwargs):
                                                datetime.date.today())
     if preferences['currency'] == 'all':
         # We need to send data about all of the currencies
-        all_currencies = cache_proxy.get_all_currencies(parser_instance,
-                                                        date=parse_date)
-
-        all_currencies = utils.sort_currencies(all_currencies)
-        displayed_values = [utils.format_currency_string(x)
-                            for x in all_currencies]
-        header = [_("\tBuy\tSell"), ]
-
-        currencies_text_value = "\n".join(header + displayed_values)
+        text = render_all_currencies(parser_instance, parse_date)
         bot.sendChatAction(chat_id=chat_id, action=telegram.ChatAction.TYPING)
         bot.sendMessage(chat_id=chat_id,
-                        text=_("Currencies: \n{curs}").format(
-                            curs=currencies_text_value),
+                        text=text,
                         parse_mode=telegram.ParseMode.HTML)
 
         return
@@ -154,7 +299,50 @@ def course(bot, update, args, **kwargs):
         return
 
 
-@run_async
+def graph_series(parser, currency: str, days_diff: int,
+                 today: datetime.date,
+                 max_points: int=settings.GRAPH_MAX_POINTS) -> CurrencySeries:
+    """Daily rates of the currency for the last days_diff days,
+    downsampled to at most max_points points"""
+    dates = [utils.get_date_from_date_diff(d, today)
+             for d in range(days_diff + 1)]
+
+    # Dates falling on the same publication day share rates,
+    # so each publication day is looked up only once
+    calendar = parser.publication_calendar
+    publication_dates = sorted(set(calendar.effective_date(d)
+                                   for d in dates))
+
+    # Full daily history is read from cache, upstream is
+    # asked only for sampled dates that are not cached yet
+    cached = cache_proxy.get_cached_currencies(parser, currency,
+                                               publication_dates)
+    sampled_dates = set(
+        calendar.effective_date(utils.get_date_from_date_diff(d, today))
+        for d in utils.date_diffs_for_long_diff(days_diff))
+    to_fetch = sorted(sampled_dates.difference(cached))
+
+    # We use shared thread pool to asyncronously get pages
+    currencies_deque = deque(cached.items())
+    future_to_date = {}
+    try:
+        for date in to_fetch:
+            future = fetch_executor.submit(result_date_saver, parser,
+                                           currency, date)
+            future_to_date[future] = date
+        for future in as_completed(future_to_date):
+            data = future.result()
+            currencies_deque.append(data)
+    except (FetchQueueFullError, BotBankUnavailableError):
+        for future in future_to_date:
+            future.cancel()
+        raise
+
+    series = CurrencySeries.from_pairs(currencies_deque, iso=currency)
+    series = series.denominated().fill_gaps().resample(dates)
+    return series.downsample(max_points)
+
+
 @log_statistics
 @log_exceptions
 def show_currency_graph(bot, update, args, **kwargs):
@@ -186,10 +374,9 @@ def show_currency_graph(bot, update, args, **kwargs):
     if currency == 'all':
         currency = settings.DEFAULT_CURRENCY.upper()
 
-    date_diffs = utils.date_diffs_for_long_diff(days_diff)
-
     today = datetime.date.today()
-    dates = [utils.get_date_from_date_diff(d, today) for d in date_diffs]
+    dates = [utils.get_date_from_date_diff(d, today)
+             for d in range(days_diff + 1)]
     past_date, future_date = dates[0], dates[-1]
 
     plot_image_name = plotting.generate_plot_name(parser.short_name, currency,
@@ -203,23 +390,10 @@ def show_currency_graph(bot, update, args, **kwargs):
     output_file = os.path.join(settings.IMAGES_FOLDER, plot_image_name)
 
     if not utils.is_image_cached(output_file):
-
-        # We use thread pool to asyncronously get pages
-        currencies_deque = deque()
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_date = {executor.submit(result_date_saver,
-                                              parser_instance,
-                                              currency, date): date
-                              for date in dates}
-            for future in as_completed(future_to_date):
-                data = future.result()
-                currencies_deque.append(data)
-
-        currencies = utils.sort_by_value(currencies_deque, dates)
+        series = graph_series(parser_instance, currency, days_diff, today)
         logging.info("Creating a plot.")
-        x = [d for d in dates]
-        y_buy = [c.buy / c.multiplier for c in currencies]
-        y_sell = [c.sell / c.multiplier for c in currencies]
+        x = series.to_dates()
+        y_buy, y_sell = series.normalized()
         plotting.render_exchange_rate_plot(x, y_buy, y_sell, output_file)
         plotting.reset_plot()
 
@@ -263,7 +437,6 @@ def set_default_bank(bot, update, args):
                     text=msg.format(bank_name))
 
 
-@run_async
 @log_statistics
 @log_exceptions
 def best_course(bot, update, args, **kwargs):
@@ -303,9 +476,8 @@ def inline_rate(bot, update):
 
     results = list()
 
-    parser_classes = utils.get_parser_classes()
-    parsers = [parser(cache=default_cache)
-               for parser in parser_classes]
+    parsers = [parser for parser in utils.get_parsers()
+               if parser.is_available()]
 
     for parser in parsers:
         # Best exchange rate in inline mode
@@ -319,7 +491,13 @@ def inline_rate(bot, update):
             currency = temp_list[0]
             if currency.upper() not in parser.allowed_currencies:
                 continue
-            best = utils.get_best_currencies(currency)
+            try:
+                best = utils.get_best_currencies(currency)
+            except BotLoggedError as e:
+                # Best rate does not depend on the parser, query is
+                # answered with no results rather than left hanging
+                logger.warning(str(e))
+                break
             buy_msg = _("Buy {}: <b>{}</b> - {}")
             buy_msg = buy_msg.format(best["buy"][1].iso,
                                      best["buy"][0],
@@ -341,8 +519,13 @@ def inline_rate(bot, update):
             return
         if query.upper() not in parser.allowed_currencies:
             continue
-        cur_value = cache_proxy.get_currency(parser,
-                                             query.upper())
+        try:
+            cur_value = cache_proxy.get_currency(parser,
+                                                 query.upper())
+        except BotLoggedError as e:
+            # Other banks are still answered
+            logger.warning(str(e))
+            continue
         bank_name = parser.name
         text = "{}\n<b>{}</b>: {}".format(bank_name,
                                           query.upper(),
@@ -1,4 +1,5 @@
-from typing import Union, Dict
+from array import array
+from typing import Dict, Iterable, Iterator, Union
 
 
 class Currency(object):
@@ -32,8 +33,7 @@ class Currency(object):
         return sell_equal and buy_equal and iso_equal and mul_equal
 
     def __hash__(self) -> int:
-        s = self.iso + str(self.sell) + str(self.buy)
-        return hash(s)
+        return hash((self.iso, self.sell, self.buy))
 
     @classmethod
     def empty_currency(cls):
@@ -55,3 +55,72 @@ class Currency(object):
     @classmethod
     def from_dict(cls, d: Dict[str, Union[str, float, int]]):
         return cls(**d)
+
+
+class RateTable(object):
+    """
+    Exchange rates of a bank for a single date. Values are stored
+    in flat arrays with an iso -> index map, so that lookups by
+    currency code take O(1). Iterating yields Currency objects.
+    `fetched_at` is the time cached snapshots were fetched at,
+    it identifies version of today's rates.
+    """
+    __slots__ = ('_index', '_names', '_isos', '_buy', '_sell', '_multiplier',
+                 'fetched_at')
+
+    def __init__(self, currencies: Iterable[Currency]=(),
+                 fetched_at: float=None) -> None:
+        self.fetched_at = fetched_at
+        self._index = {}  # type: Dict[str, int]
+        self._names = []
+        self._isos = []
+        self._buy = array('d')
+        self._sell = array('d')
+        self._multiplier = array('l')
+        for currency in currencies:
+            self.add(currency)
+
+    def add(self, currency: Currency) -> None:
+        """Adds currency, replacing the one with the same iso code,
+        empty currencies are skipped"""
+        if currency is None or currency.is_empty():
+            return
+        key = currency.iso.upper()
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self._isos)
+            self._names.append(currency.name)
+            self._isos.append(currency.iso)
+            self._buy.append(currency.buy)
+            self._sell.append(currency.sell)
+            self._multiplier.append(currency.multiplier or 0)
+            return
+        self._names[i] = currency.name
+        self._isos[i] = currency.iso
+        self._buy[i] = currency.buy
+        self._sell[i] = currency.sell
+        self._multiplier[i] = currency.multiplier or 0
+
+    def _currency(self, i: int) -> Currency:
+        return Currency(self._names[i], self._isos[i],
+                        sell=self._sell[i],
+                        buy=self._buy[i],
+                        multiplier=self._multiplier[i])
+
+    def get(self, iso: str, default: Currency=None) -> Currency:
+        i = self._index.get(iso.upper())
+        if i is None:
+            return default
+        return self._currency(i)
+
+    def __contains__(self, iso: str) -> bool:
+        return iso.upper() in self._index
+
+    def __len__(self) -> int:
+        return len(self._isos)
+
+    def __iter__(self) -> Iterator[Currency]:
+        return (self._currency(i) for i in range(len(self._isos)))
+
+    def __repr__(self) -> str:
+        return "RateTable({})".format(", ".join(self._isos))
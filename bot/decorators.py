@@ -6,6 +6,7 @@ import functools
 
 import telegram
 
+from bot import metrics
 from bot.exceptions import BotLoggedError
 from bot.settings import logging
 
@@ -38,5 +39,6 @@ def log_statistics(bot_func):
         chat_id = update.message.chat_id
         msg = "{} triggered, user_id: {}, chat_id {}"
         logger.info(msg.format(message, user_id, chat_id))
-        bot_func(bot, update, *args, **kwargs)
+        with metrics.COMMAND_SECONDS.time(command=bot_func.__name__):
+            bot_func(bot, update, *args, **kwargs)
     return wrapper
@@ -8,3 +8,11 @@ class BotParserLookupError(Exception):
 
 class BotLoggedError(Exception):
     """When this exception is raised its message is sent back to user"""
+
+
+class BotCacheSnapshotError(Exception):
+    """Cache snapshot file is damaged or of unsupported version"""
+
+
+class BotBankUnavailableError(BotLoggedError):
+    """Bank site failed to respond or its circuit breaker is open"""
@@ -0,0 +1,81 @@
+"""
+Process-wide executor used for all bank fetches.
+
+Total number of fetch threads, number of queued fetches and number of
+concurrent requests to every bank host are bounded no matter how many
+commands are being served at once.
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+from urllib.parse import urlparse
+
+from bot import metrics
+from bot import settings
+from bot.exceptions import BotLoggedError
+
+
+class FetchQueueFullError(BotLoggedError):
+    """Too many fetches are already queued"""
+
+
+class FetchExecutor(object):
+
+    def __init__(self,
+                 max_workers: int=settings.FETCH_WORKERS,
+                 max_queue_depth: int=settings.FETCH_QUEUE_DEPTH,
+                 per_host_limit: int=settings.FETCH_PER_HOST_LIMIT) -> None:
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.per_host_limit = per_host_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._host_semaphores = {}  # type: Dict[str, threading.BoundedSemaphore]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedules fn(*args, **kwargs), raises FetchQueueFullError
+        if the number of queued and running fetches hits the limit
+        """
+        with self._lock:
+            if self._pending >= self.max_queue_depth:
+                metrics.FETCH_REJECTED.inc()
+                raise FetchQueueFullError(
+                    "Bot is too busy at the moment, please try later")
+            self._pending += 1
+            metrics.FETCH_QUEUE_DEPTH.set(self._pending)
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._task_done(None)
+            raise
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+            metrics.FETCH_QUEUE_DEPTH.set(self._pending)
+
+    def host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        """Semaphore limiting concurrent requests to the url's host"""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def shutdown(self, wait: bool=True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+fetch_executor = FetchExecutor()
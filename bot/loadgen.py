@@ -0,0 +1,264 @@
+"""
+Synthetic load generator for the bot dispatcher.
+
+Builds the same dispatcher as production (via create_bot), replaces
+the telegram Bot object with a fake one that records outgoing calls
+and feeds synthetic updates straight into the handlers from a number
+of concurrent virtual users.
+
+Usage:
+    python -m bot.loadgen -n 200 -c 20 -l heavy=8 "/course" "/graph -d 30"
+"""
+
+import argparse
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Sequence
+
+import telegram
+
+from bot import settings
+from bot.telegrambot import create_bot
+
+
+FAKE_TOKEN = '123456:LOADGEN'
+
+DEFAULT_SCENARIO = (
+    '/course',
+    '/course -c USD',
+    '/graph -d 30',
+    '/best -c USD',
+    '/set nbrb',
+    'inline:USD',
+)
+
+INLINE_PREFIX = 'inline:'
+
+logger = logging.getLogger('telegrambot')
+
+
+class FakeBot(object):
+    """
+    Stands in for telegram.Bot: every API method call is recorded
+    instead of being sent to Telegram.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def recorder(*args, **kwargs):
+            for value in kwargs.values():
+                # sendPhoto receives an opened file
+                if hasattr(value, 'close'):
+                    value.close()
+            with self._lock:
+                self.calls.append((time.time(), name, args, kwargs))
+            return None
+        return recorder
+
+    def calls_for(self, method: str) -> List[Any]:
+        with self._lock:
+            return [c for c in self.calls if c[1] == method]
+
+
+def make_message_update(update_id: int, user_id: int, text: str):
+    """Builds a private chat message update for the given user"""
+    data = {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'first_name': 'loadgen'},
+        }
+    }
+    return telegram.Update.de_json(data, None)
+
+
+def make_inline_update(update_id: int, user_id: int, query: str):
+    """Builds an inline query update for the given user"""
+    data = {
+        'update_id': update_id,
+        'inline_query': {
+            'id': str(update_id),
+            'query': query,
+            'offset': '',
+            'from': {'id': user_id, 'first_name': 'loadgen'},
+        }
+    }
+    return telegram.Update.de_json(data, None)
+
+
+def make_update(update_id: int, user_id: int, scenario_item: str):
+    if scenario_item.startswith(INLINE_PREFIX):
+        query = scenario_item[len(INLINE_PREFIX):]
+        return make_inline_update(update_id, user_id, query)
+    return make_message_update(update_id, user_id, scenario_item)
+
+
+def command_label(scenario_item: str) -> str:
+    """
+    >>> command_label('/graph -d 30')
+    'graph'
+    """
+    if scenario_item.startswith(INLINE_PREFIX):
+        return 'inline'
+    return scenario_item.split()[0].lstrip('/')
+
+
+def dispatch_and_wait(dispatcher, update) -> None:
+    """
+    Mirrors Dispatcher.process_update, but waits for the
+    handler to finish even if it was scheduled asynchronously.
+    """
+    for group in dispatcher.groups:
+        for handler in dispatcher.handlers[group]:
+            if handler.check_update(update):
+                result = handler.handle_update(update, dispatcher)
+                # Scheduled handlers return a future
+                if hasattr(result, 'result'):
+                    result.result()
+                return
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of the given values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    rank = min(max(rank, 0), len(ordered) - 1)
+    return ordered[rank]
+
+
+def summarize(latencies: Mapping[str, Sequence[float]],
+              errors: Mapping[str, int],
+              elapsed: float) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for label, values in sorted(latencies.items()):
+        summary[label] = {
+            'count': len(values),
+            'errors': errors.get(label, 0),
+            'throughput': len(values) / elapsed if elapsed else 0.0,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+    return summary
+
+
+def run_load(scenario: Sequence[str]=DEFAULT_SCENARIO,
+             total_requests: int=100,
+             concurrency: int=10,
+             workers: int=settings.DISPATCHER_WORKERS,
+             lanes: Mapping[str, int]=settings.SCHEDULER_LANES,
+             fake_bot: FakeBot=None):
+    """
+    Runs total_requests updates cycling through the scenario
+    from `concurrency` virtual users. Returns a tuple of
+    (summary, elapsed seconds, fake bot).
+    """
+    fake_bot = fake_bot or FakeBot()
+    bot = create_bot(FAKE_TOKEN, workers=workers, lanes=lanes)
+    dispatcher = bot.dispatcher
+    dispatcher.bot = fake_bot
+
+    dispatcher_thread = threading.Thread(target=dispatcher.start,
+                                         name='loadgen_dispatcher')
+    dispatcher_thread.start()
+    while not dispatcher.running:
+        time.sleep(0.01)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    latencies_lock = threading.Lock()
+    items = itertools.cycle(scenario)
+
+    def one_request(update_id, scenario_item):
+        user_id = update_id % concurrency + 1
+        update = make_update(update_id, user_id, scenario_item)
+        label = command_label(scenario_item)
+        start = time.time()
+        try:
+            dispatch_and_wait(dispatcher, update)
+        except Exception:
+            logger.exception("Load generator request failed.")
+            with latencies_lock:
+                errors[label] += 1
+        finally:
+            took = time.time() - start
+            with latencies_lock:
+                latencies[label].append(took)
+
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for update_id in range(1, total_requests + 1):
+                executor.submit(one_request, update_id, next(items))
+    finally:
+        elapsed = time.time() - start
+        dispatcher.stop()
+        dispatcher_thread.join()
+        bot.scheduler.shutdown()
+
+    return summarize(latencies, errors, elapsed), elapsed, fake_bot
+
+
+def format_report(summary: Mapping[str, Mapping[str, float]],
+                  elapsed: float) -> str:
+    header = '{:<10}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'command', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')
+    lines = [header]
+    total = 0
+    for label, stats in summary.items():
+        total += stats['count']
+        lines.append('{:<10}{:>8}{:>8}{:>10.2f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            label, stats['count'], stats['errors'], stats['throughput'],
+            stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000))
+    lines.append('Total: {} requests in {:.2f}s ({:.2f} req/s)'.format(
+        total, elapsed, total / elapsed if elapsed else 0.0))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('scenario', nargs='*',
+                            default=list(DEFAULT_SCENARIO),
+                            help='Commands to cycle through, '
+                                 '"inline:<query>" for inline queries')
+    arg_parser.add_argument('-n', '--requests', type=int, default=100)
+    arg_parser.add_argument('-c', '--concurrency', type=int, default=10)
+    arg_parser.add_argument('-w', '--workers', type=int,
+                            default=settings.DISPATCHER_WORKERS,
+                            help='Number of dispatcher worker threads, '
+                                 'handlers run in scheduler lanes (-l)')
+    arg_parser.add_argument('-l', '--lanes', default='',
+                            help='Scheduler lane sizes overrides, '
+                                 'e.g. "standard=8,heavy=2"')
+    args = arg_parser.parse_args(argv)
+
+    lanes = dict(settings.SCHEDULER_LANES)
+    if args.lanes:
+        lanes.update(settings.parse_lane_sizes(args.lanes))
+
+    summary, elapsed, _ = run_load(args.scenario,
+                                   total_requests=args.requests,
+                                   concurrency=args.concurrency,
+                                   workers=args.workers,
+                                   lanes=lanes)
+    print(format_report(summary, elapsed))
+
+
+if __name__ == '__main__':
+    main()
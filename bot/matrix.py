@@ -0,0 +1,184 @@
+"""
+Materialized bank x currency matrix of today's exchange rates.
+
+Rows are updated whenever a bank's rates for today are fetched, best
+rates per currency are recomputed for the touched columns only, so
+looking them up does not require scraping every bank.
+"""
+
+import datetime
+import threading
+import time
+from typing import Callable, Dict, Iterable, Tuple
+
+import numpy as np
+
+from bot.cache.cache_proxy import effective_date
+from bot.currency import Currency
+
+
+class RateMatrix(object):
+    """
+    Holds buy and sell rates as (banks x currencies) arrays,
+    NaN marks rates a bank does not provide. The matrix is
+    reset once the first rates of a new day arrive.
+    """
+
+    def __init__(self, clock: Callable[[], float]=time.time) -> None:
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._rows = {}  # type: Dict[str, int]
+        self._bank_names = []
+        self._columns = {}  # type: Dict[str, int]
+        self.date = None
+        self.buy = np.full((0, 0), np.nan)
+        self.sell = np.full((0, 0), np.nan)
+        self.fetched_at = np.zeros((0, 0))
+        # Row of the extreme value for every column, -1 if none
+        self._argmin = {'buy': np.zeros(0, dtype=int),
+                        'sell': np.zeros(0, dtype=int)}
+        self._argmax = {'buy': np.zeros(0, dtype=int),
+                        'sell': np.zeros(0, dtype=int)}
+
+    def _add_row(self, short_name: str, name: str) -> int:
+        row = len(self._bank_names)
+        self._rows[short_name] = row
+        self._bank_names.append(name)
+        n_columns = len(self._columns)
+        self.buy = np.vstack([self.buy, np.full((1, n_columns), np.nan)])
+        self.sell = np.vstack([self.sell, np.full((1, n_columns), np.nan)])
+        self.fetched_at = np.vstack([self.fetched_at,
+                                     np.zeros((1, n_columns))])
+        return row
+
+    def _add_column(self, iso: str) -> int:
+        column = len(self._columns)
+        self._columns[iso] = column
+        n_rows = len(self._bank_names)
+        self.buy = np.hstack([self.buy, np.full((n_rows, 1), np.nan)])
+        self.sell = np.hstack([self.sell, np.full((n_rows, 1), np.nan)])
+        self.fetched_at = np.hstack([self.fetched_at, np.zeros((n_rows, 1))])
+        for extremes in (self._argmin, self._argmax):
+            for side in extremes:
+                extremes[side] = np.append(extremes[side], -1)
+        return column
+
+    def _reset(self, date: datetime.date) -> None:
+        self.date = date
+        self.buy.fill(np.nan)
+        self.sell.fill(np.nan)
+        self.fetched_at.fill(0)
+        for extremes in (self._argmin, self._argmax):
+            for side in extremes:
+                extremes[side].fill(-1)
+
+    def update(self, short_name: str,
+               name: str,
+               date: datetime.date,
+               currencies: Iterable[Currency],
+               complete: bool=True) -> None:
+        """
+        Puts bank's rates for the date into the matrix. If the rates
+        are complete, currencies missing from them are cleared.
+        """
+        with self._lock:
+            if self.date is not None and date < self.date:
+                return
+            if date != self.date:
+                self._reset(date)
+            row = self._rows.get(short_name)
+            if row is None:
+                row = self._add_row(short_name, name)
+            now = self._clock()
+            if complete:
+                self.buy[row].fill(np.nan)
+                self.sell[row].fill(np.nan)
+                self.fetched_at[row].fill(now)
+            touched = []
+            for currency in currencies:
+                if currency is None or currency.is_empty():
+                    continue
+                iso = currency.iso.upper()
+                column = self._columns.get(iso)
+                if column is None:
+                    column = self._add_column(iso)
+                multiplier = currency.multiplier or 1
+                self.buy[row, column] = currency.buy / multiplier
+                self.sell[row, column] = currency.sell / multiplier
+                self.fetched_at[row, column] = now
+                touched.append(column)
+            if complete:
+                touched = list(range(len(self._columns)))
+            self._recompute(touched)
+
+    def _recompute(self, columns) -> None:
+        if not columns:
+            return
+        columns = np.array(columns, dtype=int)
+        for side, values in (('buy', self.buy), ('sell', self.sell)):
+            subset = values[:, columns]
+            missing = np.isnan(subset)
+            no_values = missing.all(axis=0)
+            argmin = np.where(missing, np.inf, subset).argmin(axis=0)
+            argmax = np.where(missing, -np.inf, subset).argmax(axis=0)
+            self._argmin[side][columns] = np.where(no_values, -1, argmin)
+            self._argmax[side][columns] = np.where(no_values, -1, argmax)
+
+    def is_fresh(self, short_name: str,
+                 iso: str,
+                 date: datetime.date,
+                 max_age: float) -> bool:
+        """True if bank's rate for the currency was updated
+        not earlier than max_age seconds ago"""
+        with self._lock:
+            row = self._rows.get(short_name)
+            column = self._columns.get(iso.upper())
+            if date != self.date or row is None or column is None:
+                return False
+            age = self._clock() - self.fetched_at[row, column]
+            return age < max_age
+
+    def _currency(self, row: int, column: int, iso: str) -> Currency:
+        return Currency(iso, iso,
+                        sell=float(self.sell[row, column]),
+                        buy=float(self.buy[row, column]))
+
+    def _extreme(self, extremes, side: str, iso: str) -> Tuple[str, Currency]:
+        column = self._columns.get(iso)
+        if column is None:
+            return None
+        row = extremes[side][column]
+        if row < 0:
+            return None
+        return self._bank_names[row], self._currency(row, column, iso)
+
+    def lowest(self, iso: str, side: str='sell') -> Tuple[str, Currency]:
+        """(bank name, currency) with the lowest rate, None if unknown"""
+        with self._lock:
+            return self._extreme(self._argmin, side, iso.upper())
+
+    def highest(self, iso: str, side: str='sell') -> Tuple[str, Currency]:
+        """(bank name, currency) with the highest rate, None if unknown"""
+        with self._lock:
+            return self._extreme(self._argmax, side, iso.upper())
+
+    def bank_rates(self, short_name: str) -> Dict[str, Currency]:
+        """Today's rates of the given bank by currency"""
+        with self._lock:
+            row = self._rows.get(short_name)
+            if row is None:
+                return {}
+            return {iso: self._currency(row, column, iso)
+                    for iso, column in self._columns.items()
+                    if not np.isnan(self.sell[row, column])}
+
+    def on_snapshot(self, parser, date: datetime.date,
+                    currencies: Iterable[Currency],
+                    complete: bool) -> None:
+        """Snapshot listener to be registered with CacheProxy, banks
+        closed today keep rates of their last publication day"""
+        today = datetime.date.today()
+        if date != effective_date(parser, today):
+            return
+        self.update(parser.short_name, parser.name, today,
+                    currencies, complete=complete)
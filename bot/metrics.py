@@ -0,0 +1,300 @@
+"""
+Minimal in-process metrics collection.
+
+Counters, gauges and histograms are registered in a registry and
+rendered in Prometheus text exposition format, optionally served
+over HTTP on a local port:
+
+    with metrics.BANK_FETCH_SECONDS.time(bank='nbrb'):
+        requests.get(...)
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, Sequence, Tuple
+
+logger = logging.getLogger('telegrambot')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _label_set(labels: Dict[str, object]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', r'\\')
+                 .replace('\n', r'\n')
+                 .replace('"', r'\"'))
+
+
+def _format_labels(label_set: LabelSet) -> str:
+    if not label_set:
+        return ''
+    pairs = ('{}="{}"'.format(k, _escape(v)) for k, v in label_set)
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric(object):
+    """Base class for all metric types"""
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _samples(self):
+        """Yields (suffix, label set, value) tuples"""
+        with self._lock:
+            items = list(self._values.items())
+        for label_set, value in sorted(items):
+            yield '', label_set, value
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type_name)]
+        for suffix, label_set, value in self._samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            _format_labels(label_set),
+                                            _format_value(value)))
+        return '\n'.join(lines)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_set(labels), 0.0)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = _label_set(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_set(labels)] = value
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = _label_set(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float=1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 buckets: Sequence[float]=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_set(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum and count
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes time spent inside the block, usable as decorator"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(_label_set(labels))
+            return state[2] if state else 0
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2]))
+                     for k, v in self._values.items()]
+        for label_set, (counts, total, count) in sorted(items):
+            cumulative = 0
+            bounds = self.buckets + (float('inf'),)
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                bucket_labels = label_set + (('le', _format_value(bound)),)
+                yield '_bucket', bucket_labels, cumulative
+            yield '_sum', label_set, total
+            yield '_count', label_set, count
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_cls):
+                msg = "Metric {} is already registered as {}"
+                raise ValueError(msg.format(name, metric.type_name))
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str,
+                  buckets: Sequence[float]=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation,
+                              buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[k] for k in sorted(self._metrics)]
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    'bot_command_seconds', 'Time spent handling a bot command')
+ARGS_PARSE_SECONDS = REGISTRY.histogram(
+    'bot_args_parse_seconds', 'Time spent parsing command arguments')
+WEBHOOK_UPDATES = REGISTRY.counter(
+    'bot_webhook_updates_total', 'Webhook requests by outcome')
+UPDATE_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_update_queue_depth', 'Updates waiting for the dispatcher')
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_scheduler_queue_depth', 'Commands waiting for a worker per lane')
+SCHEDULER_WAIT_SECONDS = REGISTRY.histogram(
+    'bot_scheduler_wait_seconds', 'Time commands wait for a worker per lane')
+CACHE_LOOKUP_SECONDS = REGISTRY.histogram(
+    'bot_cache_lookup_seconds',
+    'Time spent reading from cache by backend, bank and operation')
+CACHE_WRITE_SECONDS = REGISTRY.histogram(
+    'bot_cache_write_seconds',
+    'Time spent writing to cache by backend, bank and operation')
+CACHE_REQUESTS = REGISTRY.counter(
+    'bot_cache_requests_total',
+    'Cache lookups by backend, bank, operation and result: '
+    'hit, negative_hit or miss')
+CACHE_BYTES = REGISTRY.counter(
+    'bot_cache_bytes_total',
+    'Size of cached values read and written by bank and direction')
+CACHE_TIER_REQUESTS = REGISTRY.counter(
+    'bot_cache_tier_requests_total',
+    'Two-tier cache lookups by tier (local or backend) and result')
+SNAPSHOT_REQUESTS = REGISTRY.counter(
+    'bot_snapshot_requests_total',
+    "Today's rates requests by bank and result: fresh, stale, "
+    "refreshed or stale_if_error")
+ALERTS_TRIGGERED = REGISTRY.counter(
+    'bot_alerts_triggered_total', 'Rate alerts sent by bank')
+RESPONSE_CACHE_REQUESTS = REGISTRY.counter(
+    'bot_response_cache_requests_total',
+    'Rendered response cache lookups by result')
+BANK_FETCH_SECONDS = REGISTRY.histogram(
+    'bot_bank_fetch_seconds', 'Time spent fetching bank pages')
+BANK_FETCHES = REGISTRY.counter(
+    'bot_bank_fetches_total', 'Number of HTTP requests made to banks')
+BANK_FETCH_RETRIES = REGISTRY.counter(
+    'bot_bank_fetch_retries_total', 'Number of retried bank requests')
+BANK_FETCH_FAILURES = REGISTRY.counter(
+    'bot_bank_fetch_failures_total', 'Bank fetches failed after retries')
+CIRCUIT_BREAKER_STATE = REGISTRY.gauge(
+    'bot_circuit_breaker_state',
+    'Circuit breaker state: 0 - closed, 1 - half-open, 2 - open')
+FETCH_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_fetch_queue_depth', 'Fetches queued or running in the executor')
+FETCH_REJECTED = REGISTRY.counter(
+    'bot_fetch_rejected_total', 'Fetches rejected due to full queue')
+BANK_PARSE_SECONDS = REGISTRY.histogram(
+    'bot_bank_parse_seconds', 'Time spent parsing bank pages')
+PLOT_RENDER_SECONDS = REGISTRY.histogram(
+    'bot_plot_render_seconds', 'Time spent rendering graphs')
+OUTBOX_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_outbox_queue_depth', 'Outgoing messages waiting to be sent')
+OUTBOX_WAIT_SECONDS = REGISTRY.histogram(
+    'bot_outbox_wait_seconds', 'Time from queueing a message to sending it')
+OUTBOX_MESSAGES = REGISTRY.counter(
+    'bot_outbox_messages_total',
+    'Outgoing messages by method and result: sent, failed or dropped')
+OUTBOX_RETRIES = REGISTRY.counter(
+    'bot_outbox_retries_total', 'Messages retried after flood limit errors')
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    'bot_telegram_send_seconds', 'Time spent in Telegram API calls')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _handler_for(registry: MetricsRegistry):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format % args)
+
+    return MetricsHandler
+
+
+def start_metrics_server(port: int,
+                         host: str='127.0.0.1',
+                         registry: MetricsRegistry=REGISTRY) -> HTTPServer:
+    """Serves metrics in a background thread, returns the server"""
+    server = ThreadingHTTPServer((host, port), _handler_for(registry))
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics_server', daemon=True)
+    thread.start()
+    logger.info("Serving metrics on {}:{}".format(*server.server_address))
+    return server
@@ -0,0 +1,279 @@
+"""
+Outgoing message queue.
+
+Handlers hand messages over to the outbox and return immediately,
+sender threads deliver them within Telegram's flood limits: a token
+bucket per chat (stricter one for group chats) and a global one.
+Messages of a chat are sent in order, one at a time; when Telegram
+answers with 429 the chat is paused for the requested time and the
+message is retried.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+from telegram.error import RetryAfter
+
+from bot import metrics
+from bot import settings
+
+logger = logging.getLogger('telegrambot')
+
+# Per-chat buckets of that many recently active chats are remembered
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket(object):
+    """`rate` tokens per second, up to `capacity` saved for bursts"""
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated_at)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+
+class _Message(object):
+
+    def __init__(self, method: Callable, args, kwargs) -> None:
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.time()
+        self.attempts = 0
+
+    @property
+    def name(self) -> str:
+        return getattr(self.method, '__name__', 'call')
+
+
+class Outbox(object):
+    """Queues API calls per chat and sends them respecting limits"""
+
+    def __init__(self, workers: int=settings.OUTBOX_WORKERS,
+                 global_rate: float=settings.OUTBOX_GLOBAL_RATE,
+                 chat_rate: float=settings.OUTBOX_CHAT_RATE,
+                 chat_burst: float=settings.OUTBOX_CHAT_BURST,
+                 group_rate: float=settings.OUTBOX_GROUP_RATE,
+                 group_burst: float=settings.OUTBOX_GROUP_BURST,
+                 max_retries: int=settings.OUTBOX_MAX_RETRIES) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(1.0, global_rate),
+                                   time.time())
+        self._buckets = collections.OrderedDict()  # chat_id -> TokenBucket
+        self._queues = {}  # chat_id -> deque of messages
+        # (ready_at, seq, chat_id) of chats waiting for their turn,
+        # chats with a message being sent are not there
+        self._ready = []  # type: List[Tuple[float, int, object]]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None
+        self._stopped = False
+        self._deadline = None
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._dispatch,
+                                        name='outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=5.0) -> None:
+        """Stops after sending queued messages for up to `timeout`
+        seconds, messages left after that are dropped"""
+        with self._cond:
+            self._stopped = True
+            self._deadline = time.time() + timeout
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout + 1)
+        self._executor.shutdown(wait=True)
+        with self._cond:
+            dropped = self._pending
+        if dropped:
+            logger.warning("Dropped {} unsent messages".format(dropped))
+            metrics.OUTBOX_MESSAGES.inc(dropped, method='any',
+                                        result='dropped')
+
+    def submit(self, chat_id, method: Callable,
+               args: tuple=(), kwargs: dict=None) -> Future:
+        """Queues method call for the chat, returns future of its result"""
+        kwargs = kwargs or {}
+        message = _Message(method, args, kwargs)
+        with self._cond:
+            queued = self._thread is not None and not self._stopped
+        if not queued:
+            # Outbox is not running, message is sent right away
+            try:
+                message.future.set_result(method(*args, **kwargs))
+            except Exception as e:
+                message.future.set_exception(e)
+            return message.future
+        with self._cond:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = collections.deque()
+                heapq.heappush(self._ready,
+                               (time.time(), next(self._seq), chat_id))
+                self._cond.notify()
+            queue.append(message)
+            self._pending += 1
+            metrics.OUTBOX_QUEUE_DEPTH.set(self._pending)
+        return message.future
+
+    def _bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._buckets[chat_id] = bucket
+            if len(self._buckets) > MAX_CHAT_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def _next_message(self):
+        """Waits for a chat whose turn has come, returns (chat_id, message)
+        or None once stopped"""
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._stopped and (not self._queues or
+                                      now >= self._deadline):
+                    return None
+                timeout = 0.1 if self._stopped else None
+                if not self._ready:
+                    self._cond.wait(timeout)
+                    continue
+                ready_at, _, chat_id = self._ready[0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now if timeout is None
+                                    else min(timeout, ready_at - now))
+                    continue
+                bucket = self._bucket(chat_id, now)
+                wait = max(bucket.wait_time(now), self._global.wait_time(now))
+                if wait > 0:
+                    heapq.heapreplace(self._ready,
+                                      (now + wait, next(self._seq), chat_id))
+                    continue
+                heapq.heappop(self._ready)
+                bucket.take(now)
+                self._global.take(now)
+                return chat_id, self._queues[chat_id][0]
+
+    def _dispatch(self) -> None:
+        while True:
+            item = self._next_message()
+            if item is None:
+                return
+            try:
+                self._executor.submit(self._send, *item)
+            except RuntimeError:
+                # Executor was shut down by stop()
+                return
+
+    def _send(self, chat_id, message: _Message) -> None:
+        message.attempts += 1
+        try:
+            result = message.method(*message.args, **message.kwargs)
+        except RetryAfter as e:
+            if message.attempts <= self.max_retries:
+                logger.warning("Flood limit hit for chat {}, retrying in "
+                               "{}s".format(chat_id, e.retry_after))
+                metrics.OUTBOX_RETRIES.inc(method=message.name)
+                self._requeue(chat_id, time.time() + e.retry_after)
+                return
+            self._done(chat_id, message, error=e)
+            return
+        except Exception as e:
+            self._done(chat_id, message, error=e)
+            return
+        self._done(chat_id, message, result=result)
+
+    def _requeue(self, chat_id, ready_at: float) -> None:
+        with self._cond:
+            heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+            self._cond.notify()
+
+    def _done(self, chat_id, message: _Message,
+              result=None, error: Exception=None) -> None:
+        with self._cond:
+            queue = self._queues[chat_id]
+            queue.popleft()
+            if queue:
+                heapq.heappush(self._ready,
+                               (time.time(), next(self._seq), chat_id))
+            else:
+                del self._queues[chat_id]
+            self._pending -= 1
+            metrics.OUTBOX_QUEUE_DEPTH.set(self._pending)
+            self._cond.notify()
+        metrics.OUTBOX_WAIT_SECONDS.observe(time.time() - message.queued_at)
+        if error is not None:
+            logger.error("Sending {} to chat {} failed: {}".format(
+                message.name, chat_id, error))
+            metrics.OUTBOX_MESSAGES.inc(method=message.name, result='failed')
+            message.future.set_exception(error)
+        else:
+            metrics.OUTBOX_MESSAGES.inc(method=message.name, result='sent')
+            message.future.set_result(result)
+
+
+class QueuedBot(object):
+    """
+    Proxies telegram.Bot sending chat messages through the outbox,
+    queued methods return futures instead of sent messages.
+    """
+    QUEUED_METHODS = ('sendMessage', 'sendPhoto', 'sendChatAction',
+                      'sendDocument', 'sendSticker', 'sendLocation')
+
+    def __init__(self, bot, outbox: Outbox) -> None:
+        self._bot = bot
+        self._outbox = outbox
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if name not in self.QUEUED_METHODS:
+            return attr
+
+        def queued(*args, **kwargs):
+            chat_id = kwargs.get('chat_id', args[0] if args else None)
+            return self._outbox.submit(chat_id, attr, args, kwargs)
+        queued.__name__ = name
+        return queued
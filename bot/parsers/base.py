@@ -1,10 +1,22 @@
 # coding: utf-8
 from abc import ABCMeta, abstractmethod
 
+import logging
 import re
 
+import requests
+
+from bot import metrics
+from bot import resilience
+from bot import settings
+from bot.exceptions import BotBankUnavailableError
+from bot.fetch import fetch_executor
+from bot.publication import DailyCalendar
+
 NUMBER_REGEX = re.compile(r'^\d+')
 
+logger = logging.getLogger('telegrambot')
+
 
 class BaseParser(object, metaclass=ABCMeta):
 
@@ -12,6 +24,27 @@ class BaseParser(object, metaclass=ABCMeta):
     allowed_currencies = tuple()
     name = 'Base Parser'
     short_name = 'base'
+    # Days on which the bank publishes new rates
+    publication_calendar = DailyCalendar()
+
+    CONNECT_TIMEOUT = settings.BANK_CONNECT_TIMEOUT
+    READ_TIMEOUT = settings.BANK_READ_TIMEOUT
+    MAX_RETRIES = settings.BANK_FETCH_RETRIES
+    RETRIABLE_ERRORS = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout,
+                        requests.exceptions.HTTPError)
+
+    @classmethod
+    def breaker(cls) -> resilience.CircuitBreaker:
+        return resilience.get_breaker(
+            cls.short_name,
+            failure_threshold=settings.BANK_BREAKER_THRESHOLD,
+            cooldown=settings.BANK_BREAKER_COOLDOWN)
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """False while the bank's circuit breaker is open"""
+        return not cls.breaker().is_open()
 
     @abstractmethod
     def get_all_currencies(self, date=None):
@@ -19,6 +52,51 @@ class BaseParser(object, metaclass=ABCMeta):
         (both sell and purchase)"""
         pass
 
+    @classmethod
+    def _get(cls, url: str, **kwargs) -> requests.models.Response:
+        """Performs GET request to the bank site, keeping track
+        of number of requests and time spent.
+
+        Requests time out, connection errors and server errors are
+        retried and then reported to the bank's circuit breaker;
+        BotBankUnavailableError is raised if the bank could not be
+        reached or the breaker is open.
+        """
+        breaker = cls.breaker()
+        unavailable_msg = "{} is temporarily unavailable, please try later"
+        if not breaker.allow_request():
+            raise BotBankUnavailableError(unavailable_msg.format(cls.name))
+        kwargs.setdefault('timeout', (cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
+
+        def fetch():
+            metrics.BANK_FETCHES.inc(bank=cls.short_name)
+            with fetch_executor.host_semaphore(url), \
+                    metrics.BANK_FETCH_SECONDS.time(bank=cls.short_name):
+                response = requests.get(url, **kwargs)
+            if response.status_code >= 500:
+                response.raise_for_status()
+            return response
+
+        def on_retry(error):
+            metrics.BANK_FETCH_RETRIES.inc(bank=cls.short_name)
+            logger.warning("Retrying {} request: {}".format(cls.short_name,
+                                                            error))
+
+        try:
+            response = resilience.call_with_retries(
+                fetch, cls.MAX_RETRIES, cls.RETRIABLE_ERRORS,
+                on_retry=on_retry)
+        except cls.RETRIABLE_ERRORS as e:
+            metrics.BANK_FETCH_FAILURES.inc(bank=cls.short_name)
+            logger.error("Error fetching {}: {}".format(url, e))
+            breaker.record_failure()
+            raise BotBankUnavailableError(unavailable_msg.format(cls.name))
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return response
+
     def _multiplier_from_name(self, name: str) -> int:
         """
         Attempts to extract multiplier from
@@ -1,11 +1,12 @@
 # coding: utf-8
 
 import datetime
-from typing import Sequence
 import requests
 from bs4 import BeautifulSoup
 
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
+from bot.publication import BusinessDayCalendar
 from .base import BaseParser
 
 import logging
@@ -22,6 +23,7 @@ class BelgazpromParser(BaseParser):
     MINIMAL_DATE = datetime.datetime(year=2004, month=5, day=1)
     allowed_currencies = ('USD', 'EUR', 'RUB', 'BYR',
                           'GBP', 'UAH', 'CHF', 'PLN', 'BYN')
+    publication_calendar = BusinessDayCalendar()
 
     def __init__(self, parser="lxml", *args, **kwargs):
         self.name = BelgazpromParser.name
@@ -40,7 +42,7 @@ class BelgazpromParser(BaseParser):
         str_date = datetime.date.strftime(supplied_date,
                                           BelgazpromParser.DATE_FORMAT)
         date_params = {"date": str_date}
-        r = requests.get(BelgazpromParser.BASE_URL, params=date_params)
+        r = self._get(BelgazpromParser.BASE_URL, params=date_params)
         return r
 
     def __soup_from_response(self,
@@ -57,22 +59,21 @@ class BelgazpromParser(BaseParser):
 
     def __get_currency_objects(self,
                                cur_table: BeautifulSoup,
-                               days_since_now=None) -> Sequence[Currency]:
+                               days_since_now=None) -> RateTable:
         """
         Parses BeautifulSoup table with exchanges rates and extracts
         currency data
         """
         if not days_since_now:
-            currencies = []
+            currencies = RateTable()
             exchange_table = cur_table.find('table').find('tbody')
             exchange_rows = exchange_table.find_all('tr')
             for row in exchange_rows:
                 try:
                     c = BelgazpromParser.__currency_object_from_row(row)
-                    currencies.append(c)
+                    currencies.add(c)
                 except ValueError:
                     logger.error("Error obtaining currency object from {}".format(row))
-                    currencies.append(Currency.empty_currency())
             return currencies
 
     @classmethod
@@ -89,7 +90,7 @@ class BelgazpromParser(BaseParser):
                         buy=float(buy))
 
     def get_all_currencies(self,
-                           date: datetime.date=None) -> Sequence[Currency]:
+                           date: datetime.date=None) -> RateTable:
         logger.info("Belgazprom: getting all currencies "
                     "for the {}".format(date))
         today = datetime.date.today()
@@ -98,9 +99,10 @@ class BelgazpromParser(BaseParser):
         assert isinstance(date, datetime.date), "Incorrect date supplied"
 
         r = self.__get_response_for_the_date(date)
-        s = self.__soup_from_response(r)
-        currency_table = self.__get_currency_table(s)
-        currencies = self.__get_currency_objects(currency_table)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            s = self.__soup_from_response(r)
+            currency_table = self.__get_currency_table(s)
+            currencies = self.__get_currency_objects(currency_table)
         return currencies
 
     def get_currency_for_diff_date(self,
@@ -122,9 +124,4 @@ class BelgazpromParser(BaseParser):
         assert isinstance(date, datetime.date), "Incorrect date supplied"
 
         currencies = self.get_all_currencies(date)
-
-        for cur in currencies:
-            if currency_name.upper() == cur.iso:
-                return cur
-        else:
-            return Currency.empty_currency()
+        return currencies.get(currency_name, Currency.empty_currency())
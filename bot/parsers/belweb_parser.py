@@ -3,10 +3,10 @@
 import datetime
 from urllib.parse import urljoin
 
-import requests
 from bs4 import BeautifulSoup
 
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
 from .base import BaseParser
 
 
@@ -32,8 +32,9 @@ class BelwebParser(BaseParser):
 
     def _currency_soup_for_date(self, date: datetime.date) -> BeautifulSoup:
         url = self._url_for_date(date)
-        resp = requests.get(url)
-        return BeautifulSoup(resp.text, self._parser)
+        resp = self._get(url)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            return BeautifulSoup(resp.text, self._parser)
 
     def _currency_from_row(self, row: BeautifulSoup) -> Currency:
         cells = row.find_all('td')
@@ -50,28 +51,25 @@ class BelwebParser(BaseParser):
         except AttributeError:
             return None
 
-    def get_all_currencies(self, date=None):
+    def get_all_currencies(self, date=None) -> RateTable:
         if date is None:
             date = datetime.date.today()
         soup = self._currency_soup_for_date(date)
-        tables = soup.find_all('table', class_='rates_second')
-        if not tables:
-            curs = []
-        else:
-            currency_table = tables[1]
-            rows = [row for row in currency_table.find_all('tr')][3:]
-            curs = filter(lambda x: x is not None,
-                          (self._currency_from_row(row) for row in rows))
-        return list(curs)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            tables = soup.find_all('table', class_='rates_second')
+            if not tables:
+                curs = []
+            else:
+                currency_table = tables[1]
+                rows = [row for row in currency_table.find_all('tr')][3:]
+                curs = filter(lambda x: x is not None,
+                              (self._currency_from_row(row) for row in rows))
+            return RateTable(curs)
 
     def get_currency(self, currency_name="USD", date=None):
         if date is None:
             date = datetime.date.today()
-        for cur in self.get_all_currencies(date):
-            if cur.iso == currency_name:
-                return cur
-        else:
-            return None
+        return self.get_all_currencies(date).get(currency_name)
 
 
 if __name__ == '__main__':
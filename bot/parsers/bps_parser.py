@@ -1,14 +1,15 @@
 # coding: utf-8
 import re
 import datetime
-from typing import Sequence, Set
+from typing import Sequence
 
-import requests
 from bs4 import BeautifulSoup
 
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
 from bot.exceptions import BotLoggedError
 from bot.parsers.base import BaseParser
+from bot.publication import BusinessDayCalendar
 
 CURRENCY_REGEX = re.compile(r'(?P<multiplier>\d+)\s*(?P<value>[A-Za-z]+)')
 
@@ -23,6 +24,7 @@ class BPSParser(BaseParser):
                               'PLN', 'GBP', 'CHF', 'BYN'))
     BASE_URL = "http://www.bps-sberbank.by/43257F17004E948D/currency_rates"
     DATE_FORMAT = "%Y.%m.%d"
+    publication_calendar = BusinessDayCalendar()
 
     def __init__(self, parser="lxml", *args, **kwargs):
         self._parser = parser
@@ -34,7 +36,7 @@ class BPSParser(BaseParser):
 
         str_date = date.strftime(cls.DATE_FORMAT)
         payload = {"openForm": 1, "date": str_date}
-        r = requests.get(cls.BASE_URL, params=payload)
+        r = cls._get(cls.BASE_URL, params=payload)
         return r.text
 
     def _soup_from_response(self, text: str) -> BeautifulSoup:
@@ -66,7 +68,7 @@ class BPSParser(BaseParser):
                     match.groupdict()["value"])
         raise BotLoggedError("Incorrect currency supplied: {}".format(cur))
 
-    def get_all_currencies(self, date=None) -> Set[Currency]:
+    def get_all_currencies(self, date=None) -> RateTable:
         """Get all available currencies for the given date
         (both sell and purchase)"""
         # FIXME: add caching
@@ -74,10 +76,12 @@ class BPSParser(BaseParser):
         if date is None:
             date = today
         response = self._response_for_date(date)
-        soup = self._soup_from_response(response)
-        rows = self.__rate_rows(soup)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            soup = self._soup_from_response(response)
+            rows = self.__rate_rows(soup)
 
-        currencies = set([self._currency_from_row(row) for row in rows])
+            currencies = RateTable(self._currency_from_row(row)
+                                   for row in rows)
         return currencies
 
     def get_currency(self, currency_name="USD", date=None):
@@ -92,10 +96,7 @@ class BPSParser(BaseParser):
             raise BotLoggedError(msg.format(currency_name, allowed))
 
         currencies = self.get_all_currencies(date=date)
-        for currency in currencies:
-            if currency.iso.upper() == currency_name:
-                return currency
-        return Currency.empty_currency()
+        return currencies.get(currency_name, Currency.empty_currency())
 
 
 def test():
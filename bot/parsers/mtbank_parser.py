@@ -2,7 +2,6 @@
 
 import datetime
 from typing import Sequence
-import requests
 from bs4 import BeautifulSoup
 
 from bot.currency import Currency
@@ -25,7 +24,7 @@ class MtbankParser(BaseParser):
         self._parser = parser
 
     def _get_page_soup(self) -> BeautifulSoup:
-        text = requests.get(self.BASE_URL)
+        text = self._get(self.BASE_URL)
         return BeautifulSoup(text, "html.parser")
 
     def get_all_currencies(self, date=None):
@@ -1,12 +1,11 @@
 # coding: utf-8
 
 import datetime
-from typing import Sequence
 
-import requests
 from lxml import etree
 
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
 from bot.parsers.base import BaseParser
 
 
@@ -43,7 +42,7 @@ Date you are trying to request is to old, minimal date is {}
 """.format(cls.MINIMAL_DATE)
             raise ValueError(msg)
         date_str = date.strftime(cls.DATE_FORMAT)
-        r = requests.get(cls.BASE_URL, params={"ondate": date_str})
+        r = cls._get(cls.BASE_URL, params={"ondate": date_str})
         r.encoding = 'utf-8'
         # TODO: handle exceptions
         return r.text
@@ -53,8 +52,9 @@ Date you are trying to request is to old, minimal date is {}
                                currency_name: str) -> Currency:
         xpath = 'Currency/CharCode[text()="{}"]/..'
         res = xml_tree.xpath(xpath.format(currency_name.upper()))
-        c = res[0]
+        return self._currency_from_xml_element(res[0])
 
+    def _currency_from_xml_element(self, c: etree._Element) -> Currency:
         name = iso = c.find('CharCode').text
         try:
             sell_value = float(c.find('Rate').text)
@@ -71,19 +71,17 @@ Date you are trying to request is to old, minimal date is {}
         return self._currency_from_xml_obj(tree, currency_name)
 
     def get_all_currencies(self,
-                           date: datetime.date=None) -> Sequence[Currency]:
+                           date: datetime.date=None) -> RateTable:
         # TODO: add aggressive caching
         today = datetime.date.today()
         if date is None:
             date = today
 
         _xml = self._response_text_for_date(date)
-        tree = etree.fromstring(_xml)
-        currencies_xpath = 'Currency/CharCode/text()'
-        available_currencies = tree.xpath(currencies_xpath)
-
-        results = [self._currency_from_xml_obj(tree, c)
-                   for c in available_currencies]
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            tree = etree.fromstring(_xml)
+            results = RateTable(self._currency_from_xml_element(c)
+                                for c in tree.iterfind('Currency'))
         return results
 
     def get_currency(self, currency_name="USD", date=None):
@@ -92,5 +90,6 @@ Date you are trying to request is to old, minimal date is {}
             date = today
 
         _xml = self._response_text_for_date(date)
-        currency = self._currency_from_xml_text(_xml, currency_name)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            currency = self._currency_from_xml_text(_xml, currency_name)
         return currency
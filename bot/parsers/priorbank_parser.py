@@ -1,10 +1,9 @@
 # coding: utf-8
 import datetime
-from typing import Dict, Set, Union
+from typing import Dict, Union
 
-import requests
-
-from bot.currency import Currency
+from bot import metrics
+from bot.currency import Currency, RateTable
 from bot.exceptions import BotLoggedError
 from bot.parsers.base import BaseParser
 from bot.settings import DENOMINATION_DATE, DENOMINATION_MULTIPLIER
@@ -43,14 +42,14 @@ class PriorbankParser(BaseParser):
             "channelIDs": 3,
             "currencies": "all"
         }
-        return requests.get(cls.BASE_URL, params=payload).json()
+        return cls._get(cls.BASE_URL, params=payload).json()
 
-    def _currencies_from_json_response(self, j: Dict) -> Set[Currency]:
+    def _currencies_from_json_response(self, j: Dict) -> RateTable:
         full_list = j["fullList"]
         channel = full_list[0]
         exchange_list = channel['exchangeModelForChannels'][0]['exchangeList']
-        currencies = [self._currency_from_dict_elem(d) for d in exchange_list]
-        return set(currencies)
+        return RateTable(self._currency_from_dict_elem(d)
+                         for d in exchange_list)
 
     def _currency_from_dict_elem(self,
                                  d: Dict[str,
@@ -68,7 +67,8 @@ class PriorbankParser(BaseParser):
         if date is None:
             date = today
         json_data = self._response_for_date(date)
-        currencies = self._currencies_from_json_response(json_data)
+        with metrics.BANK_PARSE_SECONDS.time(bank=self.short_name):
+            currencies = self._currencies_from_json_response(json_data)
         return currencies
 
     def get_currency(self, currency_name="USD", date=None):
@@ -82,14 +82,14 @@ class PriorbankParser(BaseParser):
             raise BotLoggedError(msg.format(currency_name, allowed))
 
         currencies = self.get_all_currencies(date=date)
-        for currency in currencies:
-            if currency.iso.upper() == currency_name:
-                if date < DENOMINATION_DATE:
-                    currency.multiplier = DENOMINATION_MULTIPLIER
-                else:
-                    currency.multiplier = 1
-                return currency
-        return Currency.empty_currency()
+        currency = currencies.get(currency_name)
+        if currency is None:
+            return Currency.empty_currency()
+        if date < DENOMINATION_DATE:
+            currency.multiplier = DENOMINATION_MULTIPLIER
+        else:
+            currency.multiplier = 1
+        return currency
 
 
 if __name__ == '__main__':
@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import seaborn as sns
 
+from bot import metrics
+
 # add extra styling for our graphs
 sns.set_style("darkgrid")
 
@@ -15,6 +17,7 @@ def reset_plot(plot=plt):
 
 
 # TODO: This function should be less specific
+@metrics.PLOT_RENDER_SECONDS.time()
 def render_exchange_rate_plot(x_axe, y_buy, y_sell, output_file):
     """Renders plot to the given file"""
     # Extra setup to correctly display dates on X-axis
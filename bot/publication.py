@@ -0,0 +1,81 @@
+"""
+Publication calendars describe on which days a bank publishes
+new exchange rates. Any requested date is mapped to its effective
+publication date, i.e. the latest day not later than the requested
+one when rates were actually published.
+"""
+
+import datetime
+import functools
+
+# (month, day) of public holidays in Belarus
+BELARUS_FIXED_HOLIDAYS = frozenset([
+    (1, 1),    # New Year
+    (1, 7),    # Orthodox Christmas
+    (3, 8),    # Women's Day
+    (5, 1),    # Labour Day
+    (5, 9),    # Victory Day
+    (7, 3),    # Independence Day
+    (11, 7),   # October Revolution Day
+    (12, 25),  # Catholic Christmas
+])
+
+# Nobody closes for longer than that
+MAX_LOOKBACK_DAYS = 14
+
+
+@functools.lru_cache(maxsize=256)
+def orthodox_easter(year: int) -> datetime.date:
+    """Orthodox Easter date (Meeus Julian algorithm), valid for 1900-2099"""
+    a = year % 4
+    b = year % 7
+    c = year % 19
+    d = (19 * c + 15) % 30
+    e = (2 * a + 4 * b - d + 34) % 7
+    month = (d + e + 114) // 31
+    day = (d + e + 114) % 31 + 1
+    julian_date = datetime.date(year, month, day)
+    # Julian to Gregorian calendar difference
+    return julian_date + datetime.timedelta(days=13)
+
+
+def radunitsa(year: int) -> datetime.date:
+    """Day of remembrance, 9 days after Orthodox Easter"""
+    return orthodox_easter(year) + datetime.timedelta(days=9)
+
+
+class DailyCalendar(object):
+    """Bank publishes rates every day"""
+
+    def is_publication_day(self, date: datetime.date) -> bool:
+        return True
+
+    def effective_date(self, date: datetime.date) -> datetime.date:
+        return date
+
+
+class BusinessDayCalendar(DailyCalendar):
+    """Bank publishes rates on working days only, rates stay
+    the same through weekends and public holidays"""
+
+    def __init__(self,
+                 fixed_holidays=BELARUS_FIXED_HOLIDAYS,
+                 movable_holidays=(radunitsa,)) -> None:
+        self.fixed_holidays = fixed_holidays
+        self.movable_holidays = movable_holidays
+
+    def is_publication_day(self, date: datetime.date) -> bool:
+        if date.weekday() >= 5:
+            return False
+        if (date.month, date.day) in self.fixed_holidays:
+            return False
+        return all(holiday(date.year) != date
+                   for holiday in self.movable_holidays)
+
+    def effective_date(self, date: datetime.date) -> datetime.date:
+        candidate = date
+        for _ in range(MAX_LOOKBACK_DAYS):
+            if self.is_publication_day(candidate):
+                return candidate
+            candidate -= datetime.timedelta(days=1)
+        return date
@@ -0,0 +1,156 @@
+"""
+Helpers making calls to unreliable upstreams (bank sites) safer:
+bounded retries with jittered exponential backoff and circuit breakers
+failing fast while an upstream keeps erroring.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Tuple, Type, TypeVar
+
+from bot import metrics
+
+T = TypeVar('T')
+
+logger = logging.getLogger('telegrambot')
+
+
+class CircuitBreaker(object):
+    """
+    Classic three-state circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens
+    and rejects calls for `cooldown` seconds, then lets a single trial
+    call through (half-open): its success closes the breaker,
+    its failure opens it again.
+    """
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+
+    # Values exported to metrics
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str,
+                 failure_threshold: int=5,
+                 cooldown: float=60.0,
+                 clock: Callable[[], float]=time.time) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._export_state(self.CLOSED)
+
+    def after_fork(self) -> None:
+        """Drops lock and trial state of the parent process' threads,
+        to be called in a forked child"""
+        self._lock = threading.Lock()
+        self._trial_in_progress = False
+
+    def _export_state(self, state: str) -> None:
+        metrics.CIRCUIT_BREAKER_STATE.set(self.STATE_CODES[state],
+                                          name=self.name)
+
+    def _current_state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self) -> bool:
+        """True if calls are currently rejected without trying"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                return self._trial_in_progress
+            return state == self.OPEN
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                self._export_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            was_closed = self._opened_at is None
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+        if not was_closed:
+            logger.info("Circuit breaker {} closed".format(self.name))
+            self._export_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            should_open = (self._trial_in_progress or
+                           self._failures >= self.failure_threshold)
+            self._trial_in_progress = False
+            if should_open:
+                self._opened_at = self._clock()
+        if should_open:
+            logger.warning("Circuit breaker {} opened".format(self.name))
+            self._export_state(self.OPEN)
+
+
+_breakers = {}  # type: Dict[str, CircuitBreaker]
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Returns process-wide circuit breaker with the given name"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **kwargs)
+            _breakers[name] = breaker
+        return breaker
+
+
+def backoff_delay(attempt: int,
+                  base_delay: float,
+                  max_delay: float) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def call_with_retries(func: Callable[[], T],
+                      retries: int,
+                      retry_on: Tuple[Type[Exception], ...],
+                      base_delay: float=0.5,
+                      max_delay: float=5.0,
+                      on_retry: Callable[[Exception], None]=None,
+                      sleep: Callable[[float], None]=time.sleep) -> T:
+    """
+    Calls func, retrying it up to `retries` more times if it raises
+    one of `retry_on` exceptions. The last error is re-raised.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except retry_on as e:
+            if attempt >= retries:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
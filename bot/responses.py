@@ -0,0 +1,78 @@
+"""
+Cache of rendered command responses.
+
+Texts are kept per (bank, date) and keyed by currency selection and
+version of the rates they were rendered from, so repeated commands
+skip formatting until the bank's rates are refreshed. Texts with no
+version, i.e. of past dates, expire after `ttl` seconds since cached
+past rates may still change, e.g. by backfill in another process.
+"""
+
+import collections
+import datetime
+import threading
+import time
+from typing import Callable
+
+from bot import metrics
+
+
+class ResponseCache(object):
+    """LRU of rendered texts for up to `max_entries` (bank, date) pairs"""
+
+    def __init__(self, max_entries: int=256, ttl: float=None,
+                 clock: Callable[[], float]=time.time) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        # (bank, date) -> {(selection, version): (text, expires_at)}
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bank_short_name: str, date: datetime.date,
+            selection: str, version=None) -> str:
+        key = (bank_short_name, date)
+        with self._lock:
+            texts = self._entries.get(key)
+            text, expires_at = (texts or {}).get((selection, version),
+                                                 (None, None))
+            if expires_at is not None and expires_at <= self._clock():
+                del texts[(selection, version)]
+                text = None
+            if text is not None:
+                self._entries.move_to_end(key)
+        metrics.RESPONSE_CACHE_REQUESTS.inc(
+            result='miss' if text is None else 'hit')
+        return text
+
+    def put(self, bank_short_name: str, date: datetime.date,
+            selection: str, version, text: str) -> None:
+        key = (bank_short_name, date)
+        with self._lock:
+            texts = self._entries.get(key)
+            if texts is None:
+                texts = self._entries[key] = {}
+            # Texts of older versions are never read again
+            for cached in [k for k in texts if k[1] != version]:
+                del texts[cached]
+            expires_at = None
+            if version is None and self.ttl is not None:
+                expires_at = self._clock() + self.ttl
+            texts[(selection, version)] = (text, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, bank_short_name: str, date: datetime.date) -> None:
+        with self._lock:
+            self._entries.pop((bank_short_name, date), None)
+
+    def on_snapshot(self, parser, date: datetime.date,
+                    currencies, complete: bool) -> None:
+        """Snapshot listener of the cache proxy, drops texts
+        rendered from the bank's previous rates"""
+        if complete:
+            self.invalidate(parser.short_name, date)
+
+    def __len__(self):
+        return len(self._entries)
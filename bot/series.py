@@ -0,0 +1,187 @@
+"""
+Exchange rate time series backed by NumPy arrays.
+
+Graph preparation and statistics work on whole arrays instead
+of lists of Currency objects.
+"""
+
+import datetime
+from typing import Iterable, Sequence, Tuple
+
+import numpy as np
+
+from bot.currency import Currency
+from bot.settings import DENOMINATION_DATE, DENOMINATION_MULTIPLIER
+
+DENOMINATION_DAY = np.datetime64(DENOMINATION_DATE, 'D')
+
+
+def to_datetime64(dates: Sequence[datetime.date]) -> np.ndarray:
+    return np.array(dates, dtype='datetime64[D]')
+
+
+def largest_triangle_indices(x: np.ndarray,
+                             ys: Sequence[np.ndarray],
+                             n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of n_out
+    points preserving the visual shape of the given lines.
+
+    The first and the last points are always kept, every bucket in
+    between contributes the point forming the largest triangle with
+    the previously selected point and the average of the next bucket.
+    Areas of several lines sharing the x axis are summed up.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    sizes = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / sizes
+    next_x = np.append(avg_x[1:], x[-1])
+    next_ys = []
+    for y in ys:
+        avg_y = np.add.reduceat(y[:-1], edges[:-1]) / sizes
+        next_ys.append(np.append(avg_y[1:], y[-1]))
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.zeros(hi - lo)
+        for y, next_y in zip(ys, next_ys):
+            area += np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) -
+                           (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+class CurrencySeries(object):
+    """
+    Rates of a single currency sorted by date. Dates the bank
+    had no rates for hold NaN buy and sell values.
+    """
+    __slots__ = ('iso', 'dates', 'buy', 'sell', 'multiplier')
+
+    def __init__(self, iso: str,
+                 dates: np.ndarray,
+                 buy: np.ndarray,
+                 sell: np.ndarray,
+                 multiplier: np.ndarray) -> None:
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        order = np.argsort(dates, kind='mergesort')
+        self.iso = iso
+        self.dates = dates[order]
+        self.buy = np.asarray(buy, dtype=float)[order]
+        self.sell = np.asarray(sell, dtype=float)[order]
+        self.multiplier = np.asarray(multiplier, dtype=float)[order]
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[datetime.date, Currency]],
+                   iso: str=''):
+        """Builds series from (date, currency) pairs in any order"""
+        pairs = list(pairs)
+        n = len(pairs)
+        dates = to_datetime64([d for d, _ in pairs])
+        buy = np.full(n, np.nan)
+        sell = np.full(n, np.nan)
+        multiplier = np.ones(n)
+        for i, (_, currency) in enumerate(pairs):
+            if currency is None or currency.is_empty():
+                continue
+            iso = iso or currency.iso
+            buy[i] = currency.buy
+            sell[i] = currency.sell
+            multiplier[i] = currency.multiplier
+        return cls(iso, dates, buy, sell, multiplier)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def _replace(self, dates=None, buy=None, sell=None, multiplier=None):
+        return CurrencySeries(
+            self.iso,
+            self.dates if dates is None else dates,
+            self.buy if buy is None else buy,
+            self.sell if sell is None else sell,
+            self.multiplier if multiplier is None else multiplier)
+
+    def to_dates(self) -> Sequence[datetime.date]:
+        return self.dates.astype(datetime.date).tolist()
+
+    def denominated(self):
+        """Fills in missing multipliers basing on denomination date"""
+        missing = self.multiplier == 0
+        if not missing.any():
+            return self
+        by_date = np.where(self.dates < DENOMINATION_DAY,
+                           DENOMINATION_MULTIPLIER, 1)
+        return self._replace(multiplier=np.where(missing, by_date,
+                                                 self.multiplier))
+
+    def normalized(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Buy and sell rates in post-denomination units"""
+        return self.buy / self.multiplier, self.sell / self.multiplier
+
+    def fill_gaps(self):
+        """Carries the last known rates forward over missing dates,
+        leading gaps stay NaN"""
+        valid = ~(np.isnan(self.buy) & np.isnan(self.sell))
+        index = np.where(valid, np.arange(len(self)), 0)
+        np.maximum.accumulate(index, out=index)
+        filled = self._replace(buy=self.buy[index],
+                               sell=self.sell[index],
+                               multiplier=self.multiplier[index])
+        seen = np.logical_or.accumulate(valid)
+        filled.buy[~seen] = np.nan
+        filled.sell[~seen] = np.nan
+        return filled
+
+    def resample(self, dates: Sequence[datetime.date]):
+        """Rates as of each of the given dates, i.e. the latest
+        known ones not later than the date"""
+        dates = to_datetime64(dates)
+        if len(self) == 0:
+            nans = np.full(len(dates), np.nan)
+            return CurrencySeries(self.iso, dates, nans, nans,
+                                  np.ones(len(dates)))
+        index = np.searchsorted(self.dates, dates, side='right') - 1
+        before_start = index < 0
+        index = np.clip(index, 0, len(self) - 1)
+        buy = np.where(before_start, np.nan, self.buy[index])
+        sell = np.where(before_start, np.nan, self.sell[index])
+        return CurrencySeries(self.iso, dates, buy, sell,
+                              self.multiplier[index])
+
+    def downsample(self, max_points: int):
+        """At most max_points dates keeping spikes of both buy
+        and sell rates, dates without rates are dropped"""
+        buy, sell = self.normalized()
+        valid = ~(np.isnan(buy) | np.isnan(sell))
+        if valid.sum() <= max_points and valid.all():
+            return self
+        x = self.dates[valid].astype('int64').astype(float)
+        index = np.flatnonzero(valid)[
+            largest_triangle_indices(x, (buy[valid], sell[valid]),
+                                     max_points)]
+        return self._replace(dates=self.dates[index],
+                             buy=self.buy[index],
+                             sell=self.sell[index],
+                             multiplier=self.multiplier[index])
+
+    def _extreme(self, side: str, arg_func) -> Tuple[datetime.date, float]:
+        values = self.normalized()[0 if side == 'buy' else 1]
+        if np.isnan(values).all():
+            return None, None
+        i = int(arg_func(values))
+        return self.dates[i].astype(datetime.date), float(values[i])
+
+    def min(self, side: str='sell') -> Tuple[datetime.date, float]:
+        """Date and value of the lowest normalized rate"""
+        return self._extreme(side, np.nanargmin)
+
+    def max(self, side: str='sell') -> Tuple[datetime.date, float]:
+        """Date and value of the highest normalized rate"""
+        return self._extreme(side, np.nanargmax)
@@ -19,8 +19,117 @@ PIDFILE = os.path.join(tempfile.gettempdir(), "telegrambot.pid")
 LOCALIZATION_PATH = os.path.join(BASE_DIR, "locale")
 
 API_ENV_NAME = 'BANK_BOT_AP_TOKEN'
+# Number of dispatcher threads serving @run_async handlers, command
+# handlers are run by the scheduler lanes (SCHEDULER_LANES) instead
+DISPATCHER_WORKERS = int(os.environ.get('BANK_BOT_WORKERS', '4'))
+
+
+def parse_lane_sizes(value: str) -> dict:
+    """Parses 'lane=size,lane=size' string into a dict"""
+    lanes = {}
+    for item in value.split(','):
+        lane, size = item.split('=')
+        lanes[lane.strip()] = int(size)
+    return lanes
+
+# Worker pool sizes of command scheduler lanes
+SCHEDULER_LANES = parse_lane_sizes(
+    os.environ.get('BANK_BOT_LANES', 'instant=2,standard=4,heavy=4'))
+
+# Bank fetch resilience: timeouts are in seconds, parsers may override them
+BANK_CONNECT_TIMEOUT = float(os.environ.get('BANK_BOT_CONNECT_TIMEOUT', '3.05'))
+BANK_READ_TIMEOUT = float(os.environ.get('BANK_BOT_READ_TIMEOUT', '10'))
+BANK_FETCH_RETRIES = int(os.environ.get('BANK_BOT_FETCH_RETRIES', '2'))
+BANK_BREAKER_THRESHOLD = int(os.environ.get('BANK_BOT_BREAKER_THRESHOLD', '5'))
+BANK_BREAKER_COOLDOWN = float(os.environ.get('BANK_BOT_BREAKER_COOLDOWN', '120'))
+
+# Process-wide fetch executor shared by all of the commands
+FETCH_WORKERS = int(os.environ.get('BANK_BOT_FETCH_WORKERS', '16'))
+FETCH_QUEUE_DEPTH = int(os.environ.get('BANK_BOT_FETCH_QUEUE_DEPTH', '256'))
+# Max concurrent requests to a single bank host
+FETCH_PER_HOST_LIMIT = int(os.environ.get('BANK_BOT_FETCH_PER_HOST', '4'))
+
+# Update ingestion mode: 'polling' or 'webhook'
+BOT_MODE = os.environ.get('BANK_BOT_MODE', 'polling')
+WEBHOOK_LISTEN = os.environ.get('BANK_BOT_WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('BANK_BOT_WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('BANK_BOT_WEBHOOK_PATH', '/webhook')
+# Public URL registered with Telegram, e.g. behind nginx
+WEBHOOK_URL = os.environ.get('BANK_BOT_WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('BANK_BOT_WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.environ.get('BANK_BOT_WEBHOOK_WORKERS', '4'))
+WEBHOOK_MAX_QUEUE_SIZE = int(os.environ.get('BANK_BOT_WEBHOOK_MAX_QUEUE',
+                                            '500'))
+
+# Number of worker processes sharing the webhook socket
+BOT_PROCESSES = int(os.environ.get('BANK_BOT_PROCESSES', '1'))
+
+# Outgoing messages are queued and sent by OUTBOX_WORKERS threads
+# within Telegram limits: messages per second overall (shared by all
+# of the processes), per private chat and per group chat
+OUTBOX_ENABLED = os.environ.get('BANK_BOT_OUTBOX', '1') == '1'
+OUTBOX_WORKERS = int(os.environ.get('BANK_BOT_OUTBOX_WORKERS', '4'))
+OUTBOX_GLOBAL_RATE = float(os.environ.get('BANK_BOT_OUTBOX_GLOBAL_RATE',
+                                          '30')) / BOT_PROCESSES
+OUTBOX_CHAT_RATE = float(os.environ.get('BANK_BOT_OUTBOX_CHAT_RATE', '1'))
+OUTBOX_CHAT_BURST = float(os.environ.get('BANK_BOT_OUTBOX_CHAT_BURST', '3'))
+OUTBOX_GROUP_RATE = float(os.environ.get('BANK_BOT_OUTBOX_GROUP_RATE',
+                                         str(20 / 60)))
+OUTBOX_GROUP_BURST = float(os.environ.get('BANK_BOT_OUTBOX_GROUP_BURST', '3'))
+# Times a message is retried after Telegram asks to slow down
+OUTBOX_MAX_RETRIES = int(os.environ.get('BANK_BOT_OUTBOX_MAX_RETRIES', '3'))
+
+# Local time daily rate digests are sent to subscribers at
+DIGEST_TIME = datetime.datetime.strptime(
+    os.environ.get('BANK_BOT_DIGEST_TIME', '10:00'), '%H:%M').time()
+
+# Prometheus-style metrics endpoint, disabled if port is not set
+METRICS_HOST = os.environ.get('BANK_BOT_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('BANK_BOT_METRICS_PORT', '0')) or None
 CACHE_EXPIRACY_MINUTES = 60
+# Rates in the cross-bank matrix older than that are fetched again
+RATE_MATRIX_MAX_AGE = int(os.environ.get('BANK_BOT_RATE_MATRIX_MAX_AGE',
+                                         str(CACHE_EXPIRACY_MINUTES * 60)))
+# Today's rates are served without refetching for SNAPSHOT_SOFT_TTL
+# seconds, then until SNAPSHOT_HARD_TTL they are served while being
+# refreshed in background. If the bank is down rates not older than
+# SNAPSHOT_STALE_IF_ERROR are served.
+SNAPSHOT_SOFT_TTL = int(os.environ.get('BANK_BOT_SNAPSHOT_SOFT_TTL', '600'))
+SNAPSHOT_HARD_TTL = int(os.environ.get('BANK_BOT_SNAPSHOT_HARD_TTL',
+                                       str(CACHE_EXPIRACY_MINUTES * 60)))
+SNAPSHOT_STALE_IF_ERROR = int(os.environ.get(
+    'BANK_BOT_SNAPSHOT_STALE_IF_ERROR', str(24 * 60 * 60)))
+# How long we remember that a bank has no rates for some date
+NEGATIVE_CACHE_TTL = int(os.environ.get('BANK_BOT_NEGATIVE_CACHE_TTL',
+                                        str(24 * 60 * 60)))
+# Cache backend: 'redis', 'memory' or 'mmap', in-process memory cache
+# is used by default unless redis host is configured
+CACHE_BACKEND = os.environ.get(
+    'BANK_BOT_CACHE_BACKEND',
+    'redis' if os.environ.get('TELEGRAM_REDIS_HOST') else 'memory')
+# Bounds of the 'memory' cache backend
+MEMORY_CACHE_MAX_ITEMS = int(os.environ.get('BANK_BOT_MEMORY_CACHE_ITEMS',
+                                            '100000'))
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get('BANK_BOT_MEMORY_CACHE_BYTES',
+                                            str(64 * 1024 * 1024)))
+# Number of items kept in the in-process cache in front of redis
+# and how long they are kept there, 0 disables it
+LOCAL_CACHE_SIZE = int(os.environ.get('BANK_BOT_LOCAL_CACHE_SIZE', '4096'))
+LOCAL_CACHE_TTL = int(os.environ.get('BANK_BOT_LOCAL_CACHE_TTL', '60'))
+# Directory of memory-mapped rate files used by 'mmap' backend
+MMAP_CACHE_DIR = os.environ.get('BANK_BOT_MMAP_CACHE_DIR',
+                                os.path.join(BASE_DIR, 'rates'))
+# Cache is loaded from this file on start and saved to it on exit
+CACHE_SNAPSHOT_FILE = os.environ.get('BANK_BOT_CACHE_SNAPSHOT')
+# Number of (bank, date) pairs rendered /course responses are kept for
+RESPONSE_CACHE_SIZE = int(os.environ.get('BANK_BOT_RESPONSE_CACHE_SIZE',
+                                         '256'))
+# Responses of past dates are rendered again after that many seconds
+RESPONSE_CACHE_TTL = int(os.environ.get('BANK_BOT_RESPONSE_CACHE_TTL',
+                                        str(CACHE_EXPIRACY_MINUTES * 60)))
 IMAGES_FOLDER = "img"
+# Graphs are downsampled to roughly one point per horizontal pixel
+GRAPH_MAX_POINTS = int(os.environ.get('BANK_BOT_GRAPH_MAX_POINTS', '500'))
 USER_BANK_SELECTION_CACHE = {}
 
 DATE_REGEX = re.compile(r"-d(?P<date_diff>[\d]+)")
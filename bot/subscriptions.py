@@ -0,0 +1,189 @@
+"""
+Daily rate digests.
+
+Users subscribe to rates of a bank, optionally limited to a few
+currencies. Once a day the broadcaster refreshes rates of every bank
+somebody is subscribed to, renders every distinct digest (bank and
+currency set) once and queues it to all of its subscribers, so
+rendering cost depends on the number of distinct digests only.
+
+Subscriptions are kept in redis, so all of the bot processes see
+them and only one of them sends the daily digest. With other cache
+backends subscriptions are disabled: they would be evicted by rates,
+lost on restart and not shared between processes.
+"""
+
+import datetime
+import json
+import logging
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from bot import utils
+from bot.adapters import cache_proxy, default_cache, user_store
+from bot.cache.base import AbstractCache
+from bot.cache.conf import CACHE_DATE_FORMAT
+from bot.currency import Currency
+from bot.exceptions import BotLoggedError, BotParserLookupError
+
+logger = logging.getLogger('telegrambot')
+
+SUBSCRIPTION_KEY = 'subscription:{}'
+BROADCAST_LOCK_LEASE = 10 * 60
+# Digest of the day is marked as sent for that long
+SENT_MARKER_TTL = 36 * 60 * 60
+
+# Dummy method for later localization
+_ = lambda x: x
+
+Digest = Tuple[str, Tuple[str, ...]]
+
+
+def currencies_from_args(args: Sequence[str]) -> List[str]:
+    """Currency codes given by all of the -c flags"""
+    return [args[i + 1].upper() for i, arg in enumerate(args)
+            if arg == '-c' and i < len(args) - 1]
+
+
+class SubscriptionStore(object):
+    """Subscriptions by chat id: bank short name and currencies,
+    empty currencies stand for all of the bank's currencies"""
+
+    def __init__(self, cache: AbstractCache) -> None:
+        self.cache = cache
+
+    def subscribe(self, chat_id: int, bank_short_name: str,
+                  currencies: Sequence[str]=()) -> None:
+        value = json.dumps({'bank': bank_short_name,
+                            'currencies': sorted(set(currencies))})
+        self.cache.put(SUBSCRIPTION_KEY.format(chat_id), value)
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        """Returns whether the chat was subscribed"""
+        key = SUBSCRIPTION_KEY.format(chat_id)
+        if self.cache.get(key) is None:
+            return False
+        self.cache.delete(key)
+        return True
+
+    def __iter__(self) -> Iterator[Tuple[int, Digest]]:
+        """Iterates over (chat_id, (bank, currencies)) pairs"""
+        prefix = SUBSCRIPTION_KEY.format('')
+        for key, value, expires_at in self.cache.iter_items(
+                match=prefix + '*'):
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            try:
+                data = json.loads(value)
+                chat_id = int(key[len(prefix):])
+                digest = (data['bank'], tuple(data['currencies']))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Skipped malformed subscription {}".format(key))
+                continue
+            yield chat_id, digest
+
+    def digests(self) -> Dict[Digest, List[int]]:
+        """Chat ids of subscribers of every distinct digest"""
+        subscribers = {}
+        for chat_id, digest in self:
+            subscribers.setdefault(digest, []).append(chat_id)
+        return subscribers
+
+
+def render_digest(parser, rates: Sequence[Currency],
+                  currencies: Sequence[str],
+                  date: datetime.date) -> Optional[str]:
+    """Text of the bank's rates for the date, all of them
+    if no currencies are given, None if there are no rates"""
+    if currencies:
+        rates = [c for c in rates if c.iso.upper() in currencies]
+    if not rates:
+        return None
+    lines = [utils.format_currency_string(c)
+             for c in utils.sort_currencies(rates)]
+    header = _("{bank} rates for {date}:").format(
+        bank=parser.name, date=date.strftime(CACHE_DATE_FORMAT))
+    return "\n".join([header, _("\tBuy\tSell")] + lines)
+
+
+class Broadcaster(object):
+    """Sends daily digests to subscribers with `send(chat_id, text)`"""
+
+    def __init__(self, store: SubscriptionStore,
+                 send: Callable[[int, str], object],
+                 proxy=cache_proxy,
+                 get_parser: Callable[[str], object]=None) -> None:
+        self.store = store
+        self.send = send
+        self.proxy = proxy
+        self.get_parser = get_parser or (
+            lambda name: utils.get_parser(name)(cache=default_cache))
+
+    def broadcast(self, date: datetime.date=None) -> Optional[int]:
+        """Renders and sends digests, returns number of sent messages
+        or None if subscriptions could not be read"""
+        date = date or datetime.date.today()
+        if not self.store.cache.is_available:
+            logger.error("Subscriptions are unavailable, digests "
+                         "were not sent")
+            return None
+        by_bank = {}
+        for digest, chat_ids in self.store.digests().items():
+            by_bank.setdefault(digest[0], []).append((digest[1], chat_ids))
+        sent = 0
+        for bank_short_name, digests in sorted(by_bank.items()):
+            try:
+                parser = self.get_parser(bank_short_name)
+                # Rates are refreshed once, digests are rendered from them
+                rates = self.proxy.get_all_currencies(parser, date=date)
+            except (BotParserLookupError, BotLoggedError) as e:
+                logger.error("Digests of {} were not sent: {}".format(
+                    bank_short_name, e))
+                continue
+            except Exception:
+                # Other banks' digests are still sent
+                logger.exception("Digests of {} were not sent".format(
+                    bank_short_name))
+                continue
+            for currencies, chat_ids in digests:
+                text = render_digest(parser, rates, currencies, date)
+                if text is None:
+                    continue
+                for chat_id in chat_ids:
+                    try:
+                        self.send(chat_id, text)
+                    except Exception:
+                        logger.exception("Digest to chat {} was not "
+                                         "sent".format(chat_id))
+                        continue
+                    sent += 1
+        logger.info("Sent {} digests".format(sent))
+        return sent
+
+    def run_daily(self, bot, job) -> None:
+        """Job queue callback, the digest is sent once a day
+        by one of the bot processes"""
+        cache = self.store.cache
+        today = datetime.date.today()
+        marker = 'digest:sent:{}'.format(today.strftime(CACHE_DATE_FORMAT))
+        with cache.lock('lock:digest',
+                        lease=BROADCAST_LOCK_LEASE) as acquired:
+            # Without the lock other process may be sending it right now
+            if not acquired or cache.get(marker) is not None:
+                return
+            if self.broadcast(today) is None:
+                return
+            cache.put(marker, '1', expire=SENT_MARKER_TTL)
+
+
+def seconds_until(time_of_day: datetime.time,
+                  now: datetime.datetime=None) -> float:
+    """Seconds until the next moment of the given local time of day"""
+    now = now or datetime.datetime.now()
+    moment = datetime.datetime.combine(now.date(), time_of_day)
+    if moment <= now:
+        moment += datetime.timedelta(days=1)
+    return (moment - now).total_seconds()
+
+
+subscription_store = SubscriptionStore(user_store) \
+    if user_store is not None else None
@@ -1,6 +1,16 @@
 # coding: utf-8
 
+import functools
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Mapping
+
+import telegram
 from telegram.ext import (
+    Job,
     Updater,
     RegexHandler,
     CommandHandler,
@@ -9,6 +19,103 @@ from telegram.ext import (
 
 import bot.commands as commands
 import bot.settings as bot_settings
+from bot import metrics
+from bot.outbox import Outbox, QueuedBot
+from bot.alerts import alert_manager
+from bot.subscriptions import Broadcaster, seconds_until, subscription_store
+from bot.webhook import WebhookServer, set_webhook
+
+logger = logging.getLogger('telegrambot')
+
+
+class InstrumentedBot(object):
+    """
+    Proxies telegram.Bot timing every outgoing API call.
+    """
+    TIMED_PREFIXES = ('send', 'answer')
+
+    def __init__(self, bot):
+        self._bot = bot
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if callable(attr) and name.startswith(self.TIMED_PREFIXES):
+            return metrics.TELEGRAM_SEND_SECONDS.time(method=name)(attr)
+        return attr
+
+
+class CommandScheduler(object):
+    """
+    Runs command handlers in separate worker pools (lanes), so that
+    slow commands piling up in one lane don't delay cheap ones
+    served by another lane.
+
+    Exceptions raised by handlers are logged and passed to
+    `on_error(update, error)`, e.g. dispatcher's error handlers.
+    """
+
+    def __init__(self, lanes: Mapping[str, int],
+                 on_error: Callable[[object, Exception], None]=None) -> None:
+        self.on_error = on_error
+        self._executors = {lane: ThreadPoolExecutor(max_workers=size)
+                           for lane, size in lanes.items()}
+        self._depths = {lane: 0 for lane in lanes}
+        self._lock = threading.Lock()
+
+    @property
+    def lanes(self):
+        return sorted(self._executors)
+
+    def queue_depth(self, lane: str) -> int:
+        """Number of commands waiting for a worker in the lane"""
+        with self._lock:
+            return self._depths[lane]
+
+    def _change_depth(self, lane: str, delta: int) -> None:
+        with self._lock:
+            self._depths[lane] += delta
+            depth = self._depths[lane]
+        metrics.SCHEDULER_QUEUE_DEPTH.set(depth, lane=lane)
+
+    def schedule(self, callback: Callable, lane: str) -> Callable:
+        """
+        Wraps handler callback so that it is executed in the given lane,
+        wrapped callback returns a future of the handler's result.
+        """
+        if lane not in self._executors:
+            raise ValueError("Unknown scheduler lane: {}".format(lane))
+        executor = self._executors[lane]
+
+        @functools.wraps(callback)
+        def scheduled(*args, **kwargs):
+            submitted_at = time.time()
+            self._change_depth(lane, 1)
+
+            def run():
+                self._change_depth(lane, -1)
+                metrics.SCHEDULER_WAIT_SECONDS.observe(
+                    time.time() - submitted_at, lane=lane)
+                return callback(*args, **kwargs)
+
+            def report(future):
+                if future.cancelled() or future.exception() is None:
+                    return
+                error = future.exception()
+                logger.error("Handler {} failed: {}".format(
+                    callback.__name__, error), exc_info=error)
+                if self.on_error is not None:
+                    # Handlers are called with (bot, update, ...)
+                    update = args[1] if len(args) > 1 else None
+                    self.on_error(update, error)
+
+            future = executor.submit(run)
+            future.add_done_callback(report)
+            return future
+        return scheduled
+
+    def shutdown(self, wait: bool=True) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
 
 
 class TelegramBot(object):
@@ -16,48 +123,199 @@ class TelegramBot(object):
     Wrapper class representing bot.
     """
 
-    def __init__(self, token):
+    def __init__(self, token, workers=bot_settings.DISPATCHER_WORKERS,
+                 lanes=bot_settings.SCHEDULER_LANES,
+                 outbox=bot_settings.OUTBOX_ENABLED):
         self._token = token
-        self._updater = Updater(token=token)
+        self._outbox = Outbox() if outbox else None
+        self._updater = Updater(token=token, workers=workers)
         self._dispatcher = self._create_dispatcher(self._updater)
+        self._scheduler = CommandScheduler(
+            lanes, on_error=self._dispatcher.dispatch_error)
+        self._webhook = None
         self.log = bot_settings.logger
         self.log.info('Starting the telegram bot.')
 
+    @property
+    def dispatcher(self):
+        return self._dispatcher
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def outbox(self):
+        return self._outbox
+
+    def schedule(self, callback, lane):
+        return self._scheduler.schedule(callback, lane)
+
     def add_handler(self, handler, *args, **kwargs):
         self._dispatcher.add_handler(handler, *args, **kwargs)
 
+    def run_daily(self, callback, time_of_day):
+        """Runs job queue callback every day at the given local time"""
+        job = Job(callback, interval=24 * 60 * 60, repeat=True)
+        self._updater.job_queue.put(job, next_t=seconds_until(time_of_day))
+        return job
+
+    def send_message(self, chat_id, text, **kwargs):
+        """
+        Sends message through the outbox if it is enabled. Queued
+        messages are sent later, so the result is a Future of
+        telegram.Message rather than the message itself; the same
+        holds for bot.send* calls made by handlers.
+        """
+        return self._dispatcher.bot.sendMessage(chat_id=chat_id, text=text,
+                                                **kwargs)
+
     def add_error_handler(self, error_handler, *args, **kwargs):
         self._dispatcher.add_error_handler(error_handler, *args, **kwargs)
 
     def start_polling(self, *args, **kwargs):
+        self._start_outbox()
         return self._updater.start_polling(*args, **kwargs)
 
+    def _start_outbox(self):
+        if self._outbox is not None:
+            self._outbox.start()
+
+    def start_webhook(self,
+                      listen=bot_settings.WEBHOOK_LISTEN,
+                      port=bot_settings.WEBHOOK_PORT,
+                      url_path=bot_settings.WEBHOOK_PATH,
+                      webhook_url=bot_settings.WEBHOOK_URL,
+                      secret_token=bot_settings.WEBHOOK_SECRET,
+                      workers=bot_settings.WEBHOOK_WORKERS,
+                      max_queue_size=bot_settings.WEBHOOK_MAX_QUEUE_SIZE,
+                      sock=None):
+        """
+        Starts dispatcher and local HTTP server receiving updates,
+        registers webhook_url and secret_token with Telegram
+        if webhook_url is given.
+        Server accepts connections on `sock` if it is given.
+        """
+        self._start_outbox()
+        self._updater.job_queue.start()
+        dispatcher_thread = threading.Thread(target=self._dispatcher.start,
+                                             name='dispatcher')
+        dispatcher_thread.start()
+        self._webhook = WebhookServer(self._updater.update_queue,
+                                      bot=self._updater.bot,
+                                      listen=listen,
+                                      port=port,
+                                      url_path=url_path,
+                                      secret_token=secret_token,
+                                      workers=workers,
+                                      max_queue_size=max_queue_size,
+                                      sock=sock)
+        self._webhook.start()
+        if webhook_url:
+            set_webhook(self._updater.bot, webhook_url, secret_token)
+        return self._updater.update_queue
+
     def idle(self, *args, **kwargs):
-        return self._updater.idle(*args, **kwargs)
+        if self._webhook is None:
+            self._updater.idle(*args, **kwargs)
+            self._stop_senders()
+            return
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            signal.signal(sig, lambda signum, frame: stop_event.set())
+        while not stop_event.wait(1):
+            pass
+        self.stop()
+
+    def stop(self):
+        if self._webhook is not None:
+            self._webhook.stop()
+            self._webhook = None
+        self._updater.stop()
+        self._stop_senders()
+
+    def _stop_senders(self):
+        # Handlers still running may queue replies, so the outbox
+        # is drained only after all of them are done
+        self._scheduler.shutdown()
+        if self._outbox is not None:
+            self._outbox.stop()
+
+    def start_metrics_server(self, port=bot_settings.METRICS_PORT,
+                             host=bot_settings.METRICS_HOST):
+        return metrics.start_metrics_server(port, host=host)
 
     def _create_dispatcher(self, updater):
-        return updater.dispatcher
+        dispatcher = updater.dispatcher
+        dispatcher.bot = InstrumentedBot(dispatcher.bot)
+        if self._outbox is not None:
+            # Handlers return as soon as their replies are queued
+            dispatcher.bot = QueuedBot(dispatcher.bot, self._outbox)
+        return dispatcher
 
 
-def create_bot(api_token: str):
+def create_bot(api_token: str,
+               workers: int=bot_settings.DISPATCHER_WORKERS,
+               lanes: Mapping[str, int]=bot_settings.SCHEDULER_LANES):
     """
     Factory creating telegram Bot.
+
+    Handlers are split into scheduler lanes: 'instant' ones never
+    touch banks, 'standard' ones fetch a single page at most and 'heavy'
+    ones fan out to many dates or banks.
     """
 
-    bot = TelegramBot(token=api_token)
+    bot = TelegramBot(token=api_token, workers=workers, lanes=lanes)
 
-    bot.add_handler(CommandHandler('start', commands.start))
-    bot.add_handler(CommandHandler('help', commands.help_user))
-    bot.add_handler(CommandHandler('course', commands.course,
+    bot.add_handler(CommandHandler('start',
+                                   bot.schedule(commands.start, 'instant')))
+    bot.add_handler(CommandHandler('help',
+                                   bot.schedule(commands.help_user,
+                                                'instant')))
+    bot.add_handler(CommandHandler('course',
+                                   bot.schedule(commands.course, 'standard'),
+                                   pass_args=True))
+    bot.add_handler(CommandHandler('graph',
+                                   bot.schedule(commands.show_currency_graph,
+                                                'heavy'),
+                                   pass_args=True))
+    bot.add_handler(CommandHandler('banks',
+                                   bot.schedule(commands.list_banks,
+                                                'instant')))
+    bot.add_handler(CommandHandler('set',
+                                   bot.schedule(commands.set_default_bank,
+                                                'instant'),
+                                   pass_args=True))
+    bot.add_handler(CommandHandler('best',
+                                   bot.schedule(commands.best_course,
+                                                'heavy'),
                                    pass_args=True))
-    bot.add_handler(CommandHandler('graph', commands.show_currency_graph,
+    bot.add_handler(CommandHandler('subscribe',
+                                   bot.schedule(commands.subscribe,
+                                                'instant'),
                                    pass_args=True))
-    bot.add_handler(CommandHandler('banks', commands.list_banks))
-    bot.add_handler(CommandHandler('set', commands.set_default_bank,
+    bot.add_handler(CommandHandler('unsubscribe',
+                                   bot.schedule(commands.unsubscribe,
+                                                'instant')))
+    if subscription_store is not None:
+        broadcaster = Broadcaster(
+            subscription_store,
+            lambda chat_id, text: bot.send_message(
+                chat_id, text, parse_mode=telegram.ParseMode.HTML))
+        bot.run_daily(broadcaster.run_daily, bot_settings.DIGEST_TIME)
+    bot.add_handler(CommandHandler('alert',
+                                   bot.schedule(commands.set_alert,
+                                                'instant'),
                                    pass_args=True))
-    bot.add_handler(CommandHandler('best', commands.best_course,
+    bot.add_handler(CommandHandler('alerts',
+                                   bot.schedule(commands.list_alerts,
+                                                'instant'),
                                    pass_args=True))
-    inline_rate_handler = InlineQueryHandler(commands.inline_rate)
+    if alert_manager is not None:
+        alert_manager.send = lambda chat_id, text: bot.send_message(chat_id,
+                                                                    text)
+    inline_rate_handler = InlineQueryHandler(
+        bot.schedule(commands.inline_rate, 'heavy'))
     bot.add_handler(inline_rate_handler)
 
     # log all errors
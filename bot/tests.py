@@ -1,5 +1,22 @@
+import ast
 import datetime
+import inspect
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
+from queue import Queue
+from unittest import mock
+
+import numpy as np
+import telegram
+from telegram.error import RetryAfter
 
 from bot.utils import (
     get_date_arg,
@@ -8,7 +25,45 @@ from bot.utils import (
     sort_currencies
 )
 
-from bot.currency import Currency
+from bot.cache import (
+    DictionaryCache,
+    MemoryCache,
+    MmapCache,
+    RedisCache,
+    StrCacheAdapter,
+    TieredCache
+)
+from bot.cache import redis_settings
+from bot.cache.analytics import analyze, format_report
+from bot.cache.cache_proxy import CacheProxy
+from bot.cache.health import CacheHealth
+from bot.cache.snapshot import export_snapshot, import_snapshot
+from bot.currency import Currency, RateTable
+from bot.exceptions import BotBankUnavailableError, BotLoggedError
+from bot.loadgen import command_label, percentile
+from bot import commands, decorators, metrics, utils
+from bot.metrics import MetricsRegistry
+from bot.responses import ResponseCache
+from bot.resilience import CircuitBreaker, call_with_retries
+from bot.fetch import FetchExecutor, FetchQueueFullError
+from bot.telegrambot import CommandScheduler, TelegramBot
+from bot.webhook import WebhookServer, bind_socket
+from bot.alerts import ABOVE, BELOW, Alert, AlertIndex, AlertManager
+from bot.subscriptions import (
+    Broadcaster,
+    SubscriptionStore,
+    currencies_from_args,
+    seconds_until
+)
+from bot.outbox import Outbox, QueuedBot, TokenBucket
+from bot.publication import (
+    BusinessDayCalendar,
+    DailyCalendar,
+    orthodox_easter
+)
+from bot.backfill import Checkpoint, backfill_bank, publication_dates
+from bot.matrix import RateMatrix
+from bot.series import CurrencySeries, largest_triangle_indices
 
 
 class TestUtils(unittest.TestCase):
@@ -75,5 +130,1282 @@ class TestUtils(unittest.TestCase):
         c4 = Currency(iso="ZLT", buy=20, sell=30)
         self.assertEqual(sort_currencies([c1, c2, c3, c4]), [c2, c1, c3, c4])
 
+
+class TestLoadgen(unittest.TestCase):
+
+    def test_percentiles_use_nearest_rank(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 95), 95.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_command_label(self):
+        self.assertEqual(command_label('/graph -d 30'), 'graph')
+        self.assertEqual(command_label('inline:USD'), 'inline')
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_is_rendered_per_label_set(self):
+        counter = self.registry.counter('fetches_total', 'Fetches')
+        counter.inc(bank='nbrb')
+        counter.inc(2, bank='bgp')
+        rendered = self.registry.render()
+        self.assertIn('# TYPE fetches_total counter', rendered)
+        self.assertIn('fetches_total{bank="nbrb"} 1.0', rendered)
+        self.assertIn('fetches_total{bank="bgp"} 2.0', rendered)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('took', 'Took',
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        rendered = self.registry.render()
+        self.assertIn('took_bucket{le="0.1"} 1', rendered)
+        self.assertIn('took_bucket{le="1.0"} 2', rendered)
+        self.assertIn('took_bucket{le="+Inf"} 3', rendered)
+        self.assertIn('took_count 3\n', rendered)
+
+
+class TestResilience(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker('test', failure_threshold=2,
+                                      cooldown=10, clock=lambda: self.now)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_breaker_lets_single_trial_through_after_cooldown(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10.0
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_breaker(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10.0
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_retries_are_bounded(self):
+        calls = []
+
+        def failing():
+            calls.append(1)
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            call_with_retries(failing, 2, (ConnectionError,),
+                              sleep=lambda delay: None)
+        self.assertEqual(len(calls), 3)
+
+
+class TestCacheHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.backend_up = False
+        self.probes = []
+        self.health = CacheHealth('test', self._ping, errors=(OSError,),
+                                  failure_threshold=2, probe_interval=5,
+                                  background=False, clock=lambda: self.now)
+
+    def _ping(self):
+        self.probes.append(self.now)
+        if not self.backend_up:
+            raise OSError('down')
+
+    def test_backend_is_bypassed_after_failures(self):
+        self.health.record_failure()
+        self.assertTrue(self.health.is_available)
+        self.health.record_failure()
+        self.assertFalse(self.health.is_available)
+
+    def test_probe_brings_backend_back(self):
+        for _ in range(2):
+            self.health.record_failure()
+        self.assertFalse(self.health.probe())
+        self.assertEqual(self.probes, [])
+        self.now += 5
+        self.assertFalse(self.health.probe())
+        self.assertFalse(self.health.is_available)
+        self.backend_up = True
+        self.now += 5
+        self.assertTrue(self.health.probe())
+        self.assertTrue(self.health.is_available)
+        self.assertEqual(len(self.probes), 2)
+
+    def test_forked_process_probes_backend(self):
+        health = CacheHealth('fork', self._ping, errors=(OSError,),
+                             failure_threshold=1, probe_interval=0.05)
+        self.addCleanup(setattr, self, 'backend_up', True)
+        health.record_failure()
+        self.assertFalse(health.is_available)
+        pid = os.fork()
+        if pid == 0:
+            # Parent's prober thread is not running in the child
+            self.backend_up = True
+            deadline = time.time() + 5
+            while not health.is_available and time.time() < deadline:
+                time.sleep(0.01)
+            os._exit(0 if health.is_available else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
+class TestFetchExecutor(unittest.TestCase):
+
+    def test_rejects_fetches_over_queue_depth(self):
+        executor = FetchExecutor(max_workers=1, max_queue_depth=2,
+                                 per_host_limit=1)
+        release = threading.Event()
+        futures = [executor.submit(release.wait) for _ in range(2)]
+        with self.assertRaises(FetchQueueFullError):
+            executor.submit(release.wait)
+        release.set()
+        for future in futures:
+            future.result()
+        executor.shutdown()
+        self.assertEqual(executor.pending, 0)
+
+    def test_host_semaphores_are_shared_per_host(self):
+        executor = FetchExecutor(max_workers=1, per_host_limit=1)
+        first = executor.host_semaphore('http://www.nbrb.by/a?x=1')
+        second = executor.host_semaphore('http://WWW.NBRB.BY/b')
+        self.assertIs(first, second)
+        executor.shutdown()
+
+
+class TestCommandScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = CommandScheduler({'instant': 1, 'heavy': 1})
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def test_busy_lane_does_not_block_other_lanes(self):
+        release = threading.Event()
+        heavy = self.scheduler.schedule(release.wait, 'heavy')
+        instant = self.scheduler.schedule(lambda: 'done', 'instant')
+
+        heavy()
+        heavy()
+        self.assertEqual(instant().result(timeout=1), 'done')
+        release.set()
+
+    def test_unknown_lane_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.schedule(lambda: None, 'missing')
+
+    def test_handler_errors_are_passed_to_error_handler(self):
+        errors = []
+        self.scheduler.on_error = lambda update, error: errors.append(
+            (update, error))
+
+        def failing(bot, update):
+            raise KeyError('boom')
+        future = self.scheduler.schedule(failing, 'instant')(None, 'update')
+        with self.assertRaises(KeyError):
+            future.result(timeout=1)
+        self.scheduler.shutdown()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 'update')
+        self.assertIsInstance(errors[0][1], KeyError)
+
+
+class FakeTelegramBot(object):
+    """Records sent messages, fails with flood errors on demand"""
+
+    def __init__(self, flood_errors=0):
+        self.sent = []
+        self.flood_errors = flood_errors
+
+    def sendMessage(self, chat_id, text):
+        if self.flood_errors:
+            self.flood_errors -= 1
+            raise RetryAfter(0.05)
+        self.sent.append((chat_id, text, time.time()))
+        return text
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.outbox = Outbox(workers=4, global_rate=1000, chat_rate=20,
+                             chat_burst=1, group_rate=20, group_burst=1,
+                             max_retries=2)
+        self.outbox.start()
+        self.addCleanup(self.outbox.stop)
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.wait_time(0), 0)
+            bucket.take(0)
+        self.assertEqual(bucket.wait_time(0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+
+    def test_chat_messages_are_sent_in_order_within_limit(self):
+        telegram_bot = FakeTelegramBot()
+        bot = QueuedBot(telegram_bot, self.outbox)
+        futures = [bot.sendMessage(chat_id=1, text=str(i)) for i in range(5)]
+        self.assertEqual([f.result(timeout=5) for f in futures],
+                         ['0', '1', '2', '3', '4'])
+        sent_at = [t for _, _, t in telegram_bot.sent]
+        self.assertGreaterEqual(sent_at[-1] - sent_at[0], 0.15)
+
+    def test_flood_errors_are_retried(self):
+        telegram_bot = FakeTelegramBot(flood_errors=2)
+        bot = QueuedBot(telegram_bot, self.outbox)
+        self.assertEqual(bot.sendMessage(chat_id=1, text='hi').result(5), 'hi')
+        telegram_bot.flood_errors = 3
+        with self.assertRaises(RetryAfter):
+            bot.sendMessage(chat_id=1, text='hi').result(5)
+
+    def test_handlers_ignore_queued_results(self):
+        # Queued methods return futures, handlers must not use results
+        for module in (commands, decorators):
+            tree = ast.parse(inspect.getsource(module))
+            for node in ast.walk(tree):
+                for child in ast.iter_child_nodes(node):
+                    if not isinstance(child, ast.Call):
+                        continue
+                    func = child.func
+                    if isinstance(func, ast.Attribute) and \
+                            func.attr in QueuedBot.QUEUED_METHODS:
+                        self.assertIsInstance(
+                            node, ast.Expr, "{}:{} uses result of {}".format(
+                                module.__name__, child.lineno, func.attr))
+
+
+class TestWebhookServer(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = Queue()
+        self.server = WebhookServer(self.queue, port=0, url_path='hook',
+                                    secret_token='secret', workers=2,
+                                    max_queue_size=1)
+        self.server.start()
+        self.url = 'http://127.0.0.1:{}/hook'.format(
+            self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _post(self, payload, token='secret'):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json',
+                     'X-Telegram-Bot-Api-Secret-Token': token})
+        try:
+            return urllib.request.urlopen(request).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _update(self, update_id):
+        return {'update_id': update_id,
+                'message': {'message_id': 1, 'date': 0, 'text': '/course',
+                            'chat': {'id': 1, 'type': 'private'},
+                            'from': {'id': 1, 'first_name': 'test'}}}
+
+    def test_valid_update_is_queued(self):
+        self.assertEqual(self._post(self._update(1)), 200)
+        update = self.queue.get(timeout=1)
+        self.assertEqual(update.update_id, 1)
+        self.assertEqual(update.message.text, '/course')
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self._post(self._update(1), token='wrong'), 403)
+        self.assertEqual(self._post({'message': 'nope'}), 400)
+        self.assertTrue(self.queue.empty())
+
+    def test_full_queue_applies_backpressure(self):
+        self.assertEqual(self._post(self._update(1)), 200)
+        self.assertEqual(self._post(self._update(2)), 503)
+
+    def test_servers_share_listening_socket(self):
+        sock = bind_socket('127.0.0.1', 0)
+        queues = [Queue(), Queue()]
+        servers = [WebhookServer(queue, url_path='hook', secret_token=None,
+                                 sock=sock) for queue in queues]
+        for server in servers:
+            server.start()
+            self.addCleanup(server.stop)
+        self.url = 'http://127.0.0.1:{}/hook'.format(sock.getsockname()[1])
+        for update_id in range(4):
+            self.assertEqual(self._post(self._update(update_id)), 200)
+        self.assertEqual(sum(queue.qsize() for queue in queues), 4)
+
+    def test_registered_secret_is_accepted(self):
+        class FakeRequest(object):
+            def __init__(self):
+                self.posted = []
+
+            def post(self, url, data, timeout=None):
+                self.posted.append((url, data))
+                return True
+
+        request = FakeRequest()
+        bot = TelegramBot('123456:TEST', outbox=False)
+        bot._updater.bot._request = request
+        bot.start_webhook(port=0, url_path='hook', secret_token='s3cret',
+                          webhook_url='https://example.com/hook')
+        self.addCleanup(bot.stop)
+        url, data = request.posted[0]
+        self.assertTrue(url.endswith('/setWebhook'))
+        self.assertEqual(data['url'], 'https://example.com/hook')
+        self.url = 'http://127.0.0.1:{}/hook'.format(
+            bot._webhook.server_address[1])
+        # Telegram sends the registered token back with every update
+        self.assertEqual(self._post(self._update(1),
+                                    token=data['secret_token']), 200)
+
+
+class FakeParser(object):
+    """Parser returning predefined currencies, counts requests"""
+    name = 'Fake Bank'
+    short_name = 'fake'
+    MINIMAL_DATE = datetime.datetime(year=2004, month=5, day=1)
+
+    allowed_currencies = ('USD', 'EUR')
+
+    def __init__(self, currencies_by_date=None):
+        self.currencies_by_date = currencies_by_date or {}
+        self.requests = []
+
+    def is_available(self):
+        return True
+
+    def get_all_currencies(self, date=None):
+        self.requests.append(date)
+        return list(self.currencies_by_date.get(date, []))
+
+    def get_currency(self, currency_name='USD', date=None):
+        for currency in self.get_all_currencies(date):
+            if currency.iso == currency_name:
+                return currency
+        return None
+
+
+class FakeInlineBot(object):
+    """Records answers to inline queries"""
+
+    def __init__(self):
+        self.answers = []
+
+    def answerInlineQuery(self, query_id, results):
+        self.answers.append(results)
+
+
+class TestInlineRate(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = FakeInlineBot()
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency))
+        patcher = mock.patch.object(commands, 'cache_proxy', self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def inline_update(self, query):
+        return telegram.Update.de_json({
+            'update_id': 1,
+            'inline_query': {'id': '1', 'query': query, 'offset': '',
+                             'from': {'id': 1, 'first_name': 'test'}}},
+            None)
+
+    def test_failed_best_rate_is_answered(self):
+        with mock.patch.object(utils, 'get_parsers',
+                               return_value=[FakeParser()]), \
+                mock.patch.object(utils, 'get_best_currencies',
+                                  side_effect=BotLoggedError('no rates')):
+            commands.inline_rate(self.bot, self.inline_update('best usd'))
+        self.assertEqual(self.bot.answers, [[]])
+
+    def test_failing_bank_does_not_stop_others(self):
+        today = datetime.date.today()
+        broken = FakeParser()
+        broken.short_name = 'broken'
+        broken.get_all_currencies = mock.Mock(
+            side_effect=FetchQueueFullError('queue is full'))
+        working = FakeParser({today: [
+            Currency('USD', 'USD', sell=2.0, buy=1.9)]})
+        with mock.patch.object(utils, 'get_parsers',
+                               return_value=[broken, working]):
+            commands.inline_rate(self.bot, self.inline_update('usd'))
+        self.assertEqual([r.title for r in self.bot.answers[0]],
+                         ['Fake Bank'])
+
+
+class TestBestCurrencies(unittest.TestCase):
+
+    def setUp(self):
+        today = datetime.date.today()
+        self.matrix = RateMatrix()
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency))
+        self.proxy.add_snapshot_listener(self.matrix.on_snapshot)
+        self.parsers = []
+        for short_name, sell in (('nbrb', 1.0), ('a', 2.0), ('b', 2.1)):
+            parser = FakeParser({today: [
+                Currency('USD', 'USD', sell=sell, buy=sell - 0.1)]})
+            parser.short_name = parser.name = short_name
+            self.parsers.append(parser)
+        for name, value in (('rate_matrix', self.matrix),
+                            ('cache_proxy', self.proxy),
+                            ('get_parsers', lambda: self.parsers)):
+            patcher = mock.patch.object(utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_best_rates_are_served_from_matrix(self):
+        for _ in range(2):
+            best = utils.get_best_currencies('usd')
+        self.assertEqual(best['sell'][0], 'a')
+        self.assertEqual(best['sell'][1].sell, 2.0)
+        self.assertEqual(best['buy'][0], 'a')
+        # National bank is not a place to buy currency at
+        self.assertEqual(self.parsers[0].requests, [])
+        self.assertEqual([len(p.requests) for p in self.parsers[1:]], [1, 1])
+
+    def test_unknown_currency_is_reported(self):
+        with self.assertRaises(BotLoggedError):
+            utils.get_best_currencies('XYZ')
+
+
+class TestCacheProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.date = datetime.date(year=2017, month=1, day=7)
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency))
+
+    def test_cached_currency_is_not_requested_again(self):
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        parser = FakeParser({self.date: [usd]})
+        for _ in range(2):
+            currency = self.proxy.get_currency(parser, 'USD', self.date)
+        self.assertEqual(currency.sell, 2.0)
+        self.assertEqual(len(parser.requests), 1)
+
+    def test_missing_rates_are_cached_negatively(self):
+        parser = FakeParser()
+        for _ in range(2):
+            currency = self.proxy.get_currency(parser, 'USD', self.date)
+        self.assertTrue(currency.is_empty())
+        self.assertEqual(len(parser.requests), 1)
+
+    def test_dates_before_minimal_date_are_not_requested(self):
+        parser = FakeParser()
+        old_date = datetime.date(year=2000, month=1, day=1)
+        currency = self.proxy.get_currency(parser, 'USD', old_date)
+        self.assertTrue(currency.is_empty())
+        self.assertEqual(parser.requests, [])
+
+    def test_concurrent_requests_fetch_once(self):
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        parser = FakeParser({self.date: [usd]})
+        fetching = threading.Event()
+        get_all_currencies = parser.get_all_currencies
+
+        def slow_get_all_currencies(date=None):
+            fetching.set()
+            time.sleep(0.1)
+            return get_all_currencies(date)
+        parser.get_all_currencies = slow_get_all_currencies
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.proxy.get_currency(parser, 'USD', self.date)))
+            for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([c.sell for c in results], [2.0] * 3)
+        self.assertEqual(len(parser.requests), 1)
+
+    def test_bulk_read_returns_cached_dates_only(self):
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        parser = FakeParser({self.date: [usd]})
+        self.proxy.get_currency(parser, 'USD', self.date)
+        other_date = self.date - datetime.timedelta(days=1)
+        cached = self.proxy.get_cached_currencies(parser, 'USD',
+                                                  [self.date, other_date])
+        self.assertEqual(list(cached), [self.date])
+        self.assertEqual(cached[self.date].sell, 2.0)
+
+    def test_listeners_are_notified_of_fetched_rates(self):
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        parser = FakeParser({self.date: [usd]})
+        snapshots = []
+        self.proxy.add_snapshot_listener(
+            lambda *args: snapshots.append(args))
+        for _ in range(2):
+            self.proxy.get_all_currencies(parser, self.date)
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(snapshots[0], (parser, self.date, [usd], True))
+
+    def test_lookups_are_counted_per_bank(self):
+        labels = {'backend': 'MemoryCache', 'bank': 'fake',
+                  'operation': 'get'}
+        before = {result: metrics.CACHE_REQUESTS.value(result=result,
+                                                       **labels)
+                  for result in ('hit', 'miss', 'negative_hit')}
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        parser = FakeParser({self.date: [usd]})
+        for currency_name in ('USD', 'USD', 'EUR', 'EUR'):
+            self.proxy.get_currency(parser, currency_name, self.date)
+        for result, count in (('hit', 1), ('miss', 2), ('negative_hit', 1)):
+            self.assertEqual(metrics.CACHE_REQUESTS.value(result=result,
+                                                          **labels),
+                             before[result] + count)
+
+
+class DeferredExecutor(object):
+    """Executor running submitted calls on demand"""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for fn, args in calls:
+            fn(*args)
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.now = 1000000.0
+        self.executor = DeferredExecutor()
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency),
+                                soft_ttl=60, hard_ttl=600, stale_if_error=3600,
+                                executor=self.executor,
+                                clock=lambda: self.now)
+        self.parser = FakeParser(
+            {self.today: [Currency('USD', 'USD', sell=2.0, buy=1.9)]})
+        self.proxy.get_currency(self.parser, 'USD', self.today)
+        self.parser.currencies_by_date[self.today] = [
+            Currency('USD', 'USD', sell=2.1, buy=2.0)]
+
+    def test_fresh_snapshot_is_served_from_cache(self):
+        self.now += 30
+        currency = self.proxy.get_currency(self.parser, 'USD', self.today)
+        self.assertEqual(currency.sell, 2.0)
+        self.assertEqual(len(self.parser.requests), 1)
+        self.assertEqual(self.executor.calls, [])
+
+    def test_stale_snapshot_is_served_and_refreshed_once(self):
+        self.now += 120
+        for _ in range(3):
+            currency = self.proxy.get_currency(self.parser, 'USD', self.today)
+            self.assertEqual(currency.sell, 2.0)
+        self.assertEqual(len(self.executor.calls), 1)
+        self.executor.run_all()
+        currency = self.proxy.get_currency(self.parser, 'USD', self.today)
+        self.assertEqual(currency.sell, 2.1)
+        self.assertEqual(len(self.parser.requests), 2)
+
+    def test_expired_snapshot_is_fetched(self):
+        self.now += 900
+        currency = self.proxy.get_currency(self.parser, 'USD', self.today)
+        self.assertEqual(currency.sell, 2.1)
+        self.assertEqual(self.executor.calls, [])
+
+    def test_stale_snapshot_is_served_while_bank_is_down(self):
+        def unavailable(date=None):
+            raise BotBankUnavailableError('fake')
+        self.parser.get_all_currencies = unavailable
+        self.now += 900
+        currency = self.proxy.get_currency(self.parser, 'USD', self.today)
+        self.assertEqual(currency.sell, 2.0)
+        self.now += 3600
+        with self.assertRaises(BotBankUnavailableError):
+            self.proxy.get_currency(self.parser, 'USD', self.today)
+
+    def test_snapshot_refreshed_by_other_process_is_not_refetched(self):
+        backend = MemoryCache(clock=lambda: self.now)
+        proxies = [CacheProxy(StrCacheAdapter(
+            TieredCache(backend, ttl=3600, clock=lambda: self.now),
+            Currency), soft_ttl=60, hard_ttl=600, stale_if_error=3600,
+            executor=self.executor, clock=lambda: self.now)
+            for _ in range(2)]
+        parser = FakeParser(
+            {self.today: [Currency('USD', 'USD', sell=2.0, buy=1.9)]})
+        for proxy in proxies:
+            proxy.get_currency(parser, 'USD', self.today)
+        self.assertEqual(len(parser.requests), 1)
+        parser.currencies_by_date[self.today] = [
+            Currency('USD', 'USD', sell=2.1, buy=2.0)]
+        self.now += 900
+        for proxy in proxies:
+            currency = proxy.get_currency(parser, 'USD', self.today)
+            self.assertEqual(currency.sell, 2.1)
+        self.assertEqual(len(parser.requests), 2)
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = MemoryCache(max_items=3, max_bytes=1024,
+                                 clock=lambda: self.now)
+
+    def test_items_expire(self):
+        self.cache.put('a', '1', expire=10)
+        self.cache.put('b', '2')
+        self.now += 10
+        self.assertEqual(self.cache.get_many(['a', 'b']), [None, '2'])
+        self.assertEqual([key for key, _, _ in self.cache.iter_items()], ['b'])
+
+    def test_least_recently_used_items_are_evicted(self):
+        for key in 'abc':
+            self.cache.put(key, key)
+        self.cache.get('a')
+        self.cache.put('d', 'd')
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+
+    def test_cache_is_bounded_by_size(self):
+        self.cache.put('a', 'x' * 500)
+        self.cache.put('b', 'x' * 500)
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('c', 'x' * 2000)
+        self.assertIsNone(self.cache.get('c'))
+        self.assertEqual(self.cache.get('b'), 'x' * 500)
+        self.cache.delete('b')
+        self.assertEqual(self.cache.size_bytes, 0)
+
+
+class TestTieredCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.backend = DictionaryCache()
+        self.cache = TieredCache(self.backend, size=2, ttl=60,
+                                 clock=lambda: self.now)
+
+    def test_hot_keys_are_read_locally(self):
+        self.backend.put('a', '1')
+        self.assertEqual(self.cache.get('a'), '1')
+        self.backend.put('a', '2')
+        self.assertEqual(self.cache.get('a'), '1')
+        self.now += 61
+        self.assertEqual(self.cache.get('a'), '2')
+
+    def test_writes_replace_local_items(self):
+        self.cache.get_many(['a', 'b'])
+        self.cache.put('a', '1')
+        self.cache.put_many([('b', '2')])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), ['1', '2', None])
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_least_recently_used_items_are_evicted(self):
+        for key in 'abc':
+            self.backend.put(key, key)
+            self.cache.get(key)
+        self.assertEqual(len(self.cache), 2)
+        self.backend.put('a', 'new')
+        self.assertEqual(self.cache.get('a'), 'new')
+
+
+
+class TestCacheAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache()
+        for day in (1, 2, 4):
+            self.cache.put('nbrb_usd_0{}.01.2017'.format(day), '1.9,2.0,1')
+        self.cache.put('nbrb_eur_01.01.2017', 'none')
+        self.cache.put('bgp_usd_01.01.2017', '1.9,2.0,1')
+        self.cache.put('snapshot:bgp:01.01.2017', '{}')
+
+    def test_keys_are_grouped_by_bank_and_currency(self):
+        stats = analyze(self.cache)
+        usd = stats.series[('nbrb', 'usd')]
+        self.assertEqual(usd.keys, 3)
+        self.assertEqual(usd.last_date, datetime.date(2017, 1, 4))
+        self.assertEqual(usd.coverage, 0.75)
+        self.assertEqual(stats.series[('nbrb', 'eur')].negative, 1)
+        self.assertEqual(stats.by_bank()['nbrb'].keys, 4)
+        self.assertEqual(stats.other['snapshot'].keys, 1)
+        self.assertEqual(stats.total().keys, 6)
+        self.assertIn('nbrb/USD', format_report(stats))
+
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.date = datetime.date(year=2017, month=1, day=7)
+        self.responses = ResponseCache(max_entries=2)
+
+    def test_texts_are_versioned(self):
+        self.responses.put('nbrb', self.date, 'all', 1.0, 'old')
+        self.assertEqual(self.responses.get('nbrb', self.date, 'all', 1.0),
+                         'old')
+        self.responses.put('nbrb', self.date, 'all', 2.0, 'new')
+        self.assertIsNone(self.responses.get('nbrb', self.date, 'all', 1.0))
+        self.assertEqual(self.responses.get('nbrb', self.date, 'all', 2.0),
+                         'new')
+
+    def test_refreshed_snapshot_drops_texts(self):
+        self.responses.put('fake', self.date, 'all', None, 'text')
+        self.responses.on_snapshot(FakeParser(), self.date, [], False)
+        self.assertEqual(self.responses.get('fake', self.date, 'all'), 'text')
+        self.responses.on_snapshot(FakeParser(), self.date, [], True)
+        self.assertIsNone(self.responses.get('fake', self.date, 'all'))
+
+    def test_least_recently_used_dates_are_evicted(self):
+        for day in range(3):
+            date = self.date + datetime.timedelta(days=day)
+            self.responses.put('nbrb', date, 'all', None, 'text')
+        self.assertEqual(len(self.responses), 2)
+        self.assertIsNone(self.responses.get('nbrb', self.date, 'all'))
+
+    def test_unversioned_texts_expire(self):
+        now = [100.0]
+        responses = ResponseCache(ttl=60, clock=lambda: now[0])
+        responses.put('nbrb', self.date, 'all', None, 'past')
+        now[0] += 59
+        self.assertEqual(responses.get('nbrb', self.date, 'all'), 'past')
+        now[0] += 1
+        self.assertIsNone(responses.get('nbrb', self.date, 'all'))
+        responses.put('nbrb', self.date, 'all', 1.0, 'today')
+        now[0] += 3600
+        self.assertEqual(responses.get('nbrb', self.date, 'all', 1.0),
+                         'today')
+
+
+class TestSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.date = datetime.date(year=2017, month=1, day=7)
+        self.store = SubscriptionStore(MemoryCache())
+        self.parser = FakeParser({self.date: [
+            Currency('USD', 'USD', sell=2.0, buy=1.9),
+            Currency('EUR', 'EUR', sell=2.2, buy=2.1)]})
+        self.sent = []
+        self.broadcaster = Broadcaster(
+            self.store, lambda chat_id, text: self.sent.append((chat_id, text)),
+            proxy=CacheProxy(StrCacheAdapter(MemoryCache(), Currency)),
+            get_parser=lambda name: self.parser)
+
+    def test_subscribers_are_grouped_by_digest(self):
+        self.store.subscribe(1, 'fake', ['USD'])
+        self.store.subscribe(2, 'fake', ['USD', 'USD'])
+        self.store.subscribe(3, 'fake')
+        self.store.subscribe(4, 'fake')
+        self.assertTrue(self.store.unsubscribe(4))
+        self.assertFalse(self.store.unsubscribe(4))
+        digests = self.store.digests()
+        self.assertEqual(sorted(digests[('fake', ('USD',))]), [1, 2])
+        self.assertEqual(digests[('fake', ())], [3])
+
+    def test_digests_are_rendered_once_and_sent_to_all(self):
+        for chat_id in range(5):
+            self.store.subscribe(chat_id, 'fake', ['USD'])
+        self.store.subscribe(5, 'fake')
+        self.assertEqual(self.broadcaster.broadcast(self.date), 6)
+        self.assertEqual(len(self.parser.requests), 1)
+        texts = dict(self.sent)
+        self.assertNotIn('EUR', texts[0])
+        self.assertIn('EUR', texts[5])
+
+    def test_daily_digest_is_sent_once(self):
+        today = datetime.date.today()
+        self.parser.currencies_by_date[today] = \
+            self.parser.currencies_by_date[self.date]
+        self.store.subscribe(1, 'fake')
+        self.broadcaster.run_daily(None, None)
+        self.broadcaster.run_daily(None, None)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.parser.requests), 1)
+
+    def test_failing_bank_does_not_stop_broadcast(self):
+        def get_parser(name):
+            if name == 'broken':
+                raise ValueError("Page layout changed")
+            return self.parser
+        self.broadcaster.get_parser = get_parser
+        self.store.subscribe(1, 'broken')
+        self.store.subscribe(2, 'fake')
+        self.assertEqual(self.broadcaster.broadcast(self.date), 1)
+        self.assertEqual(self.sent[0][0], 2)
+
+    def test_digest_is_not_marked_sent_without_subscriptions(self):
+        class UnavailableCache(MemoryCache):
+            is_available = False
+
+        self.store.cache = UnavailableCache()
+        self.store.subscribe(1, 'fake')
+        self.broadcaster.run_daily(None, None)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(list(self.store.cache.iter_items('digest:*')), [])
+
+    def test_seconds_until_next_time_of_day(self):
+        now = datetime.datetime(2017, 1, 7, 12, 0)
+        self.assertEqual(seconds_until(datetime.time(13, 0), now), 3600)
+        self.assertEqual(seconds_until(datetime.time(11, 0), now), 23 * 3600)
+        self.assertEqual(currencies_from_args(['-c', 'usd', '-b', 'x', '-c',
+                                               'EUR']), ['USD', 'EUR'])
+
+
+class TestAlerts(unittest.TestCase):
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.parser = FakeParser({})
+        self.sent = []
+        self.manager = AlertManager(
+            MemoryCache(),
+            lambda chat_id, text: self.sent.append((chat_id, text)))
+
+    def rates(self, sell):
+        return [Currency('USD', 'USD', sell=sell, buy=sell - 0.1)]
+
+    def test_index_finds_crossed_thresholds_only(self):
+        alerts = [Alert(str(i), 1, 'fake', 'usd', 'sell', direction, value)
+                  for i, (direction, value) in enumerate([
+                      (BELOW, 2.0), (BELOW, 2.05), (BELOW, 2.1),
+                      (ABOVE, 2.0), (ABOVE, 2.05), (ABOVE, 2.1)])]
+        index = AlertIndex(alerts)
+        crossed = lambda old, new: sorted(
+            a.id for a in index.crossed('fake', 'USD', 'sell', old, new))
+        self.assertEqual(crossed(2.1, 2.0), ['1', '2'])
+        self.assertEqual(crossed(2.2, 2.06), ['2'])
+        self.assertEqual(crossed(2.0, 2.05), ['3'])
+        self.assertEqual(crossed(1.9, 2.2), ['3', '4', '5'])
+        self.assertEqual(crossed(2.05, 2.05), [])
+        index.remove(alerts[2])
+        self.assertEqual(crossed(2.1, 2.0), ['1'])
+        self.assertEqual(len(index), 5)
+
+    def test_alert_fires_once_on_crossing(self):
+        self.manager.add(1, 'fake', 'usd', 'sell', BELOW, 2.05)
+        self.manager.add(2, 'fake', 'usd', 'buy', ABOVE, 3.0)
+        self.manager.on_snapshot(self.parser, self.today,
+                                 self.rates(2.1), True)
+        self.assertEqual(self.sent, [])
+        self.manager.on_snapshot(self.parser, self.today,
+                                 self.rates(2.0), True)
+        self.manager.on_snapshot(self.parser, self.today,
+                                 self.rates(2.1), True)
+        self.manager.on_snapshot(self.parser, self.today,
+                                 self.rates(2.0), True)
+        self.assertEqual([chat_id for chat_id, _ in self.sent], [1])
+        self.assertEqual(self.manager.alerts_of(1), [])
+        self.assertEqual(len(self.manager.alerts_of(2)), 1)
+
+    def test_alerts_of_other_days_are_ignored(self):
+        self.manager.add(1, 'fake', 'usd', 'sell', BELOW, 2.05)
+        yesterday = self.today - datetime.timedelta(days=1)
+        self.manager.on_snapshot(self.parser, yesterday,
+                                 self.rates(2.1), True)
+        self.manager.on_snapshot(self.parser, yesterday,
+                                 self.rates(2.0), True)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.manager.clear(1), 1)
+        self.assertEqual(self.manager.clear(1), 0)
+
+    def test_processes_apply_changes_of_each_other(self):
+        loads = []
+
+        class CountingCache(MemoryCache):
+            def iter_items(self, match=None):
+                loads.append(match)
+                return super().iter_items(match=match)
+
+        cache = CountingCache()
+        first = AlertManager(cache, lambda *args: self.sent.append(1))
+        second = AlertManager(cache, lambda *args: self.sent.append(2))
+        first.sync()
+        second.sync()
+        self.assertEqual(len(loads), 2)
+        first.add(1, 'fake', 'usd', 'sell', BELOW, 2.05)
+        for manager in (first, second):
+            manager.on_snapshot(self.parser, self.today,
+                                self.rates(2.1), True)
+        for manager in (second, first):
+            manager.on_snapshot(self.parser, self.today,
+                                self.rates(2.0), True)
+        # Second process fired it, first one knows it is gone
+        self.assertEqual(self.sent, [2])
+        self.assertEqual(first.alerts_of(1), [])
+        self.assertEqual(len(loads), 2)
+
+    def test_unavailable_cache_keeps_index(self):
+        self.manager.add(1, 'fake', 'usd', 'sell', BELOW, 2.05)
+        self.manager.sync()
+
+        class UnavailableCache(MemoryCache):
+            is_available = False
+
+        self.manager.cache = UnavailableCache()
+        self.manager.sync()
+        self.assertEqual(len(self.manager.alerts_of(1)), 1)
+        self.manager.cache = MemoryCache()
+        self.manager.sync()
+        self.assertEqual(self.manager.alerts_of(1), [])
+
+
+class TestCacheSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.path = os.path.join(snapshot_dir, 'cache.snapshot.gz')
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        self.cache = DictionaryCache()
+        self.cache.put('bgp_usd_07.01.2017', '1.9,2.0,1')
+        self.cache.put('bgp_eur_07.01.2017', 'none', expire=600)
+        self.cache.put('bgp_rub_07.01.2017', 'none', expire=-1)
+
+    def test_snapshot_round_trip(self):
+        self.assertEqual(export_snapshot(self.cache, self.path), 2)
+        other = DictionaryCache()
+        self.assertEqual(import_snapshot(other, self.path), 2)
+        self.assertEqual(other.get('bgp_usd_07.01.2017'), '1.9,2.0,1')
+        self.assertEqual(other.get('bgp_eur_07.01.2017'), 'none')
+        self.assertIsNotNone(other.data['bgp_eur_07.01.2017'][1])
+
+    def test_existing_keys_are_kept(self):
+        export_snapshot(self.cache, self.path)
+        other = DictionaryCache()
+        other.put('bgp_usd_07.01.2017', '1.8,2.1,1')
+        self.assertEqual(import_snapshot(other, self.path), 1)
+        self.assertEqual(other.get('bgp_usd_07.01.2017'), '1.8,2.1,1')
+
+    def test_unavailable_redis_is_not_exported(self):
+        export_snapshot(self.cache, self.path)
+        # Nothing listens on a port that was just released
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        with mock.patch.object(redis_settings, 'REDIS_HOST', '127.0.0.1'), \
+                mock.patch.object(redis_settings, 'REDIS_PORT', port):
+            cache = RedisCache(Currency, __name__)
+        self.assertEqual(list(cache.iter_items()), [])
+        for _ in range(5):
+            cache.get('key')
+        self.assertFalse(cache.is_available)
+        self.assertEqual(export_snapshot(cache, self.path), 0)
+        other = DictionaryCache()
+        self.assertEqual(import_snapshot(other, self.path), 2)
+
+
+class TestMmapCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.base_date = datetime.date(year=2017, month=1, day=1)
+        self.cache = self.create_cache()
+        self.adapter = StrCacheAdapter(self.cache, Currency)
+
+    def create_cache(self):
+        cache = MmapCache(self.directory, base_date=lambda _: self.base_date)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_rates_are_shared_through_files(self):
+        date = datetime.date(year=2017, month=3, day=1)
+        usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        self.adapter.cache_currency('bgp', usd, date)
+        adapter = StrCacheAdapter(self.create_cache(), Currency)
+        self.assertEqual(adapter.get_cached_value('bgp', 'USD', date), usd)
+        self.assertIsNone(adapter.get_cached_value(
+            'bgp', 'USD', date + datetime.timedelta(days=1000)))
+
+    def test_missing_rates_expire(self):
+        date = datetime.date(year=2017, month=3, day=1)
+        self.adapter.cache_missing('bgp', 'USD', date, expire=600)
+        self.assertTrue(
+            self.adapter.get_cached_value('bgp', 'USD', date).is_empty())
+        self.adapter.cache_missing('bgp', 'USD', date, expire=-1)
+        self.assertIsNone(self.adapter.get_cached_value('bgp', 'USD', date))
+
+    def test_range_read(self):
+        for day in range(1, 11):
+            date = datetime.date(year=2017, month=1, day=day)
+            usd = Currency('USD', 'USD', sell=float(day), buy=1.0)
+            self.adapter.cache_currency('bgp', usd, date)
+        records = self.cache.read_range(
+            'bgp', 'usd', datetime.date(year=2017, month=1, day=5),
+            datetime.date(year=2017, month=1, day=20))
+        self.assertEqual(list(records['sell'][:6]),
+                         [5.0, 6.0, 7.0, 8.0, 9.0, 10.0])
+        self.assertEqual(list(records['flag'][6:12]), [0] * 6)
+
+    def test_other_keys_use_fallback(self):
+        self.cache.put('user_42_bank', 'bgp')
+        self.assertEqual(self.cache.get('user_42_bank'), 'bgp')
+
+
+class TestRateTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = RateTable([
+            Currency('Dollar', 'USD', sell=2.0, buy=1.9),
+            Currency.empty_currency(),
+            Currency('Euro', 'EUR', sell=2.2, buy=2.1),
+        ])
+
+    def test_lookup_by_iso(self):
+        self.assertEqual(len(self.table), 2)
+        self.assertIn('usd', self.table)
+        self.assertEqual(self.table.get('EUR').sell, 2.2)
+        self.assertIsNone(self.table.get('RUB'))
+
+    def test_iteration_yields_currencies(self):
+        self.assertEqual(list(self.table),
+                         [Currency('Dollar', 'USD', sell=2.0, buy=1.9),
+                          Currency('Euro', 'EUR', sell=2.2, buy=2.1)])
+
+    def test_same_iso_is_replaced(self):
+        self.table.add(Currency('Dollar', 'USD', sell=2.5, buy=2.4))
+        self.assertEqual(len(self.table), 2)
+        self.assertEqual(self.table.get('USD').sell, 2.5)
+
+
+class TestRateMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.matrix = RateMatrix(clock=lambda: self.now)
+        self.date = datetime.date(year=2017, month=1, day=9)
+
+    def update(self, bank, rates, complete=True, date=None):
+        currencies = [Currency(iso, iso, sell=sell, buy=buy)
+                      for iso, buy, sell in rates]
+        self.matrix.update(bank, bank.upper(), date or self.date,
+                           currencies, complete=complete)
+
+    def test_extremes_follow_updates(self):
+        self.update('a', [('USD', 1.9, 2.0), ('EUR', 2.0, 2.1)])
+        self.update('b', [('USD', 1.8, 2.2)])
+        self.assertEqual(self.matrix.lowest('usd')[0], 'A')
+        self.assertEqual(self.matrix.lowest('USD', side='buy')[0], 'B')
+        self.assertEqual(self.matrix.highest('USD')[1].sell, 2.2)
+        self.assertEqual(self.matrix.lowest('EUR')[0], 'A')
+        self.update('a', [('USD', 1.9, 2.5)], complete=False)
+        self.assertEqual(self.matrix.lowest('USD')[0], 'B')
+        self.assertEqual(self.matrix.lowest('EUR')[0], 'A')
+
+    def test_complete_update_clears_missing_currencies(self):
+        self.update('a', [('USD', 1.9, 2.0), ('EUR', 2.0, 2.1)])
+        self.update('a', [('USD', 1.9, 2.0)])
+        self.assertIsNone(self.matrix.lowest('EUR'))
+        self.assertEqual(list(self.matrix.bank_rates('a')), ['USD'])
+
+    def test_new_day_resets_matrix(self):
+        self.update('a', [('USD', 1.9, 2.0)])
+        next_day = self.date + datetime.timedelta(days=1)
+        self.update('b', [('USD', 1.8, 2.2)], date=next_day)
+        self.assertEqual(self.matrix.lowest('USD')[0], 'B')
+        self.assertFalse(self.matrix.is_fresh('a', 'USD', next_day, 60))
+
+    def test_rates_get_stale(self):
+        self.update('a', [('USD', 1.9, 2.0)])
+        self.assertTrue(self.matrix.is_fresh('a', 'USD', self.date, 60))
+        self.now += 60
+        self.assertFalse(self.matrix.is_fresh('a', 'USD', self.date, 60))
+
+    def test_rates_of_last_publication_day_are_todays(self):
+        today = datetime.date.today()
+        friday = today - datetime.timedelta(days=1)
+
+        class ClosedToday(object):
+            def effective_date(self, date):
+                return friday if date == today else date
+
+        parser = FakeParser({})
+        parser.publication_calendar = ClosedToday()
+        usd = [Currency('USD', 'USD', sell=2.0, buy=1.9)]
+        self.matrix.on_snapshot(parser, today, usd, True)
+        self.assertIsNone(self.matrix.lowest('USD'))
+        self.matrix.on_snapshot(parser, friday, usd, True)
+        self.assertEqual(self.matrix.lowest('USD')[0], 'Fake Bank')
+        self.assertTrue(self.matrix.is_fresh('fake', 'USD', today, 60))
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.end = datetime.date(year=2017, month=1, day=10)
+        self.usd = Currency('USD', 'USD', sell=2.0, buy=1.9)
+        self.parser = FakeParser({
+            self.end - datetime.timedelta(days=i): [self.usd]
+            for i in range(10)})
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency))
+        self.executor = FetchExecutor(max_workers=2, max_queue_depth=4)
+        self.addCleanup(self.executor.shutdown)
+        checkpoint_file = tempfile.NamedTemporaryFile(delete=False)
+        checkpoint_file.close()
+        os.unlink(checkpoint_file.name)
+        self.checkpoint_path = checkpoint_file.name
+        self.addCleanup(lambda: os.path.exists(self.checkpoint_path) and
+                        os.unlink(self.checkpoint_path))
+
+    def backfill(self):
+        start = self.end - datetime.timedelta(days=9)
+        return backfill_bank(self.parser, ['USD'], start, self.end,
+                             Checkpoint(self.checkpoint_path),
+                             self.executor, proxy=self.proxy, chunk_size=4)
+
+    def test_rates_are_cached(self):
+        self.assertEqual(self.backfill(), 10)
+        cached = self.proxy.get_cached_currencies(
+            self.parser, 'USD', list(self.parser.currencies_by_date))
+        self.assertEqual(len(cached), 10)
+
+    def test_finished_job_is_not_repeated(self):
+        self.backfill()
+        self.assertEqual(self.backfill(), 0)
+        self.assertEqual(len(self.parser.requests), 10)
+
+    def test_business_days_are_fetched_once(self):
+        self.parser.publication_calendar = BusinessDayCalendar()
+        dates = publication_dates(self.parser,
+                                  self.end - datetime.timedelta(days=9),
+                                  self.end)
+        self.assertEqual(len(dates), 7)
+        self.assertEqual(dates[0], self.end)
+
+
+class TestPublicationCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = BusinessDayCalendar()
+
+    def test_weekend_maps_to_friday(self):
+        saturday = datetime.date(year=2017, month=1, day=14)
+        sunday = datetime.date(year=2017, month=1, day=15)
+        friday = datetime.date(year=2017, month=1, day=13)
+        self.assertEqual(self.calendar.effective_date(saturday), friday)
+        self.assertEqual(self.calendar.effective_date(sunday), friday)
+        self.assertEqual(self.calendar.effective_date(friday), friday)
+
+    def test_holidays_are_skipped(self):
+        # Victory Day on Tuesday
+        self.assertEqual(
+            self.calendar.effective_date(datetime.date(2017, 5, 9)),
+            datetime.date(2017, 5, 8))
+        # Radunitsa: Easter on 16th of April + 9 days
+        self.assertEqual(orthodox_easter(2017), datetime.date(2017, 4, 16))
+        self.assertEqual(
+            self.calendar.effective_date(datetime.date(2017, 4, 25)),
+            datetime.date(2017, 4, 24))
+
+
+class TestCurrencySeries(unittest.TestCase):
+
+    def setUp(self):
+        self.day = lambda d: datetime.date(year=2016, month=7, day=d)
+        pairs = [
+            (self.day(3), Currency('USD', 'USD', sell=2.0, buy=1.9)),
+            (self.day(1), Currency('USD', 'USD', sell=2.2, buy=2.1)),
+            (self.day(2), Currency.empty_currency()),
+        ]
+        self.series = CurrencySeries.from_pairs(pairs)
+
+    def test_series_is_sorted_by_date(self):
+        self.assertEqual(self.series.to_dates(),
+                         [self.day(1), self.day(2), self.day(3)])
+        self.assertEqual(self.series.iso, 'USD')
+
+    def test_gaps_are_filled_forward(self):
+        buy, sell = self.series.fill_gaps().normalized()
+        self.assertEqual(list(sell), [2.2, 2.2, 2.0])
+
+    def test_resample_takes_latest_known_rate(self):
+        resampled = self.series.resample([self.day(5), self.day(1)])
+        self.assertEqual(resampled.to_dates(), [self.day(1), self.day(5)])
+        self.assertEqual(list(resampled.sell), [2.2, 2.0])
+
+    def test_missing_multipliers_are_denominated(self):
+        old = datetime.date(year=2016, month=6, day=30)
+        currency = Currency('USD', 'USD', sell=20000, buy=19000,
+                            multiplier=0)
+        series = CurrencySeries.from_pairs([(old, currency)]).denominated()
+        self.assertEqual(list(series.normalized()[1]), [2.0])
+
+    def test_downsampling_keeps_spikes(self):
+        start = datetime.date(year=2016, month=7, day=1)
+        pairs = []
+        for i in range(1000):
+            sell = 5.0 if i == 517 else 2.0 + (i % 3) * 0.01
+            pairs.append((start + datetime.timedelta(days=i),
+                          Currency('USD', 'USD', sell=sell, buy=sell)))
+        series = CurrencySeries.from_pairs(pairs).downsample(50)
+        self.assertEqual(len(series), 50)
+        self.assertEqual(series.to_dates()[0], start)
+        self.assertEqual(series.max(), (start + datetime.timedelta(days=517),
+                                        5.0))
+
+    def test_short_lines_are_not_downsampled(self):
+        x = np.arange(5, dtype=float)
+        self.assertEqual(list(largest_triangle_indices(x, (x,), 10)),
+                         [0, 1, 2, 3, 4])
+
+    def test_min_and_max(self):
+        self.assertEqual(self.series.min(), (self.day(3), 2.0))
+        self.assertEqual(self.series.max('buy'), (self.day(1), 2.1))
+
+
+class TestGraphSeries(unittest.TestCase):
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.proxy = CacheProxy(StrCacheAdapter(MemoryCache(), Currency))
+        patcher = mock.patch.object(commands, 'cache_proxy', self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rates = {}
+        for days in range(61):
+            date = self.today - datetime.timedelta(days=days)
+            sell = 2.0 + days * 0.01
+            self.rates[date] = [Currency('USD', 'USD', sell=sell, buy=sell)]
+        self.parser = FakeParser(self.rates)
+        self.parser.publication_calendar = DailyCalendar()
+
+    def test_cached_history_is_used_and_downsampled(self):
+        self.proxy.cache_currencies(
+            self.parser, [(date, currencies[0])
+                          for date, currencies in self.rates.items()
+                          if 1 <= (self.today - date).days <= 30])
+        series = commands.graph_series(self.parser, 'USD', 60, self.today,
+                                       max_points=20)
+        # 13 sampled dates, 6 of them cached
+        self.assertEqual(len(self.parser.requests), 7)
+        self.assertEqual(len(series), 20)
+        self.assertEqual(series.to_dates()[-1], self.today)
+        self.assertEqual(series.max(), (self.today -
+                                        datetime.timedelta(days=60), 2.6))
+        commands.graph_series(self.parser, 'USD', 60, self.today,
+                              max_points=20)
+        self.assertEqual(len(self.parser.requests), 7)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -14,9 +14,12 @@ from typing import Sequence, Mapping, Any, Tuple, TypeVar, Dict
 
 import bot.settings as settings
 
-from bot.adapters import cache_proxy, default_cache
+from bot import metrics
+
+from bot.adapters import cache_proxy, default_cache, rate_matrix
 from bot.exceptions import (
     BotArgumentParsingError,
+    BotBankUnavailableError,
     BotLoggedError,
     BotParserLookupError
 )
@@ -187,6 +190,22 @@ def get_parser_classes(active_only: bool=True):
     return parser_classes
 
 
+_parser_instances = {}
+
+
+def get_parsers(active_only: bool=True):
+    """Returns shared instances of parser classes, parsers
+    keep no state between requests"""
+    parsers = []
+    for parser_class in get_parser_classes(active_only=active_only):
+        parser = _parser_instances.get(parser_class)
+        if parser is None:
+            parser = parser_class(cache=default_cache)
+            _parser_instances[parser_class] = parser
+        parsers.append(parser)
+    return parsers
+
+
 def get_bank_names() -> Sequence[str]:
     """Get all available bank short and full names"""
     parser_classes = get_parser_classes()
@@ -255,6 +274,7 @@ def format_currency_string(cur: Currency) -> str:
     return s
 
 
+@metrics.ARGS_PARSE_SECONDS.time()
 def parse_args(bot, update, args) -> Mapping[str, Any]:
     try:
         preferences = preferences_from_args(args)
@@ -290,15 +310,28 @@ def is_image_cached(image_path: str, max_n: int=8) -> bool:
 
 
 def get_best_currencies(currency: str) -> Dict[str, Tuple[str, Any]]:
-    """Get best sell and buy rates for available banks"""
-    parser_classes = get_parser_classes()
-    parsers = [parser(cache=default_cache) for parser in parser_classes
-               if parser.short_name != 'nbrb']
-    results = [(p.name, cache_proxy.get_currency(p, currency))
-               for p in parsers]
-    results = list(filter(lambda x: not x[1].is_empty(), results))
-    best_sell = list(sorted(results, key=lambda x: x[1].sell))[0]
-    best_buy = list(sorted(results, key=lambda x: x[1].buy))[0]
+    """Get best sell and buy rates for available banks,
+    banks that are currently unavailable are skipped"""
+    today = datetime.date.today()
+    for p in get_parsers():
+        if p.short_name == 'nbrb' or not p.is_available():
+            continue
+        if currency.upper() not in p.allowed_currencies:
+            continue
+        # Matrix keeps rates in effect today, i.e. of the bank's
+        # last publication day, under today's date
+        if rate_matrix.is_fresh(p.short_name, currency, today,
+                                settings.RATE_MATRIX_MAX_AGE):
+            continue
+        # Fetched rates are put into the matrix by cache proxy
+        try:
+            cache_proxy.get_all_currencies(p, today)
+        except BotBankUnavailableError as e:
+            logger.warning(str(e))
+    best_buy = rate_matrix.lowest(currency, side='buy')
+    best_sell = rate_matrix.lowest(currency, side='sell')
+    if best_buy is None or best_sell is None:
+        raise BotLoggedError("No bank has rates for {}".format(currency))
 
     result = {
         "buy": best_buy,
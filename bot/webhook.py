@@ -0,0 +1,187 @@
+"""
+Webhook ingestion: a small local HTTP server receiving updates
+from Telegram, validating them and putting them into the dispatcher's
+update queue.
+"""
+
+import hmac
+import json
+import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Queue
+
+import telegram
+
+from bot import metrics
+from bot import settings
+
+logger = logging.getLogger('telegrambot')
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def set_webhook(bot, webhook_url: str, secret_token: str=None):
+    """
+    Registers webhook_url with Telegram, secret_token is sent back by
+    Telegram in the X-Telegram-Bot-Api-Secret-Token header. Bot.setWebhook
+    of python-telegram-bot 5.2 has no secret_token, so the API is called
+    directly.
+    """
+    data = {'url': webhook_url}
+    if secret_token is not None:
+        data['secret_token'] = secret_token
+    return bot._request.post('{}/setWebhook'.format(bot.base_url), data)
+
+
+def bind_socket(listen: str=settings.WEBHOOK_LISTEN,
+                port: int=settings.WEBHOOK_PORT,
+                backlog: int=128) -> socket.socket:
+    """Listening socket to be shared by several worker processes"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((listen, port))
+    sock.listen(backlog)
+    return sock
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server handling requests in a fixed size thread pool"""
+
+    def __init__(self, server_address, handler_cls, workers: int,
+                 sock: socket.socket=None) -> None:
+        super().__init__(server_address, handler_cls,
+                         bind_and_activate=sock is None)
+        if sock is not None:
+            # Listening socket inherited from the parent process
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_in_pool,
+                          request, client_address)
+
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server_version = 'BankBotWebhook/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook request: " + format % args)
+
+    def _respond(self, code: int, status: str, headers=None) -> None:
+        metrics.WEBHOOK_UPDATES.inc(status=status)
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._respond(405, 'method_not_allowed', {'Allow': 'POST'})
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path.split('?')[0] != webhook.url_path:
+            self._respond(404, 'not_found')
+            return
+
+        if webhook.secret_token is not None:
+            supplied = self.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(supplied, webhook.secret_token):
+                self._respond(403, 'forbidden')
+                return
+
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('application/json'):
+            self._respond(415, 'bad_content_type')
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._respond(411, 'length_required')
+            return
+        if length > MAX_BODY_SIZE:
+            self._respond(413, 'too_large')
+            return
+
+        if webhook.update_queue.qsize() >= webhook.max_queue_size:
+            # Telegram redelivers updates that were not accepted
+            self._respond(503, 'queue_full', {'Retry-After': '1'})
+            return
+
+        body = self.rfile.read(length)
+        try:
+            data = json.loads(body.decode('utf-8'))
+            if not isinstance(data.get('update_id'), int):
+                raise ValueError("update_id is missing")
+            update = telegram.Update.de_json(data, webhook.bot)
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            logger.warning("Rejected malformed update: {}".format(e))
+            self._respond(400, 'malformed')
+            return
+
+        webhook.update_queue.put(update)
+        metrics.UPDATE_QUEUE_DEPTH.set(webhook.update_queue.qsize())
+        self._respond(200, 'accepted')
+
+
+class WebhookServer(object):
+    """
+    Receives updates at http://listen:port/url_path and puts
+    them into the update queue. Updates are rejected with
+    503 status while the queue holds max_queue_size updates.
+    """
+
+    def __init__(self,
+                 update_queue: Queue,
+                 bot=None,
+                 listen: str=settings.WEBHOOK_LISTEN,
+                 port: int=settings.WEBHOOK_PORT,
+                 url_path: str=settings.WEBHOOK_PATH,
+                 secret_token: str=settings.WEBHOOK_SECRET,
+                 workers: int=settings.WEBHOOK_WORKERS,
+                 max_queue_size: int=settings.WEBHOOK_MAX_QUEUE_SIZE,
+                 sock: socket.socket=None) -> None:
+        self.update_queue = update_queue
+        self.bot = bot
+        self.url_path = '/' + url_path.lstrip('/')
+        self.secret_token = secret_token
+        self.max_queue_size = max_queue_size
+        self._httpd = PooledHTTPServer((listen, port), WebhookHandler,
+                                       workers=workers, sock=sock)
+        self._httpd.webhook = self
+        self._thread = None
+
+    @property
+    def server_address(self):
+        return self._httpd.server_address
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name='webhook_server', daemon=True)
+        self._thread.start()
+        logger.info("Listening for webhook updates on {}:{}{}".format(
+            self.server_address[0], self.server_address[1], self.url_path))
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
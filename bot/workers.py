@@ -0,0 +1,104 @@
+"""
+Multi-process mode: the parent process binds the webhook socket and
+forks worker processes, each running its own dispatcher and webhook
+server on the shared socket. Workers share the cache, so bank
+fetches are deduplicated with cache fetch locks.
+"""
+
+import logging
+import os
+import signal
+import time
+
+import telegram
+
+from bot import settings
+from bot.telegrambot import create_bot
+from bot.webhook import bind_socket, set_webhook
+
+logger = logging.getLogger('telegrambot')
+
+# Worker crashing sooner than that after start is not restarted
+MIN_WORKER_UPTIME = 5
+
+
+class WorkerPool(object):
+    """Forks and supervises worker processes"""
+
+    def __init__(self, api_token: str,
+                 processes: int=settings.BOT_PROCESSES,
+                 listen: str=settings.WEBHOOK_LISTEN,
+                 port: int=settings.WEBHOOK_PORT,
+                 webhook_url: str=settings.WEBHOOK_URL,
+                 secret_token: str=settings.WEBHOOK_SECRET) -> None:
+        self.api_token = api_token
+        self.processes = processes
+        self.listen = listen
+        self.port = port
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self._sock = None
+        self._workers = {}  # pid -> (index, started_at)
+        self._stopping = False
+
+    def run(self) -> None:
+        """Starts workers and waits until the pool is stopped"""
+        self._sock = bind_socket(self.listen, self.port)
+        if self.webhook_url:
+            # Registered once for all of the workers
+            set_webhook(telegram.Bot(self.api_token), self.webhook_url,
+                        self.secret_token)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._stop)
+        for index in range(self.processes):
+            self._spawn(index)
+        logger.info("Started {} workers on {}:{}".format(
+            self.processes, self.listen, self.port))
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index, started_at = self._workers.pop(pid, (None, None))
+            if index is None or self._stopping:
+                continue
+            logger.error("Worker {} (pid {}) exited with status {}".format(
+                index, pid, status))
+            if time.time() - started_at >= MIN_WORKER_UPTIME:
+                self._spawn(index)
+        self._sock.close()
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = (index, time.time())
+            return
+        code = 0
+        try:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, signal.SIG_DFL)
+            self._run_worker(index)
+        except Exception:
+            logger.exception("Worker {} failed".format(index))
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _run_worker(self, index: int) -> None:
+        # Dispatcher threads are created after fork only
+        bot = create_bot(self.api_token)
+        if settings.METRICS_PORT:
+            bot.start_metrics_server(port=settings.METRICS_PORT + index)
+        bot.start_webhook(webhook_url=None, sock=self._sock)
+        logger.info("Worker {} started, pid {}".format(index, os.getpid()))
+        bot.idle()
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -1,9 +1,12 @@
 import os
 
+from bot.adapters import default_cache
+from bot.cache.snapshot import export_snapshot, load_snapshot
 from bot.telegrambot import (
     create_bot,
     settings
 )
+from bot.workers import WorkerPool
 
 api_token = os.environ.get(settings.API_ENV_NAME, '')
 
@@ -11,6 +14,24 @@ if not api_token:
     raise ValueError("No API token specified.")
 
 if __name__ == '__main__':
-    updater = create_bot(api_token)
-    updater.start_polling()
-    updater.idle()
+    if settings.CACHE_SNAPSHOT_FILE:
+        load_snapshot(default_cache.cache, settings.CACHE_SNAPSHOT_FILE)
+    if settings.BOT_PROCESSES > 1:
+        if settings.BOT_MODE != 'webhook':
+            raise ValueError("Several processes can only run in webhook mode.")
+        if settings.CACHE_BACKEND != 'redis':
+            # Locks, subscriptions and alerts must be seen by all workers
+            raise ValueError("Several processes need a shared redis cache, "
+                             "set TELEGRAM_REDIS_HOST.")
+        WorkerPool(api_token, processes=settings.BOT_PROCESSES).run()
+    else:
+        updater = create_bot(api_token)
+        if settings.METRICS_PORT:
+            updater.start_metrics_server()
+        if settings.BOT_MODE == 'webhook':
+            updater.start_webhook()
+        else:
+            updater.start_polling()
+        updater.idle()
+    if settings.CACHE_SNAPSHOT_FILE:
+        export_snapshot(default_cache.cache, settings.CACHE_SNAPSHOT_FILE)